@@ -1,4 +1,7 @@
 import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -8,10 +11,12 @@ from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
 from .database import get_db
+from .cache import TTLCache
+from .metrics import PASSWORD_HASH_TIME, PASSWORD_HASH_WAIT
 
 
 # Configuration
@@ -22,8 +27,22 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 30  # 30 days
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Users resolved by get_current_user, keyed by token subject (email).
+# Other workers only see a change once the ttl runs out, so keep it short.
+user_cache = TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('USER_CACHE_TTL', '60')),
+)
+
+
+# Stored for users created by a bulk import, which have not chosen a password yet.
+# It is not a valid bcrypt hash, so nothing verifies against it.
+UNUSABLE_PASSWORD = '!'
+
 
 def verify_password(plain_password, hashed_password):
+    if hashed_password == UNUSABLE_PASSWORD:
+        return False
     return pwd_context.verify(plain_password, hashed_password)
 
 
@@ -31,6 +50,85 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+# bcrypt takes ~250ms of CPU per call and releases the GIL, so it runs in a bounded
+# thread pool instead of on the event loop. Half the cores by default, leaving room
+# for the event loop to keep serving other requests during a login burst.
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+# Hashing requests allowed in flight (running + queued) before new ones are rejected with a 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '64'))
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='bcrypt')
+_hash_stats = {
+    "in_flight": 0,
+    "completed": 0,
+    "rejected": 0,
+    "hash_time_total": 0.0,
+    "hash_time_max": 0.0,
+    "queue_wait_total": 0.0,
+    "queue_wait_max": 0.0,
+}
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, started, time.perf_counter() - started
+
+
+async def _run_in_hash_pool(fn, *args):
+    if _hash_stats["in_flight"] >= PASSWORD_HASH_MAX_PENDING:
+        _hash_stats["rejected"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, please try again shortly",
+            headers={"Retry-After": "1"},
+        )
+
+    _hash_stats["in_flight"] += 1
+    submitted = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        result, started, duration = await loop.run_in_executor(_hash_executor, _timed, fn, *args)
+    finally:
+        _hash_stats["in_flight"] -= 1
+
+    waited = started - submitted
+    _hash_stats["completed"] += 1
+    _hash_stats["hash_time_total"] += duration
+    _hash_stats["hash_time_max"] = max(_hash_stats["hash_time_max"], duration)
+    _hash_stats["queue_wait_total"] += waited
+    _hash_stats["queue_wait_max"] = max(_hash_stats["queue_wait_max"], waited)
+    PASSWORD_HASH_TIME.observe(duration)
+    PASSWORD_HASH_WAIT.observe(waited)
+    return result
+
+
+async def check_password(plain_password, hashed_password):
+    """verify_password, run in the bcrypt worker pool."""
+    return await _run_in_hash_pool(verify_password, plain_password, hashed_password)
+
+
+async def hash_password(password):
+    """get_password_hash, run in the bcrypt worker pool."""
+    return await _run_in_hash_pool(get_password_hash, password)
+
+
+def password_hashing_status() -> dict:
+    completed = _hash_stats["completed"]
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "in_flight": _hash_stats["in_flight"],
+        "queue_depth": max(_hash_stats["in_flight"] - PASSWORD_HASH_WORKERS, 0),
+        "completed": completed,
+        "rejected": _hash_stats["rejected"],
+        "hash_time_avg_ms": round(1000 * _hash_stats["hash_time_total"] / completed, 3) if completed else 0.0,
+        "hash_time_max_ms": round(1000 * _hash_stats["hash_time_max"], 3),
+        "queue_wait_avg_ms": round(1000 * _hash_stats["queue_wait_total"] / completed, 3) if completed else 0.0,
+        "queue_wait_max_ms": round(1000 * _hash_stats["queue_wait_max"], 3),
+    }
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -42,7 +140,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -56,11 +154,21 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    result = db.execute(
-        text("SELECT * FROM users WHERE email = :email"),
+    result = user_cache.get(email)
+    if result is not None:
+        return result
+
+    result = (await db.execute(
+        text("SELECT id, email, is_verified FROM users WHERE email = :email"),
         {"email": email}
-    ).fetchone()
+    )).fetchone()
     
     if result is None:
         raise credentials_exception
+    user_cache.set(email, result)
     return result
+
+
+def invalidate_user(email: str) -> None:
+    """Drop a cached user record, call this whenever a users row is changed."""
+    user_cache.pop(email)
@@ -0,0 +1,134 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Small in-process LRU cache whose entries expire after `ttl` seconds.
+
+    Each API worker has its own copy, so keep the ttl short for anything that
+    can change in the database behind our back.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class ReloadingIndex:
+    """A whole table held in memory as a dict, so lookups need no queries.
+
+    Subclasses implement load(), which returns the complete mapping. The index is
+    reloaded once it is older than `ttl` seconds. An unknown key triggers at most one
+    reload per `miss_reload` seconds and is then remembered for `negative_ttl` seconds,
+    so requests for keys that don't exist never turn into one query each.
+    """
+
+    def __init__(self, ttl: float, miss_reload: float, negative_ttl: float = None, negative_cache_size: int = 10000):
+        self.ttl = ttl
+        self.miss_reload = miss_reload
+        self._entries = {}
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._unknown = TTLCache(maxsize=negative_cache_size, ttl=miss_reload if negative_ttl is None else negative_ttl)
+        self.stats = {
+            "lookups": 0,
+            "misses": 0,
+            "reloads": 0,
+            "last_reload_ms": 0.0,
+        }
+
+    async def load(self) -> dict:
+        raise NotImplementedError
+
+    async def reload(self, max_age: float = 0.0) -> None:
+        """Load the index, unless it is younger than max_age (someone else just reloaded it)."""
+        async with self._lock:
+            if time.monotonic() - self._loaded_at < max_age:
+                return
+            start = time.perf_counter()
+            size = len(self._entries)
+            self._entries = await self.load()
+            if len(self._entries) != size:
+                # Some remembered unknown keys may exist now
+                self._unknown.clear()
+            self._loaded_at = time.monotonic()
+            self.stats["reloads"] += 1
+            self.stats["last_reload_ms"] = round(1000 * (time.perf_counter() - start), 3)
+
+    async def get(self, key):
+        self.stats["lookups"] += 1
+        if time.monotonic() - self._loaded_at > self.ttl:
+            await self.reload(max_age=self.ttl)
+        value = self._entries.get(key)
+        if value is None and self._unknown.get(key) is None:
+            # Possibly added since the last load
+            self._unknown.set(key, True)
+            await self.reload(max_age=self.miss_reload)
+            value = self._entries.get(key)
+        if value is None:
+            self.stats["misses"] += 1
+        return value
+
+    def expire(self) -> None:
+        """Reload on the next lookup, e.g. after the table was changed."""
+        self._loaded_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def status(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "negative_cache": len(self._unknown),
+            **self.stats,
+        }
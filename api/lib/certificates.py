@@ -0,0 +1,307 @@
+import io
+import os
+import json
+import time
+import asyncio
+import hashlib
+import tempfile
+import datetime as dt
+from typing import NamedTuple
+
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.pdfgen import canvas
+from sqlalchemy import text
+
+from .database import AsyncSessionLocal
+from .cache import ReloadingIndex
+from .storage import write_once
+from .worker import BackgroundWorker, ProcessPoolWorker
+
+
+CERT_INDEX_REFRESH_INTERVAL = float(os.getenv('CERT_INDEX_REFRESH_INTERVAL', '60'))  # seconds between incremental refreshes
+CERT_INDEX_FULL_RELOAD = float(os.getenv('CERT_INDEX_FULL_RELOAD', '3600'))  # full reloads pick up deleted certificates
+CERT_INDEX_MISS_RELOAD = float(os.getenv('CERT_INDEX_MISS_RELOAD', '5'))  # refresh at most this often because of unknown tokens
+# Rows are picked up by created_at, which is the start of the inserting transaction.
+# Re-reading this far back catches transactions that committed after the previous refresh.
+CERT_INDEX_OVERLAP = dt.timedelta(seconds=float(os.getenv('CERT_INDEX_OVERLAP', '300')))
+CERT_NEGATIVE_CACHE_SIZE = int(os.getenv('CERT_NEGATIVE_CACHE_SIZE', '100000'))
+
+# Issuance
+CERT_ISSUER_ENABLED = os.getenv('CERT_ISSUER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CERT_ISSUE_INTERVAL = float(os.getenv('CERT_ISSUE_INTERVAL', '300'))
+# Completions are picked up by completed_at, re-read this far back for the same reason as CERT_INDEX_OVERLAP
+CERT_ISSUE_OVERLAP = dt.timedelta(seconds=float(os.getenv('CERT_ISSUE_OVERLAP', '300')))
+CERT_PDF_WORKERS = int(os.getenv('CERT_PDF_WORKERS', '2'))  # processes, rendering is CPU bound
+CERT_PDF_DIR = os.getenv('CERT_PDF_DIR', os.path.join(tempfile.gettempdir(), 'certificates'))
+CERT_PDF_TEMPLATE_VERSION = '1'  # bump when render_certificate_pdf changes, so cached PDFs are re-rendered
+
+
+class CertificateEntry(NamedTuple):
+    course_name: str
+    course_version: int
+    issued_at: dt.datetime
+    valid_until: dt.date
+
+
+class CertificateIndex(ReloadingIndex, BackgroundWorker):
+    """access_token -> certificate for the public verification endpoint.
+
+    Refreshed incrementally in the background and on notify() when certificates
+    are issued, with a full reload every CERT_INDEX_FULL_RELOAD seconds.
+    """
+
+    name = "Certificate index"
+
+    def __init__(self):
+        ReloadingIndex.__init__(
+            self,
+            ttl=CERT_INDEX_REFRESH_INTERVAL,
+            miss_reload=CERT_INDEX_MISS_RELOAD,
+            negative_ttl=CERT_INDEX_REFRESH_INTERVAL,
+            negative_cache_size=CERT_NEGATIVE_CACHE_SIZE
+        )
+        BackgroundWorker.__init__(self, interval=CERT_INDEX_REFRESH_INTERVAL)
+        self._high_water = None  # newest created_at loaded so far
+        self._full_reload_at = 0.0
+
+    async def run_once(self) -> bool:
+        await self.reload()
+        return False
+
+    async def load(self) -> dict:
+        """Certificates issued since the last load added to the index, or all of them when a full reload is due."""
+        full = self._high_water is None or time.monotonic() - self._full_reload_at > CERT_INDEX_FULL_RELOAD
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                text("""
+                    SELECT c.access_token, c.created_at, c.valid_until, co.name AS course_name, co.version AS course_version
+                    FROM certificates c
+                    JOIN courses co ON co.id = c.course_id
+                    WHERE CAST(:since AS timestamptz) IS NULL OR c.created_at >= CAST(:since AS timestamptz)
+                """),
+                {"since": None if full else self._high_water - CERT_INDEX_OVERLAP}
+            )).fetchall()
+
+        # Incremental loads update the live dict in place rather than copying every entry
+        entries = {} if full else self._entries
+        for row in rows:
+            entries[str(row.access_token)] = CertificateEntry(row.course_name, row.course_version, row.created_at, row.valid_until)
+            if self._high_water is None or row.created_at > self._high_water:
+                self._high_water = row.created_at
+        if full:
+            self._full_reload_at = time.monotonic()
+            if self._high_water is None:
+                # No certificates yet, start incremental refreshes from now
+                self._high_water = dt.datetime.now(dt.timezone.utc)
+        return entries
+
+
+class CertificateFields(NamedTuple):
+    """Everything printed on a certificate, and so everything its cached PDF depends on."""
+    access_token: str
+    email: str
+    course_name: str
+    course_version: int
+    issued_on: str
+    valid_until: str
+
+
+def certificate_pdf_path(fields: CertificateFields) -> str:
+    """Content-addressed location of the PDF for these fields."""
+    key = hashlib.sha256(json.dumps([CERT_PDF_TEMPLATE_VERSION, *fields]).encode('utf-8')).hexdigest()
+    return os.path.join(CERT_PDF_DIR, key[:2], f"{key}.pdf")
+
+
+def render_certificate_pdf(fields: CertificateFields) -> str:
+    """Runs in a worker process. Renders the PDF unless it is cached and returns its path."""
+    path = certificate_pdf_path(fields)
+    if os.path.exists(path):
+        return path
+
+    buffer = io.BytesIO()
+    width, height = landscape(A4)
+    # invariant drops the creation timestamp, so identical fields give identical bytes
+    pdf = canvas.Canvas(buffer, pagesize=(width, height), invariant=1)
+    pdf.setTitle(f"Certificate {fields.course_name}")
+    pdf.setFont("Helvetica-Bold", 32)
+    pdf.drawCentredString(width / 2, height - 150, "Certificate of Completion")
+    pdf.setFont("Helvetica", 16)
+    pdf.drawCentredString(width / 2, height - 210, "This certifies that")
+    pdf.setFont("Helvetica-Bold", 20)
+    pdf.drawCentredString(width / 2, height - 245, fields.email)
+    pdf.setFont("Helvetica", 16)
+    pdf.drawCentredString(width / 2, height - 280, "has completed the course")
+    pdf.setFont("Helvetica-Bold", 22)
+    pdf.drawCentredString(width / 2, height - 315, f"{fields.course_name} (version {fields.course_version})")
+    pdf.setFont("Helvetica", 12)
+    pdf.drawCentredString(width / 2, 130, f"Issued on {fields.issued_on}, valid until {fields.valid_until}")
+    pdf.drawCentredString(width / 2, 110, f"Verification code {fields.access_token}")
+    pdf.showPage()
+    pdf.save()
+
+    write_once(path, buffer.getvalue())
+    return path
+
+
+class CertificateIssuer(ProcessPoolWorker):
+    """Issues certificates for every student who completed all questions of a course.
+
+    One job finds the newly completed (student, course) pairs with a single
+    set-based query, inserts their certificates in the same statement and then
+    renders the PDFs in a process pool. An advisory lock keeps API workers from
+    running it at the same time. After the first run only the (student, course)
+    pairs with an assignment completed since the previous run are checked.
+    """
+
+    name = "Certificate issuer"
+
+    def __init__(self):
+        super().__init__(interval=CERT_ISSUE_INTERVAL, processes=CERT_PDF_WORKERS)
+        self.stats = {
+            "runs": 0,
+            "issued": 0,
+            "pdfs_rendered": 0,
+            "last_run_ms": 0.0,
+        }
+        # Completion time checked from, None until the first run which checks all assignments
+        self._checked_since = None
+
+    async def run_once(self) -> bool:
+        await self.issue()
+        return False
+
+    async def issue(self) -> int:
+        start = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            lock = (await db.execute(
+                text("SELECT pg_try_advisory_xact_lock(hashtext('issue_certificates')) AS locked, now() AS started_at")
+            )).one()
+            if not lock.locked:
+                await db.commit()
+                return 0
+
+            recent = "" if self._checked_since is None else "WHERE a.completed_at >= :since"
+            rows = (await db.execute(
+                text(f"""
+                    WITH candidates AS (
+                        SELECT DISTINCT a.student_id, m.course_id
+                        FROM assignments a
+                        JOIN questions_mc q ON q.id = a.question_mc_id
+                        JOIN module_pages p ON p.id = q.module_page_id
+                        JOIN modules m ON m.id = p.module_id
+                        {recent}
+                    ),
+                    course_questions AS (
+                        SELECT m.course_id, COUNT(*) AS questions
+                        FROM questions_mc q
+                        JOIN module_pages p ON p.id = q.module_page_id
+                        JOIN modules m ON m.id = p.module_id
+                        WHERE m.course_id IN (SELECT course_id FROM candidates)
+                        GROUP BY m.course_id
+                    ),
+                    -- Only the latest assignment of a question counts, a re-assigned
+                    -- question has to be answered again
+                    latest AS (
+                        SELECT DISTINCT ON (a.student_id, a.question_mc_id)
+                            a.student_id,
+                            a.question_mc_id,
+                            m.course_id,
+                            a.status,
+                            a.created_at
+                        FROM candidates c
+                        JOIN assignments a ON a.student_id = c.student_id
+                        JOIN questions_mc q ON q.id = a.question_mc_id
+                        JOIN module_pages p ON p.id = q.module_page_id
+                        JOIN modules m ON m.id = p.module_id AND m.course_id = c.course_id
+                        ORDER BY a.student_id, a.question_mc_id, a.created_at DESC, a.id DESC
+                    ),
+                    completed AS (
+                        SELECT
+                            l.student_id,
+                            l.course_id,
+                            COUNT(*) AS questions,
+                            MAX(l.created_at) AS last_assigned_at
+                        FROM latest l
+                        GROUP BY l.student_id, l.course_id
+                        HAVING bool_and(l.status = 'completed')
+                    ),
+                    issued AS (
+                        INSERT INTO certificates (student_id, course_id, access_token, valid_until)
+                        SELECT
+                            c.student_id,
+                            c.course_id,
+                            uuid_generate_v4(),
+                            CAST(CURRENT_DATE + co.certificate_valid_duration AS date)
+                        FROM completed c
+                        JOIN course_questions cq ON cq.course_id = c.course_id AND cq.questions = c.questions
+                        JOIN courses co ON co.id = c.course_id
+                        -- Once per completion, a student who retakes the course gets newer assignments
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM certificates ce
+                            WHERE ce.student_id = c.student_id
+                            AND ce.course_id = c.course_id
+                            AND ce.created_at >= c.last_assigned_at
+                        )
+                        RETURNING student_id, course_id, access_token, valid_until, created_at
+                    )
+                    SELECT
+                        i.access_token,
+                        i.valid_until,
+                        i.created_at,
+                        u.email,
+                        co.name AS course_name,
+                        co.version AS course_version
+                    FROM issued i
+                    JOIN students s ON s.id = i.student_id
+                    JOIN users u ON u.id = s.user_id
+                    JOIN courses co ON co.id = i.course_id
+                """),
+                {"since": self._checked_since} if self._checked_since is not None else {}
+            )).fetchall()
+            await db.commit()
+        self._checked_since = lock.started_at - CERT_ISSUE_OVERLAP
+
+        if rows:
+            certificate_index.notify()
+            await self.render_all([
+                CertificateFields(
+                    str(row.access_token),
+                    row.email,
+                    row.course_name,
+                    row.course_version,
+                    row.created_at.date().isoformat(),
+                    row.valid_until.isoformat()
+                )
+                for row in rows
+            ])
+
+        self.stats["runs"] += 1
+        self.stats["issued"] += len(rows)
+        self.stats["last_run_ms"] = round(1000 * (time.perf_counter() - start), 3)
+        return len(rows)
+
+    async def render_all(self, certificates: list) -> list:
+        """Render PDFs in the process pool, returns their paths."""
+        paths = await asyncio.gather(*(
+            self.run_in_pool(render_certificate_pdf, fields)
+            for fields in certificates
+        ))
+        self.stats["pdfs_rendered"] += len(paths)
+        return paths
+
+    async def pdf(self, fields: CertificateFields) -> str:
+        """Path of the certificate's PDF, rendered now if it isn't cached yet."""
+        path = certificate_pdf_path(fields)
+        if os.path.exists(path):
+            return path
+        return (await self.render_all([fields]))[0]
+
+    def status(self) -> dict:
+        return {
+            "enabled": CERT_ISSUER_ENABLED,
+            **self.stats,
+        }
+
+
+certificate_index = CertificateIndex()
+certificate_issuer = CertificateIssuer()
@@ -0,0 +1,278 @@
+import os
+import json
+import asyncio
+import hashlib
+import tempfile
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+from sqlalchemy import text
+
+from .database import AsyncSessionLocal
+from .cache import TTLCache
+from .rendering import rendered_fields, RENDERER_VERSION
+from .storage import write_atomic
+
+
+# Snapshots are written here so a restarted worker doesn't have to rebuild them
+CONTENT_CACHE_DIR = os.getenv('CONTENT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'course-content'))
+CONTENT_CACHE_SIZE = int(os.getenv('CONTENT_CACHE_SIZE', '256'))  # snapshots kept in memory per worker
+# A course version never changes once published, entries only leave the cache when it is full
+CONTENT_CACHE_TTL = 365 * 24 * 3600
+# Bump when the snapshot layout changes, 2 added the *_html fields
+SNAPSHOT_FORMAT = 2
+
+
+class Snapshot(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest() + '"'
+
+
+def _snapshot_path(course_id: int) -> str:
+    # Files from an older layout or renderer are never read again, the content is rebuilt
+    return os.path.join(CONTENT_CACHE_DIR, f"course-{course_id}.v{SNAPSHOT_FORMAT}.r{RENDERER_VERSION}.json")
+
+
+async def build_course_snapshot(course_id: int) -> Optional[dict]:
+    """Walk a course version down to its answer options in a handful of queries.
+
+    Markdown fields come with their rendered html. Correctness and feedback are
+    left out, those are only revealed when an answer is submitted.
+    """
+    async with AsyncSessionLocal() as db:
+        course = (await db.execute(
+            text("""
+                SELECT id, name, version, description, credit_cost, certificate_valid_duration
+                FROM courses
+                WHERE id = :course_id
+            """),
+            {"course_id": course_id}
+        )).fetchone()
+        if not course:
+            return None
+
+        modules = (await db.execute(
+            text("""
+                SELECT id, name, version, description, sequence_number
+                FROM modules
+                WHERE course_id = :course_id
+                ORDER BY sequence_number, id
+            """),
+            {"course_id": course_id}
+        )).fetchall()
+
+        pages = (await db.execute(
+            text("""
+                SELECT p.id, p.module_id, p.name, p.version, p.description, p.sequence_number
+                FROM module_pages p
+                JOIN modules m ON m.id = p.module_id
+                WHERE m.course_id = :course_id
+                ORDER BY p.sequence_number, p.id
+            """),
+            {"course_id": course_id}
+        )).fetchall()
+
+        questions = (await db.execute(
+            text("""
+                SELECT q.id, q.module_page_id, q.context, q.question
+                FROM questions_mc q
+                JOIN module_pages p ON p.id = q.module_page_id
+                JOIN modules m ON m.id = p.module_id
+                WHERE m.course_id = :course_id
+                ORDER BY q.id
+            """),
+            {"course_id": course_id}
+        )).fetchall()
+
+        options = (await db.execute(
+            text("""
+                SELECT o.id, o.question_mc_id, o.option_text
+                FROM answer_options o
+                JOIN questions_mc q ON q.id = o.question_mc_id
+                JOIN module_pages p ON p.id = q.module_page_id
+                JOIN modules m ON m.id = p.module_id
+                WHERE m.course_id = :course_id
+                ORDER BY o.id
+            """),
+            {"course_id": course_id}
+        )).fetchall()
+
+        media = (await db.execute(
+            text("""
+                SELECT 'course' AS owner, cm.course_id AS owner_id, md.id, md.alt_text, md.path
+                FROM course_media cm
+                JOIN media md ON md.id = cm.media_id
+                WHERE cm.course_id = :course_id
+                UNION ALL
+                SELECT 'module', mm.module_id, md.id, md.alt_text, md.path
+                FROM module_media mm
+                JOIN modules m ON m.id = mm.module_id
+                JOIN media md ON md.id = mm.media_id
+                WHERE m.course_id = :course_id
+                UNION ALL
+                SELECT 'page', pm.module_page_id, md.id, md.alt_text, md.path
+                FROM module_page_media pm
+                JOIN module_pages p ON p.id = pm.module_page_id
+                JOIN modules m ON m.id = p.module_id
+                JOIN media md ON md.id = pm.media_id
+                WHERE m.course_id = :course_id
+                UNION ALL
+                SELECT 'question', qm.questions_mc_id, md.id, md.alt_text, md.path
+                FROM questions_mc_media qm
+                JOIN questions_mc q ON q.id = qm.questions_mc_id
+                JOIN module_pages p ON p.id = q.module_page_id
+                JOIN modules m ON m.id = p.module_id
+                JOIN media md ON md.id = qm.media_id
+                WHERE m.course_id = :course_id
+                ORDER BY 1, 2, 3
+            """),
+            {"course_id": course_id}
+        )).fetchall()
+
+        html = await rendered_fields(db, {
+            ("courses", course.id, "description"): course.description,
+            **{("modules", m.id, "description"): m.description for m in modules},
+            **{("module_pages", p.id, "description"): p.description for p in pages},
+            **{("questions_mc", q.id, "context"): q.context for q in questions},
+        })
+        await db.commit()
+
+    media_by_owner = defaultdict(list)
+    for m in media:
+        media_by_owner[(m.owner, m.owner_id)].append({
+            "id": m.id,
+            "alt_text": m.alt_text,
+            "path": m.path
+        })
+
+    options_by_question = defaultdict(list)
+    for o in options:
+        options_by_question[o.question_mc_id].append({
+            "id": o.id,
+            "text": o.option_text
+        })
+
+    questions_by_page = defaultdict(list)
+    for q in questions:
+        questions_by_page[q.module_page_id].append({
+            "id": q.id,
+            "context": q.context,
+            "context_html": html[("questions_mc", q.id, "context")],
+            "question": q.question,
+            "media": media_by_owner[("question", q.id)],
+            "answer_options": options_by_question[q.id]
+        })
+
+    pages_by_module = defaultdict(list)
+    for p in pages:
+        pages_by_module[p.module_id].append({
+            "id": p.id,
+            "name": p.name,
+            "version": p.version,
+            "description": p.description,
+            "description_html": html[("module_pages", p.id, "description")],
+            "sequence_number": p.sequence_number,
+            "media": media_by_owner[("page", p.id)],
+            "questions": questions_by_page[p.id]
+        })
+
+    return {
+        "id": course.id,
+        "name": course.name,
+        "version": course.version,
+        "description": course.description,
+        "description_html": html[("courses", course.id, "description")],
+        "credit_cost": course.credit_cost,
+        "certificate_valid_days": course.certificate_valid_duration.days,
+        "media": media_by_owner[("course", course.id)],
+        "modules": [
+            {
+                "id": m.id,
+                "name": m.name,
+                "version": m.version,
+                "description": m.description,
+                "description_html": html[("modules", m.id, "description")],
+                "sequence_number": m.sequence_number,
+                "media": media_by_owner[("module", m.id)],
+                "pages": pages_by_module[m.id]
+            }
+            for m in modules
+        ]
+    }
+
+
+def _read_snapshot(course_id: int) -> Optional[bytes]:
+    try:
+        with open(_snapshot_path(course_id), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_snapshot(course_id: int, body: bytes) -> None:
+    write_atomic(_snapshot_path(course_id), body)
+
+
+class ContentSnapshots:
+    """Serialized course snapshots, kept in memory with a copy on disk.
+
+    Course versions are immutable (UNIQUE(name, version)), so once a snapshot is
+    built it is served until the process restarts, and from disk after that.
+    A new version of the content is a new course id and gets its own snapshot.
+    """
+
+    def __init__(self):
+        self._memory = TTLCache(maxsize=CONTENT_CACHE_SIZE, ttl=CONTENT_CACHE_TTL)
+        self._locks = defaultdict(asyncio.Lock)
+        self.builds = 0
+
+    async def get(self, course_id: int) -> Optional[Snapshot]:
+        snapshot = self._memory.get(course_id)
+        if snapshot is not None:
+            return snapshot
+
+        # Only one request per worker builds a missing snapshot, the others wait for it
+        lock = self._locks[course_id]
+        try:
+            async with lock:
+                snapshot = self._memory.get(course_id)
+                if snapshot is not None:
+                    return snapshot
+
+                body = await asyncio.to_thread(_read_snapshot, course_id)
+                if body is None:
+                    content = await build_course_snapshot(course_id)
+                    if content is None:
+                        return None
+                    body = json.dumps(content, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+                    await asyncio.to_thread(_write_snapshot, course_id, body)
+                    self.builds += 1
+
+                snapshot = Snapshot(body, _etag(body))
+                self._memory.set(course_id, snapshot)
+                return snapshot
+        finally:
+            if not lock.locked():
+                self._locks.pop(course_id, None)
+
+    def invalidate(self, course_id: int) -> None:
+        """Drop a snapshot, only needed when published content was edited in place."""
+        self._memory.pop(course_id)
+        try:
+            os.unlink(_snapshot_path(course_id))
+        except FileNotFoundError:
+            pass
+
+    def status(self) -> dict:
+        return {
+            **self._memory.stats(),
+            "builds": self.builds,
+            "cache_dir": CONTENT_CACHE_DIR,
+        }
+
+
+content_snapshots = ContentSnapshots()
@@ -0,0 +1,49 @@
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class InsufficientCredits(Exception):
+    pass
+
+
+async def deduct_credits(db: AsyncSession, user_id: int, amount: int, reference: str) -> int:
+    """Deduct credits by adding a negative row to the credits ledger and return the new balance.
+
+    The after_credit_insert trigger applies the row to credit_balances under a row lock, so
+    concurrent deductions can't overdraw the balance. Raises InsufficientCredits when the
+    balance is too low, after which the transaction must be rolled back. Does not commit.
+    """
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+
+    try:
+        await db.execute(
+            text("""
+                INSERT INTO credits (user_id, amount, stripe_payment_id)
+                VALUES (:user_id, :amount, :reference)
+            """),
+            {
+                "user_id": user_id,
+                "amount": -amount,
+                "reference": reference
+            }
+        )
+    except IntegrityError as e:
+        if "credit_balances_no_overdraft" in str(e):
+            raise InsufficientCredits(f"Not enough credits available, {amount} required")
+        raise
+
+    return (await db.execute(
+        text("SELECT balance FROM credit_balances WHERE user_id = :user_id"),
+        {"user_id": user_id}
+    )).scalar_one()
+
+
+async def credit_balance(db: AsyncSession, user_id: int) -> int:
+    """Current balance, 0 for users who never had a credit transaction."""
+    balance = (await db.execute(
+        text("SELECT balance FROM credit_balances WHERE user_id = :user_id"),
+        {"user_id": user_id}
+    )).scalar()
+    return balance or 0
@@ -0,0 +1,170 @@
+import os
+import time
+from collections import defaultdict
+
+from sqlalchemy import text
+
+from .database import AsyncSessionLocal
+from .mail import mail_sender, FRONTEND_URL
+from .worker import BackgroundWorker
+
+
+DELIVERY_WORKER_ENABLED = os.getenv('DELIVERY_WORKER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+DELIVERY_BATCH_SIZE = int(os.getenv('DELIVERY_BATCH_SIZE', '1000'))
+DELIVERY_POLL_INTERVAL = float(os.getenv('DELIVERY_POLL_INTERVAL', '30'))
+
+
+def render_assignment_email(questions) -> tuple:
+    """Subject and body of the email that sends a student their due questions."""
+    subject = "You have a new question waiting" if len(questions) == 1 else f"You have {len(questions)} new questions waiting"
+    links = "\n".join(
+        f"- {q.module_name}: {q.question}\n  {FRONTEND_URL}/assignment?token={q.access_token}\n  (open until {q.expiration_date.isoformat()})"
+        for q in questions
+    )
+    body = f"""
+Hello,
+
+The following questions are ready for you on the Course Platform:
+
+{links}
+
+Each link is personal, please don't forward this email.
+"""
+    return subject, body
+
+
+class AssignmentDelivery(BackgroundWorker):
+    """Moves due assignments from pending to sent and queues their emails in the outbox.
+
+    Batches are claimed with FOR UPDATE SKIP LOCKED, so any number of API workers can
+    run this side by side without sending an assignment twice. Marking the rows sent
+    and queueing the emails happens in one transaction.
+    """
+
+    name = "Assignment delivery"
+
+    def __init__(self):
+        super().__init__(interval=DELIVERY_POLL_INTERVAL)
+        self.stats = {
+            "batches": 0,
+            "assignments_sent": 0,
+            "emails_queued": 0,
+            "busy_time_total": 0.0,
+            "last_batch_ms": 0.0,
+            "last_batch_rows_per_second": 0.0,
+            "backlog": None,
+        }
+
+    async def run_once(self) -> bool:
+        claimed = await self.process_batch()
+        if claimed >= DELIVERY_BATCH_SIZE:
+            return True
+        await self.update_backlog()
+        return False
+
+    async def process_batch(self) -> int:
+        start = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                text("""
+                    WITH due AS (
+                        SELECT id FROM assignments
+                        WHERE status = 'pending' AND test_date <= CURRENT_DATE
+                        ORDER BY test_date, id
+                        LIMIT :batch_size
+                        FOR UPDATE SKIP LOCKED
+                    ),
+                    sent AS (
+                        UPDATE assignments a
+                        SET status = 'sent'
+                        FROM due
+                        WHERE a.id = due.id
+                        RETURNING a.id, a.student_id, a.question_mc_id, a.access_token, a.expiration_date
+                    )
+                    SELECT
+                        sent.id,
+                        sent.student_id,
+                        sent.access_token,
+                        sent.expiration_date,
+                        u.email,
+                        q.question,
+                        m.name AS module_name
+                    FROM sent
+                    JOIN students s ON s.id = sent.student_id
+                    JOIN users u ON u.id = s.user_id
+                    JOIN questions_mc q ON q.id = sent.question_mc_id
+                    JOIN module_pages p ON p.id = q.module_page_id
+                    JOIN modules m ON m.id = p.module_id
+                    ORDER BY sent.student_id, m.sequence_number, p.sequence_number, sent.id
+                """),
+                {"batch_size": DELIVERY_BATCH_SIZE}
+            )).fetchall()
+
+            if not rows:
+                await db.commit()
+                return 0
+
+            # One email per student for everything that became due in this batch
+            by_email = defaultdict(list)
+            for row in rows:
+                by_email[row.email].append(row)
+
+            addresses, subjects, bodies = [], [], []
+            for email, questions in by_email.items():
+                subject, body = render_assignment_email(questions)
+                addresses.append(email)
+                subjects.append(subject)
+                bodies.append(body)
+
+            await db.execute(
+                text("""
+                    INSERT INTO email_outbox (to_address, subject, body)
+                    SELECT * FROM unnest(
+                        CAST(:addresses AS text[]),
+                        CAST(:subjects AS text[]),
+                        CAST(:bodies AS text[])
+                    )
+                """),
+                {
+                    "addresses": addresses,
+                    "subjects": subjects,
+                    "bodies": bodies
+                }
+            )
+            await db.commit()
+
+        mail_sender.notify()
+
+        duration = time.perf_counter() - start
+        self.stats["batches"] += 1
+        self.stats["assignments_sent"] += len(rows)
+        self.stats["emails_queued"] += len(addresses)
+        self.stats["busy_time_total"] += duration
+        self.stats["last_batch_ms"] = round(1000 * duration, 3)
+        self.stats["last_batch_rows_per_second"] = round(len(rows) / duration, 1) if duration else 0.0
+        return len(rows)
+
+    async def update_backlog(self) -> None:
+        async with AsyncSessionLocal() as db:
+            self.stats["backlog"] = (await db.execute(
+                text("""
+                    SELECT COUNT(*) FROM assignments
+                    WHERE status = 'pending' AND test_date <= CURRENT_DATE
+                """)
+            )).scalar_one()
+
+    def status(self) -> dict:
+        busy = self.stats["busy_time_total"]
+        return {
+            "enabled": DELIVERY_WORKER_ENABLED,
+            "batches": self.stats["batches"],
+            "assignments_sent": self.stats["assignments_sent"],
+            "emails_queued": self.stats["emails_queued"],
+            "rows_per_second": round(self.stats["assignments_sent"] / busy, 1) if busy else 0.0,
+            "last_batch_ms": self.stats["last_batch_ms"],
+            "last_batch_rows_per_second": self.stats["last_batch_rows_per_second"],
+            "backlog": self.stats["backlog"],
+        }
+
+
+assignment_delivery = AssignmentDelivery()
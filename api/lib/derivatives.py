@@ -0,0 +1,203 @@
+import io
+import os
+import time
+import asyncio
+import hashlib
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy import text
+
+from .database import AsyncSessionLocal
+from .media import media_index, resolve_media_path, MEDIA_ROOT
+from .storage import write_once
+from .worker import ProcessPoolWorker
+
+
+MEDIA_DERIVATIVES_ENABLED = os.getenv('MEDIA_DERIVATIVES_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+MEDIA_DERIVATIVE_WIDTHS = [int(w) for w in os.getenv('MEDIA_DERIVATIVE_WIDTHS', '320,640,1280,1920').split(',')]
+MEDIA_DERIVATIVE_WORKERS = int(os.getenv('MEDIA_DERIVATIVE_WORKERS', '2'))  # processes, resizing is CPU bound
+MEDIA_DERIVATIVE_BATCH_SIZE = int(os.getenv('MEDIA_DERIVATIVE_BATCH_SIZE', '8'))
+MEDIA_DERIVATIVE_POLL_INTERVAL = float(os.getenv('MEDIA_DERIVATIVE_POLL_INTERVAL', '10'))
+MEDIA_DERIVATIVE_LEASE = float(os.getenv('MEDIA_DERIVATIVE_LEASE', '600'))  # seconds before a claimed row from a crashed worker is retried
+DERIVATIVES_DIR = '.derivatives'  # created next to each original
+
+ENCODERS = {
+    'jpeg': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', {'quality': 80, 'method': 6}),
+}
+
+
+def generate_derivatives(source_path: str, media_root: str, widths: list):
+    """Resize an image to each of `widths` (and its own width) as JPEG and WebP.
+
+    Runs in a worker process. Returns (width, height, derivatives) with one
+    (width, height, format, path relative to media_root, size) per file, or
+    None when the file isn't an image. Variants that would not be smaller than
+    the original are not kept.
+    """
+    try:
+        image = Image.open(source_path)
+    except UnidentifiedImageError:
+        return None
+
+    with image:
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        original_size = os.path.getsize(source_path)
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        out_dir = os.path.join(os.path.dirname(source_path), DERIVATIVES_DIR)
+
+        derivatives = []
+        for target in sorted({w for w in widths if w < width} | {width}):
+            target_height = max(1, round(height * target / width))
+            resized = image if target == width else image.resize((target, target_height), Image.LANCZOS)
+            for format, (extension, options) in ENCODERS.items():
+                if format == 'jpeg' and has_alpha:
+                    continue  # would lose transparency, the original is served instead
+                buffer = io.BytesIO()
+                resized.save(buffer, format=format.upper(), **options)
+                data = buffer.getvalue()
+                if len(data) >= original_size:
+                    continue
+                path = os.path.join(out_dir, f"{hashlib.sha256(data).hexdigest()}.{extension}")
+                write_once(path, data)
+                derivatives.append((target, target_height, format, os.path.relpath(path, media_root), len(data)))
+    return width, height, derivatives
+
+
+class DerivativeWorker(ProcessPoolWorker):
+    """Generates resized JPEG and WebP copies of new media rows in a process pool.
+
+    Rows are claimed with FOR UPDATE SKIP LOCKED and a lease like the mail outbox,
+    so every API worker can run one. The derivatives are recorded in
+    media_derivatives and /media/{id} picks the smallest one that fits.
+    """
+
+    name = "Media derivatives"
+
+    def __init__(self):
+        super().__init__(interval=MEDIA_DERIVATIVE_POLL_INTERVAL, processes=MEDIA_DERIVATIVE_WORKERS)
+        self.stats = {
+            "processed": 0,
+            "derivatives": 0,
+            "skipped": 0,
+            "failed": 0,
+            "last_batch_ms": 0.0,
+        }
+
+    async def run_once(self) -> bool:
+        return await self.process_batch() >= MEDIA_DERIVATIVE_BATCH_SIZE
+
+    async def process_batch(self) -> int:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                text("""
+                    UPDATE media m
+                    SET derivatives_status = 'processing',
+                        derivatives_locked_until = CURRENT_TIMESTAMP + make_interval(secs => :lease)
+                    FROM (
+                        SELECT id FROM media
+                        WHERE derivatives_status = 'pending'
+                        OR (derivatives_status = 'processing' AND derivatives_locked_until < CURRENT_TIMESTAMP)
+                        ORDER BY id
+                        LIMIT :batch_size
+                        FOR UPDATE SKIP LOCKED
+                    ) due
+                    WHERE m.id = due.id
+                    RETURNING m.id, m.path
+                """),
+                {"lease": MEDIA_DERIVATIVE_LEASE, "batch_size": MEDIA_DERIVATIVE_BATCH_SIZE}
+            )).fetchall()
+            await db.commit()
+
+        if not rows:
+            return 0
+
+        start = time.perf_counter()
+        jobs = []
+        for row in rows:
+            path = resolve_media_path(row.path)
+            if path is None:
+                jobs.append(asyncio.sleep(0, ValueError(f"{row.path} is outside MEDIA_ROOT")))
+            else:
+                jobs.append(self.run_in_pool(generate_derivatives, path, MEDIA_ROOT, MEDIA_DERIVATIVE_WIDTHS))
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+
+        ids, statuses, widths, heights = [], [], [], []
+        derivatives = []
+        for row, result in zip(rows, results):
+            if isinstance(result, BaseException):
+                print(f"Failed to generate derivatives for media {row.id}: {str(result)}")
+                status, width, height = 'failed', None, None
+            elif result is None:
+                status, width, height = 'skipped', None, None
+            else:
+                status, (width, height, files) = 'done', result
+                derivatives.extend((row.id, *f) for f in files)
+            ids.append(row.id)
+            statuses.append(status)
+            widths.append(width)
+            heights.append(height)
+            self.stats["processed" if status == 'done' else status] += 1
+
+        async with AsyncSessionLocal() as db:
+            if derivatives:
+                await db.execute(
+                    text("""
+                        INSERT INTO media_derivatives (media_id, width, height, format, path, size_bytes)
+                        SELECT * FROM unnest(
+                            CAST(:media_ids AS int[]),
+                            CAST(:widths AS int[]),
+                            CAST(:heights AS int[]),
+                            CAST(:formats AS text[]),
+                            CAST(:paths AS text[]),
+                            CAST(:sizes AS int[])
+                        )
+                        ON CONFLICT (media_id, width, format) DO UPDATE
+                        SET height = EXCLUDED.height,
+                            path = EXCLUDED.path,
+                            size_bytes = EXCLUDED.size_bytes
+                    """),
+                    {
+                        "media_ids": [d[0] for d in derivatives],
+                        "widths": [d[1] for d in derivatives],
+                        "heights": [d[2] for d in derivatives],
+                        "formats": [d[3] for d in derivatives],
+                        "paths": [d[4] for d in derivatives],
+                        "sizes": [d[5] for d in derivatives]
+                    }
+                )
+            await db.execute(
+                text("""
+                    UPDATE media m
+                    SET derivatives_status = r.status,
+                        derivatives_locked_until = NULL,
+                        width = r.width,
+                        height = r.height
+                    FROM unnest(
+                        CAST(:ids AS int[]),
+                        CAST(:statuses AS text[]),
+                        CAST(:widths AS int[]),
+                        CAST(:heights AS int[])
+                    ) AS r(id, status, width, height)
+                    WHERE m.id = r.id
+                """),
+                {"ids": ids, "statuses": statuses, "widths": widths, "heights": heights}
+            )
+            await db.commit()
+
+        media_index.expire()
+        self.stats["derivatives"] += len(derivatives)
+        self.stats["last_batch_ms"] = round(1000 * (time.perf_counter() - start), 3)
+        return len(rows)
+
+    def status(self) -> dict:
+        return {
+            "enabled": MEDIA_DERIVATIVES_ENABLED,
+            **self.stats,
+        }
+
+
+derivative_worker = DerivativeWorker()
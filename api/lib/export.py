@@ -0,0 +1,130 @@
+import io
+import csv
+import json
+import datetime as dt
+from uuid import UUID
+
+from sqlalchemy import text
+
+from .database import AsyncSessionLocal
+
+
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# One row per attempt, per visit without attempts, per assignment without visits and per certificate
+STUDENT_ACTIVITY_QUERY = """
+    SELECT
+        s.id AS student_id,
+        u.id AS user_id,
+        u.email,
+        s.class_id,
+        CASE
+            WHEN aa.id IS NOT NULL THEN 'attempt'
+            WHEN av.id IS NOT NULL THEN 'visit'
+            ELSE 'assignment'
+        END AS record_type,
+        COALESCE(aa.created_at, av.created_at, a.created_at) AS occurred_at,
+        a.id AS assignment_id,
+        a.question_mc_id,
+        a.test_date,
+        a.expiration_date,
+        a.status AS assignment_status,
+        av.id AS visit_id,
+        aa.id AS attempt_id,
+        aa.answer_option_id,
+        CASE WHEN aa.id IS NULL THEN NULL ELSE aoc.id IS NOT NULL END AS is_correct,
+        NULL::int AS certificate_id,
+        NULL::int AS course_id,
+        NULL::date AS valid_until
+    FROM students s
+    JOIN users u ON u.id = s.user_id
+    JOIN assignments a ON a.student_id = s.id
+    LEFT JOIN assignment_visits av ON av.assignment_id = a.id
+    LEFT JOIN assignment_attempts aa ON aa.assignment_visit_id = av.id
+    LEFT JOIN answer_option_correctness aoc ON aoc.answer_option_id = aa.answer_option_id
+    WHERE {student_filter}
+
+    UNION ALL
+
+    SELECT
+        s.id,
+        u.id,
+        u.email,
+        s.class_id,
+        'certificate',
+        c.created_at,
+        NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL,
+        c.id,
+        c.course_id,
+        c.valid_until
+    FROM certificates c
+    JOIN students s ON s.id = c.student_id
+    JOIN users u ON u.id = s.user_id
+    WHERE {student_filter}
+
+    ORDER BY student_id, occurred_at
+"""
+
+EXPORT_COLUMNS = [
+    "student_id", "user_id", "email", "class_id", "record_type", "occurred_at",
+    "assignment_id", "question_mc_id", "test_date", "expiration_date", "assignment_status",
+    "visit_id", "attempt_id", "answer_option_id", "is_correct",
+    "certificate_id", "course_id", "valid_until",
+]
+
+
+def _json_default(value):
+    if isinstance(value, (dt.date, dt.datetime)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Can not serialize {type(value)}")
+
+
+async def stream_student_activity(class_id: int, user_id: int = None):
+    """Yield activity rows in chunks from a server-side cursor, so memory stays flat however long the history."""
+    student_filter = "s.class_id = :class_id"
+    params = {"class_id": class_id}
+    if user_id is not None:
+        student_filter += " AND s.user_id = :user_id"
+        params["user_id"] = user_id
+
+    # The request's own session is already closed once the response body streams, so open one here
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            text(STUDENT_ACTIVITY_QUERY.format(student_filter=student_filter)),
+            params
+        )
+        async for rows in result.partitions(EXPORT_CHUNK_SIZE):
+            yield rows
+
+
+async def ndjson_export(chunks):
+    async for rows in chunks:
+        yield "".join(
+            json.dumps(dict(row._mapping), default=_json_default) + "\n"
+            for row in rows
+        )
+
+
+async def csv_export(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    async for rows in chunks:
+        for row in rows:
+            writer.writerow(
+                value.isoformat() if isinstance(value, (dt.date, dt.datetime)) else value
+                for value in (row._mapping[column] for column in EXPORT_COLUMNS)
+            )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty export
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,158 @@
+import os
+import time
+import datetime as dt
+from typing import NamedTuple
+
+from sqlalchemy import text
+
+from .database import AsyncSessionLocal
+from .cache import TTLCache, ReloadingIndex
+from .worker import BackgroundWorker
+
+
+ANSWER_KEY_TTL = float(os.getenv('ANSWER_KEY_TTL', '300'))  # seconds before the answer key is reloaded
+ANSWER_KEY_MISS_RELOAD = 5.0  # reload at most this often when an unknown option comes in
+ATTEMPT_FLUSH_INTERVAL = float(os.getenv('ATTEMPT_FLUSH_INTERVAL', '0.25'))  # upper bound on write-behind latency
+ATTEMPT_FLUSH_SIZE = int(os.getenv('ATTEMPT_FLUSH_SIZE', '500'))
+ATTEMPT_BUFFER_MAX = int(os.getenv('ATTEMPT_BUFFER_MAX', '20000'))  # flush inline once this many attempts are waiting
+
+
+class AnswerOption(NamedTuple):
+    id: int
+    question_mc_id: int
+    is_correct: bool
+    feedback_message: str
+
+
+class AnswerKey(ReloadingIndex):
+    """All answer options with their correctness, so grading needs no queries."""
+
+    def __init__(self):
+        super().__init__(ttl=ANSWER_KEY_TTL, miss_reload=ANSWER_KEY_MISS_RELOAD)
+
+    async def load(self) -> dict:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                text("""
+                    SELECT
+                        o.id,
+                        o.question_mc_id,
+                        c.id IS NOT NULL AS is_correct,
+                        o.feedback_message
+                    FROM answer_options o
+                    LEFT JOIN answer_option_correctness c ON c.answer_option_id = o.id
+                """)
+            )).fetchall()
+        return {row.id: AnswerOption(*row) for row in rows}
+
+
+class AttemptBuffer(BackgroundWorker):
+    """Write-behind buffer for answer submissions.
+
+    Submissions are graded and answered right away and written here. Every
+    ATTEMPT_FLUSH_INTERVAL seconds, or as soon as ATTEMPT_FLUSH_SIZE are waiting,
+    the visits and attempts are inserted with a single statement. The completion
+    trigger on assignment_attempts then updates assignment status for the whole batch.
+    Anything still buffered is flushed on shutdown.
+    """
+
+    name = "Attempt buffer"
+
+    def __init__(self):
+        super().__init__(interval=ATTEMPT_FLUSH_INTERVAL)
+        self._pending = []
+        self._oldest = None
+        self.stats = {
+            "received": 0,
+            "flushed": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "last_flush_ms": 0.0,
+            "max_write_delay_ms": 0.0,
+        }
+
+    def add(self, assignment_id: int, answer_option_id: int, created_at: dt.datetime) -> None:
+        if not self._pending:
+            self._oldest = time.monotonic()
+        self._pending.append((assignment_id, answer_option_id, created_at))
+        self.stats["received"] += 1
+        if len(self._pending) >= ATTEMPT_FLUSH_SIZE:
+            self.notify()
+
+    def is_full(self) -> bool:
+        return len(self._pending) >= ATTEMPT_BUFFER_MAX
+
+    async def run_once(self) -> bool:
+        await self.flush()
+        return len(self._pending) >= ATTEMPT_FLUSH_SIZE
+
+    async def stop(self) -> None:
+        await super().stop()
+        await self.flush()
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        batch, oldest = self._pending[:ATTEMPT_FLUSH_SIZE * 4], self._oldest
+        self._pending = self._pending[len(batch):]
+        self._oldest = time.monotonic() if self._pending else None
+
+        start = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    text("""
+                        WITH input AS MATERIALIZED (
+                            SELECT
+                                nextval(pg_get_serial_sequence('assignment_visits', 'id')) AS visit_id,
+                                t.assignment_id,
+                                t.answer_option_id,
+                                t.created_at
+                            FROM unnest(
+                                CAST(:assignment_ids AS int[]),
+                                CAST(:answer_option_ids AS int[]),
+                                CAST(:created_ats AS timestamptz[])
+                            ) AS t(assignment_id, answer_option_id, created_at)
+                            -- Skip rows whose assignment or option was deleted since, they would fail the whole batch
+                            WHERE EXISTS (SELECT 1 FROM assignments a WHERE a.id = t.assignment_id)
+                            AND EXISTS (SELECT 1 FROM answer_options o WHERE o.id = t.answer_option_id)
+                        ),
+                        visits AS (
+                            INSERT INTO assignment_visits (id, assignment_id, created_at)
+                            SELECT visit_id, assignment_id, created_at FROM input
+                        )
+                        INSERT INTO assignment_attempts (assignment_visit_id, answer_option_id, created_at)
+                        SELECT visit_id, answer_option_id, created_at FROM input
+                    """),
+                    {
+                        "assignment_ids": [a for a, _, _ in batch],
+                        "answer_option_ids": [o for _, o, _ in batch],
+                        "created_ats": [c for _, _, c in batch]
+                    }
+                )
+                await db.commit()
+        except Exception:
+            # Most likely the database is unreachable, put the batch back in front for the next flush
+            self.stats["failed_flushes"] += 1
+            self._pending = batch + self._pending
+            self._oldest = oldest
+            raise
+
+        self.stats["flushes"] += 1
+        self.stats["flushed"] += len(batch)
+        self.stats["last_flush_ms"] = round(1000 * (time.perf_counter() - start), 3)
+        if oldest is not None:
+            self.stats["max_write_delay_ms"] = max(self.stats["max_write_delay_ms"], round(1000 * (time.monotonic() - oldest), 3))
+        return len(batch)
+
+    def status(self) -> dict:
+        return {
+            "buffered": len(self._pending),
+            **self.stats,
+        }
+
+
+answer_key = AnswerKey()
+attempt_buffer = AttemptBuffer()
+# access_token -> assignment row, so repeated submissions on a link need no lookup
+assignment_cache = TTLCache(maxsize=int(os.getenv('ASSIGNMENT_CACHE_SIZE', '50000')), ttl=300)
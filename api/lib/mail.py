@@ -1,40 +1,279 @@
 # api/lib/mail.py
 import os
+import time
+import asyncio
 import smtplib
+from typing import List
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formataddr
 
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import AsyncSessionLocal
+from .worker import BackgroundWorker
+from .metrics import SMTP_SEND_TIME
+
 EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
 EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
 SMTP_SERVER = os.getenv('EMAIL_SMTP_SERVER')
 SMTP_PORT = int(os.getenv('EMAIL_SMTP_PORT', '465'))
+# Set to false to talk plain SMTP, e.g. to a local aiosmtpd stand-in. Login is skipped without a password.
+SMTP_USE_SSL = os.getenv('EMAIL_SMTP_SSL', 'true').lower() in ('1', 'true', 'yes')
+SMTP_TIMEOUT = float(os.getenv('EMAIL_SMTP_TIMEOUT', '30'))
+SMTP_IDLE_TIMEOUT = float(os.getenv('EMAIL_SMTP_IDLE_TIMEOUT', '60'))  # close pooled connection after this many idle seconds
 
-def send_email(to_address: str, subject: str, body: str, sender_name: str = 'Course Platform') -> None:
-    print(f"Attempting to send email to: {to_address}")
-    print(f"Using SMTP server: {SMTP_SERVER}:{SMTP_PORT}")
-    
-    if not all([EMAIL_ADDRESS, EMAIL_PASSWORD, SMTP_SERVER, SMTP_PORT]):
+# Base url of the frontend, used for links in emails
+FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:8501')
+
+# Outbox sender
+MAIL_SENDER_ENABLED = os.getenv('MAIL_SENDER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+MAIL_BATCH_SIZE = int(os.getenv('MAIL_BATCH_SIZE', '50'))
+MAIL_POLL_INTERVAL = float(os.getenv('MAIL_POLL_INTERVAL', '5'))
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', '5'))
+MAIL_RETRY_BASE_DELAY = float(os.getenv('MAIL_RETRY_BASE_DELAY', '30'))  # seconds, doubled on every retry
+MAIL_LEASE = float(os.getenv('MAIL_LEASE', '300'))  # seconds before a claimed batch from a crashed sender is retried
+
+
+def check_config() -> None:
+    if not all([EMAIL_ADDRESS, SMTP_SERVER, SMTP_PORT]):
         raise ValueError(
             "Email configuration missing. Need EMAIL_ADDRESS, EMAIL_PASSWORD, "
             "EMAIL_SMTP_SERVER, and EMAIL_SMTP_PORT in environment variables."
         )
 
-    # Create the email message
+
+def build_message(to_address: str, subject: str, body: str, sender_name: str = 'Course Platform') -> MIMEMultipart:
     message = MIMEMultipart()
     message['From'] = formataddr((sender_name, EMAIL_ADDRESS))
     message['To'] = to_address
     message['Subject'] = subject
     message.attach(MIMEText(body, 'plain'))
+    return message
 
-    try:
-        # Send the message
-        with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-            print("Connected to SMTP server")
+
+class SMTPConnection:
+    """A single authenticated SMTP connection that is kept open between messages.
+
+    Not thread-safe, only use it from one thread at a time.
+    """
+
+    def __init__(self):
+        self._server = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _connect(self) -> None:
+        check_config()
+        if SMTP_USE_SSL:
+            server = smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        else:
+            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if EMAIL_PASSWORD:
             server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            print("Logged in successfully")
-            server.send_message(message)
-            print(f"Email sent successfully to {to_address}")
+        print(f"Connected to SMTP server {SMTP_SERVER}:{SMTP_PORT}")
+        self._server = server
+        self.connects += 1
+
+    def send(self, message) -> None:
+        if self._server is not None and time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+            self.close()
+        if self._server is None:
+            self._connect()
+        try:
+            self._server.send_message(message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # The server dropped our pooled connection, reconnect once and retry
+            self.close()
+            self._connect()
+            self._server.send_message(message)
+        self._last_used = time.monotonic()
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            pass
+        self._server = None
+
+
+def send_email(to_address: str, subject: str, body: str, sender_name: str = 'Course Platform') -> None:
+    """Send one message right away over a fresh connection. Prefer enqueue_email in request handlers."""
+    print(f"Attempting to send email to: {to_address}")
+    connection = SMTPConnection()
+    try:
+        connection.send(build_message(to_address, subject, body, sender_name))
+        print(f"Email sent successfully to {to_address}")
     except Exception as e:
         print(f"Failed to send email: {str(e)}")
         raise
+    finally:
+        connection.close()
+
+
+async def enqueue_email(db: AsyncSession, to_address: str, subject: str, body: str, sender_name: str = 'Course Platform') -> None:
+    """Add a message to the outbox. It is only sent once the caller commits the transaction."""
+    await db.execute(
+        text("""
+            INSERT INTO email_outbox (to_address, subject, body, sender_name)
+            VALUES (:to_address, :subject, :body, :sender_name)
+        """),
+        {
+            "to_address": to_address,
+            "subject": subject,
+            "body": body,
+            "sender_name": sender_name
+        }
+    )
+
+
+async def enqueue_emails(db: AsyncSession, to_addresses: List[str], subject: str, bodies: List[str], sender_name: str = 'Course Platform') -> None:
+    """Add one message per address to the outbox in a single statement, bodies in the same order."""
+    await db.execute(
+        text("""
+            INSERT INTO email_outbox (to_address, subject, body, sender_name)
+            SELECT m.to_address, :subject, m.body, :sender_name
+            FROM unnest(CAST(:to_addresses AS text[]), CAST(:bodies AS text[])) AS m(to_address, body)
+        """),
+        {
+            "to_addresses": to_addresses,
+            "bodies": bodies,
+            "subject": subject,
+            "sender_name": sender_name
+        }
+    )
+
+
+class MailSender(BackgroundWorker):
+    """Background task that drains email_outbox over a reused SMTP connection.
+
+    Several API workers can run one each, batches are claimed with SKIP LOCKED.
+    """
+
+    name = "Mail sender"
+
+    def __init__(self):
+        super().__init__(interval=MAIL_POLL_INTERVAL)
+        self._connection = SMTPConnection()
+        self.stats = {
+            "batches": 0,
+            "sent": 0,
+            "retried": 0,
+            "failed": 0,
+            "send_time_total": 0.0,
+            "last_batch_ms": 0.0,
+        }
+
+    async def stop(self) -> None:
+        await super().stop()
+        await asyncio.to_thread(self._connection.close)
+
+    async def run_once(self) -> bool:
+        # A full batch probably means there is more waiting
+        return await self.process_batch() >= MAIL_BATCH_SIZE
+
+    async def process_batch(self) -> int:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                text("""
+                    UPDATE email_outbox o
+                    SET status = 'sending',
+                        attempts = o.attempts + 1,
+                        locked_until = CURRENT_TIMESTAMP + make_interval(secs => :lease)
+                    FROM (
+                        SELECT id FROM email_outbox
+                        WHERE (status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP)
+                        OR (status = 'sending' AND locked_until < CURRENT_TIMESTAMP)
+                        ORDER BY next_attempt_at, id
+                        LIMIT :batch_size
+                        FOR UPDATE SKIP LOCKED
+                    ) due
+                    WHERE o.id = due.id
+                    RETURNING o.id, o.to_address, o.subject, o.body, o.sender_name
+                """),
+                {"lease": MAIL_LEASE, "batch_size": MAIL_BATCH_SIZE}
+            )).fetchall()
+            await db.commit()
+
+        if not rows:
+            return 0
+
+        start = time.perf_counter()
+        sent_ids, errors = await asyncio.to_thread(self._send_all, rows)
+        duration = time.perf_counter() - start
+
+        async with AsyncSessionLocal() as db:
+            if sent_ids:
+                await db.execute(
+                    text("""
+                        UPDATE email_outbox
+                        SET status = 'sent',
+                            sent_at = CURRENT_TIMESTAMP,
+                            locked_until = NULL,
+                            last_error = NULL
+                        WHERE id = ANY(CAST(:ids AS int[]))
+                    """),
+                    {"ids": sent_ids}
+                )
+            if errors:
+                result = await db.execute(
+                    text("""
+                        UPDATE email_outbox o
+                        SET status = CASE WHEN o.attempts >= :max_attempts THEN 'failed' ELSE 'pending' END,
+                            next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => :base_delay * power(2, o.attempts - 1)),
+                            locked_until = NULL,
+                            last_error = f.error
+                        FROM unnest(CAST(:ids AS int[]), CAST(:errors AS text[])) AS f(id, error)
+                        WHERE o.id = f.id
+                        RETURNING o.status
+                    """),
+                    {
+                        "ids": list(errors.keys()),
+                        "errors": list(errors.values()),
+                        "max_attempts": MAIL_MAX_ATTEMPTS,
+                        "base_delay": MAIL_RETRY_BASE_DELAY
+                    }
+                )
+                for row in result.fetchall():
+                    self.stats["failed" if row.status == 'failed' else "retried"] += 1
+            await db.commit()
+
+        self.stats["batches"] += 1
+        self.stats["sent"] += len(sent_ids)
+        self.stats["send_time_total"] += duration
+        self.stats["last_batch_ms"] = round(1000 * duration, 3)
+        return len(rows)
+
+    def _send_all(self, rows):
+        """Runs in a worker thread, smtplib is blocking."""
+        sent_ids, errors = [], {}
+        for row in rows:
+            start = time.perf_counter()
+            try:
+                self._connection.send(build_message(row.to_address, row.subject, row.body, row.sender_name))
+                sent_ids.append(row.id)
+                SMTP_SEND_TIME.labels("sent").observe(time.perf_counter() - start)
+            except Exception as e:
+                SMTP_SEND_TIME.labels("error").observe(time.perf_counter() - start)
+                print(f"Failed to send email {row.id} to {row.to_address}: {str(e)}")
+                errors[row.id] = str(e)
+        return sent_ids, errors
+
+    def status(self) -> dict:
+        sent = self.stats["sent"]
+        return {
+            "enabled": MAIL_SENDER_ENABLED,
+            "batches": self.stats["batches"],
+            "sent": sent,
+            "retried": self.stats["retried"],
+            "failed": self.stats["failed"],
+            "smtp_connects": self._connection.connects,
+            "send_time_avg_ms": round(1000 * self.stats["send_time_total"] / sent, 3) if sent else 0.0,
+            "last_batch_ms": self.stats["last_batch_ms"],
+        }
+
+
+mail_sender = MailSender()
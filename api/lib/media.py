@@ -0,0 +1,127 @@
+import os
+import asyncio
+import hashlib
+import mimetypes
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+from sqlalchemy import text
+
+from .database import AsyncSessionLocal
+from .cache import TTLCache, ReloadingIndex
+
+
+# Directory that media.path is relative to, docker-compose mounts ./media here
+MEDIA_ROOT = os.path.realpath(os.getenv('MEDIA_ROOT', 'media'))
+MEDIA_INDEX_TTL = float(os.getenv('MEDIA_INDEX_TTL', '300'))  # seconds before the id -> path index is reloaded
+MEDIA_INDEX_MISS_RELOAD = 5.0  # reload at most this often when an unknown id comes in
+MEDIA_MAX_AGE = int(os.getenv('MEDIA_MAX_AGE', '86400'))  # Cache-Control max-age for media responses
+MEDIA_HASH_CHUNK = 1024 * 1024
+
+
+class Variant(NamedTuple):
+    width: int
+    format: str
+    path: str  # absolute path under MEDIA_ROOT
+    size: int
+
+
+class MediaFile(NamedTuple):
+    id: int
+    path: str  # absolute path under MEDIA_ROOT
+    alt_text: str
+    width: Optional[int]
+    variants: tuple  # derivatives, empty until the derivative worker processed the file
+
+    def choose(self, width: Optional[int] = None, accept: str = '') -> str:
+        """Path of the smallest file that is at least `width` wide (full size by default) in a format the client accepts."""
+        if not self.variants:
+            return self.path
+        formats = {'jpeg', 'webp'} if 'image/webp' in accept else {'jpeg'}
+        suitable = [v for v in self.variants if v.format in formats and v.width >= (width or self.width)]
+        # Derivatives are only kept when smaller than the original, which covers everything else
+        return min(suitable, key=lambda v: v.size).path if suitable else self.path
+
+
+class FileInfo(NamedTuple):
+    size: int
+    mtime: float
+    etag: str
+    media_type: str
+
+
+def resolve_media_path(path: str) -> Optional[str]:
+    """Absolute path of a media.path value, or None when it points outside MEDIA_ROOT."""
+    full_path = os.path.realpath(os.path.join(MEDIA_ROOT, path))
+    if os.path.commonpath([full_path, MEDIA_ROOT]) != MEDIA_ROOT:
+        return None
+    return full_path
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(MEDIA_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaIndex(ReloadingIndex):
+    """media.id -> file on disk and its derivatives, so serving a file needs no queries.
+
+    Content hashes for the ETag are computed once per file version (size and
+    mtime) in a worker thread and remembered.
+    """
+
+    def __init__(self):
+        super().__init__(ttl=MEDIA_INDEX_TTL, miss_reload=MEDIA_INDEX_MISS_RELOAD)
+        self._info = TTLCache(maxsize=int(os.getenv('MEDIA_INFO_CACHE_SIZE', '10000')), ttl=MEDIA_INDEX_TTL)
+
+    async def load(self) -> dict:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                text("SELECT id, path, alt_text, width FROM media")
+            )).fetchall()
+            derivatives = (await db.execute(
+                text("SELECT media_id, width, format, path, size_bytes FROM media_derivatives")
+            )).fetchall()
+
+        variants = defaultdict(list)
+        for d in derivatives:
+            full_path = resolve_media_path(d.path)
+            if full_path is not None:
+                variants[d.media_id].append(Variant(d.width, d.format, full_path, d.size_bytes))
+
+        files = {}
+        for row in rows:
+            full_path = resolve_media_path(row.path)
+            if full_path is None:
+                print(f"Media {row.id} points outside MEDIA_ROOT, skipping: {row.path}")
+                continue
+            files[row.id] = MediaFile(row.id, full_path, row.alt_text, row.width, tuple(variants[row.id]))
+        return files
+
+    async def file_info(self, path: str) -> Optional[FileInfo]:
+        """Size, mtime, content-hash ETag and type of a file, None when it is missing on disk."""
+        try:
+            stat = await asyncio.to_thread(os.stat, path)
+        except FileNotFoundError:
+            return None
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        info = self._info.get(key)
+        if info is None:
+            etag = '"' + await asyncio.to_thread(_hash_file, path) + '"'
+            media_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            info = FileInfo(stat.st_size, stat.st_mtime, etag, media_type)
+            self._info.set(key, info)
+        return info
+
+    def status(self) -> dict:
+        return {
+            **super().status(),
+            "root": MEDIA_ROOT,
+            "hashes": self._info.stats(),
+        }
+
+
+media_index = MediaIndex()
@@ -0,0 +1,223 @@
+import os
+import re
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    REGISTRY,
+    CONTENT_TYPE_LATEST,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+
+# Set this to a writable directory shared by all uvicorn workers to aggregate their metrics
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Requests by route template and status code",
+    ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time from receiving a request until its response is sent",
+    ["method", "route"], buckets=LATENCY_BUCKETS
+)
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being handled right now",
+    ["method"], multiprocess_mode="livesum"
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "Database queries per request",
+    ["method", "route"], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds", "Time spent executing database queries per request",
+    ["method", "route"], buckets=LATENCY_BUCKETS
+)
+DB_QUERY_TIME = Histogram(
+    "db_query_duration_seconds", "Execution time of single database queries, including background workers",
+    buckets=QUERY_BUCKETS
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a connection from the pool",
+    buckets=QUERY_BUCKETS
+)
+PASSWORD_HASH_TIME = Histogram(
+    "password_hash_seconds", "bcrypt hash or verify time in the worker pool",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0)
+)
+PASSWORD_HASH_WAIT = Histogram(
+    "password_hash_queue_seconds", "Time a bcrypt job waited for a free worker",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+SMTP_SEND_TIME = Histogram(
+    "smtp_send_seconds", "Time to hand one message to the SMTP server",
+    ["outcome"], buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Database work of the request being handled, set by MetricsMiddleware
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def instrument_engine(engine) -> None:
+    """Time every query on a (sync) engine and add it to the current request's stats.
+
+    For an AsyncEngine pass engine.sync_engine. The async driver runs queries in a
+    greenlet that shares the request task's context, so the contextvar is visible.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["query_started"].pop()
+        DB_QUERY_TIME.observe(duration)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += duration
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        # after_cursor_execute isn't called for failed queries
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and database work per route template.
+
+    Routes are labelled by their template (/classes/{class_id}/students), never the
+    raw path, so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        HTTP_IN_PROGRESS.labels(method).inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            HTTP_IN_PROGRESS.labels(method).dec()
+            _request_stats.reset(token)
+            # The router stores the matched route in the shared scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+            HTTP_LATENCY.labels(method, route).observe(duration)
+            REQUEST_DB_QUERIES.labels(method, route).observe(stats.queries)
+            REQUEST_DB_TIME.labels(method, route).observe(stats.db_time)
+
+
+# Status fields that only ever grow, exported as counters. Everything else is a gauge.
+CUMULATIVE_FIELDS = {
+    "batches", "builds", "checkouts", "completed", "derivatives", "emails_queued", "failed",
+    "failed_flushes", "flushed", "flushes", "hits", "issued", "lookups", "misses", "pdfs_rendered",
+    "processed", "received", "reloads", "rejected", "retried", "runs", "sent", "assignments_sent",
+    "skipped", "smtp_connects", "timeouts",
+}
+
+
+def _metric_name(*parts: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', "_".join(parts)).lower()
+
+
+def _numeric_values(values: dict, prefix: str = ""):
+    """(name, field, value) for every number in a status dict, timings converted to seconds."""
+    for key, value in values.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _numeric_values(value, f"{name}_")
+        elif isinstance(value, (bool, int, float)):
+            if key.endswith("_ms"):
+                yield f"{name[:-3]}_seconds", key, value / 1000
+            else:
+                yield name, key, float(value)
+
+
+class StatusCollector:
+    """The status() dicts of the API's components, for /health and as Prometheus metrics.
+
+    Numeric fields become app_<component>_<field> metrics: counters for the fields in
+    CUMULATIVE_FIELDS, gauges otherwise, with millisecond timings in seconds.
+    """
+
+    def __init__(self):
+        self.sources: Dict[str, Callable[[], dict]] = {}
+
+    def register(self, name: str, status: Callable[[], dict]) -> None:
+        self.sources[name] = status
+
+    def statuses(self) -> dict:
+        return {name: status() for name, status in self.sources.items()}
+
+    def collect(self):
+        for source, status in self.sources.items():
+            try:
+                values = status()
+            except Exception as e:
+                print(f"Metrics status source {source} failed: {str(e)}")
+                continue
+            for name, key, value in _numeric_values(values):
+                metric_name = _metric_name("app", source, name)
+                documentation = f"{name} from the {source} status"
+                if key in CUMULATIVE_FIELDS:
+                    yield CounterMetricFamily(metric_name, documentation, value=value)
+                else:
+                    yield GaugeMetricFamily(metric_name, documentation, value=value)
+
+
+status_collector = StatusCollector()
+REGISTRY.register(status_collector)
+
+
+def render_metrics() -> bytes:
+    """Everything in Prometheus text format, summed over workers in multiprocess mode."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # Status gauges are per worker, they come from the worker answering the scrape
+        registry.register(status_collector)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
@@ -0,0 +1,132 @@
+import os
+import re
+import html
+import asyncio
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import markdown
+import nh3
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+# Public url the browser fetches /media from, the API isn't on the frontend's origin
+MEDIA_BASE_URL = os.getenv('MEDIA_BASE_URL', 'http://localhost:8000/media').rstrip('/')
+MEDIA_SRCSET_WIDTHS = [int(w) for w in os.getenv('MEDIA_DERIVATIVE_WIDTHS', '320,640,1280,1920').split(',')]
+# Bump when the output of render_markdown changes, so stored html is re-rendered
+RENDERER_VERSION = '1'
+
+# [alt_text](path) or ![alt_text](path), content links media this way
+MEDIA_LINK = re.compile(r'!?\[([^\]]*)\]\(([^)\s]+)\)')
+
+ALLOWED_ATTRIBUTES = {
+    **nh3.ALLOWED_ATTRIBUTES,
+    'img': nh3.ALLOWED_ATTRIBUTES.get('img', set()) | {'srcset', 'sizes', 'loading'},
+}
+
+# (table, id, field) of a markdown column
+SourceKey = Tuple[str, int, str]
+
+
+def content_hash(source: str) -> str:
+    return hashlib.sha256(f"{RENDERER_VERSION}\0{source}".encode('utf-8')).hexdigest()
+
+
+def media_img(media_id: int, alt_text: str) -> str:
+    url = f"{MEDIA_BASE_URL}/{media_id}"
+    srcset = ", ".join(f"{url}?w={w} {w}w" for w in MEDIA_SRCSET_WIDTHS)
+    return (
+        f'<img src="{url}" srcset="{srcset}" sizes="(max-width: 800px) 100vw, 800px" '
+        f'alt="{html.escape(alt_text)}" loading="lazy">'
+    )
+
+
+def render_markdown(source: str, media_ids: Dict[str, int]) -> str:
+    """Markdown to sanitized html, with links to known media paths turned into responsive images."""
+    def replace_link(match):
+        media_id = media_ids.get(match.group(2))
+        return media_img(media_id, match.group(1)) if media_id is not None else match.group(0)
+
+    rendered = markdown.markdown(MEDIA_LINK.sub(replace_link, source), extensions=['extra', 'sane_lists'])
+    return nh3.clean(rendered, attributes=ALLOWED_ATTRIBUTES)
+
+
+async def rendered_fields(db: AsyncSession, fields: Dict[SourceKey, Optional[str]]) -> Dict[SourceKey, Optional[str]]:
+    """Sanitized html for each markdown field, rendered at most once per content version.
+
+    Html stored in rendered_markdown is reused while its content hash matches the
+    markdown. Everything else is rendered in a worker thread and stored. Doesn't
+    commit, the caller decides when.
+    """
+    wanted = {key: content_hash(source) for key, source in fields.items() if source}
+    result = {key: None for key in fields}
+    if not wanted:
+        return result
+
+    keys = list(wanted)
+    stored = (await db.execute(
+        text("""
+            SELECT r.source_table, r.source_id, r.field, r.content_hash, r.html
+            FROM rendered_markdown r
+            JOIN unnest(
+                CAST(:tables AS text[]),
+                CAST(:ids AS int[]),
+                CAST(:fields AS text[])
+            ) AS k(source_table, source_id, field)
+            ON r.source_table = k.source_table AND r.source_id = k.source_id AND r.field = k.field
+        """),
+        {
+            "tables": [k[0] for k in keys],
+            "ids": [k[1] for k in keys],
+            "fields": [k[2] for k in keys]
+        }
+    )).fetchall()
+    for row in stored:
+        key = (row.source_table, row.source_id, row.field)
+        if wanted.get(key) == row.content_hash:
+            result[key] = row.html
+
+    missing = [key for key in keys if result[key] is None]
+    if not missing:
+        return result
+
+    paths = {match.group(2) for key in missing for match in MEDIA_LINK.finditer(fields[key])}
+    media_ids = {}
+    if paths:
+        media_ids = {
+            row.path: row.id
+            for row in (await db.execute(
+                text("SELECT id, path FROM media WHERE path = ANY(CAST(:paths AS text[]))"),
+                {"paths": list(paths)}
+            )).fetchall()
+        }
+
+    rendered: List[str] = await asyncio.to_thread(
+        lambda: [render_markdown(fields[key], media_ids) for key in missing]
+    )
+    await db.execute(
+        text("""
+            INSERT INTO rendered_markdown (source_table, source_id, field, content_hash, html)
+            SELECT * FROM unnest(
+                CAST(:tables AS text[]),
+                CAST(:ids AS int[]),
+                CAST(:fields AS text[]),
+                CAST(:hashes AS text[]),
+                CAST(:htmls AS text[])
+            )
+            ON CONFLICT (source_table, source_id, field) DO UPDATE
+            SET content_hash = EXCLUDED.content_hash,
+                html = EXCLUDED.html,
+                created_at = CURRENT_TIMESTAMP
+        """),
+        {
+            "tables": [k[0] for k in missing],
+            "ids": [k[1] for k in missing],
+            "fields": [k[2] for k in missing],
+            "hashes": [wanted[k] for k in missing],
+            "htmls": rendered
+        }
+    )
+    result.update(zip(missing, rendered))
+    return result
@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write next to the target and rename, so readers never see a half-written file."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_once(path: str, data: bytes) -> None:
+    """For content-addressed files, an existing file already holds these bytes."""
+    if not os.path.exists(path):
+        write_atomic(path, data)
@@ -0,0 +1,79 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+class BackgroundWorker:
+    """Base for the asyncio tasks the API runs next to the request handlers.
+
+    Subclasses implement run_once(), which returns True while there is more work
+    waiting. Otherwise the worker sleeps for `interval` seconds or until notify().
+    """
+
+    name = "worker"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self) -> None:
+        """Wake the worker up right away instead of at the next interval."""
+        self._wakeup.set()
+
+    async def run_once(self) -> bool:
+        raise NotImplementedError
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                more = await self.run_once()
+            except Exception as e:
+                print(f"{self.name} error: {str(e)}")
+                more = False
+
+            if more:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+class ProcessPoolWorker(BackgroundWorker):
+    """BackgroundWorker for CPU-bound jobs, which run in a process pool created on first use."""
+
+    def __init__(self, interval: float, processes: int):
+        super().__init__(interval=interval)
+        self.processes = processes
+        self._pool = None
+
+    async def run_in_pool(self, fn, *args):
+        if self._pool is None:
+            # forkserver rather than fork: the API process has threads (bcrypt pool, SMTP
+            # sends) and a forked child can inherit one of their locks in the held state
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("forkserver")
+            )
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    async def stop(self) -> None:
+        await super().stop()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
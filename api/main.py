@@ -1,31 +1,64 @@
 import datetime as dt
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
-from lib.database import get_db
+from lib.database import get_db, async_engine, engine
+from lib.metrics import MetricsMiddleware, instrument_engine
 from lib.auth import (
-    verify_password,
+    check_password,
     create_access_token,
     get_current_user,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
+from lib.mail import mail_sender, MAIL_SENDER_ENABLED
+from lib.delivery import assignment_delivery, DELIVERY_WORKER_ENABLED
+from lib.grading import attempt_buffer
+from lib.derivatives import derivative_worker, MEDIA_DERIVATIVES_ENABLED
+from lib.certificates import certificate_index, certificate_issuer, CERT_ISSUER_ENABLED
+
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background workers
+    if MAIL_SENDER_ENABLED:
+        mail_sender.start()
+    if DELIVERY_WORKER_ENABLED:
+        assignment_delivery.start()
+    if MEDIA_DERIVATIVES_ENABLED:
+        derivative_worker.start()
+    attempt_buffer.start()
+    certificate_index.start()
+    if CERT_ISSUER_ENABLED:
+        certificate_issuer.start()
+    yield
+    await certificate_issuer.stop()
+    await certificate_index.stop()
+    await attempt_buffer.stop()
+    await derivative_worker.stop()
+    await assignment_delivery.stop()
+    await mail_sender.stop()
+    await async_engine.dispose()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+instrument_engine(async_engine.sync_engine)
+instrument_engine(engine)
 
 @app.post("/token")
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = db.execute(
-        text("SELECT * FROM users WHERE email = :email"),
+    user = (await db.execute(
+        text("SELECT id, email, password_hash FROM users WHERE email = :email"),
         {"email": form_data.username}
-    ).fetchone()
+    )).fetchone()
     
     if not user:
         raise HTTPException(
@@ -34,7 +67,7 @@ async def login(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    if not verify_password(form_data.password, user.password_hash):
+    if not await check_password(form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -64,13 +97,32 @@ async def read_users_me(current_user = Depends(get_current_user)):
 
 
 from pydantic import BaseModel, EmailStr, field_validator
-from lib.auth import get_password_hash
-from lib.mail import send_email
+from lib.auth import hash_password, invalidate_user, UNUSABLE_PASSWORD
+from lib.mail import enqueue_email, enqueue_emails, FRONTEND_URL
 import uuid
 from sqlalchemy import text
 
 from password_validator import PasswordValidator
 
+def check_password_strength(v: str) -> str:
+    schema = PasswordValidator()
+    schema\
+        .min(8)\
+        .max(100)\
+        .has().uppercase()\
+        .has().lowercase()\
+        .has().digits()\
+        .has().symbols()\
+        .no().spaces()
+
+    if not schema.validate(v):
+        raise ValueError(
+            'Password must be 8-100 characters long, '
+            'contain upper and lowercase letters, '
+            'numbers, special characters, and no spaces'
+        )
+    return v
+
 class UserCreate(BaseModel):
     email: EmailStr
     password: str
@@ -78,34 +130,61 @@ class UserCreate(BaseModel):
     @field_validator('password')
     @classmethod
     def password_strength(cls, v: str) -> str:
-        schema = PasswordValidator()
-        schema\
-            .min(8)\
-            .max(100)\
-            .has().uppercase()\
-            .has().lowercase()\
-            .has().digits()\
-            .has().symbols()\
-            .no().spaces()
-
-        if not schema.validate(v):
-            raise ValueError(
-                'Password must be 8-100 characters long, '
-                'contain upper and lowercase letters, '
-                'numbers, special characters, and no spaces'
-            )
-        return v
+        return check_password_strength(v)
+
+INVITATION_SUBJECT = "You have been added to a class on the Course Platform"
+# /register re-sends an invitation at most this often per address
+INVITATION_RESEND_INTERVAL = 15 * 60  # seconds
+
+def invitation_body(verification_key) -> str:
+    """Mail for users created by a student import, they choose their password through the link."""
+    invitation_url = f"{FRONTEND_URL}/invite?key={verification_key}"
+    return f"""
+Welcome to the Course Platform!
+
+Your teacher added you to a class. Choose a password to activate your account:
+{invitation_url}
+
+If you did not expect this email, please ignore it.
+"""
 
 @app.post("/register")
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     print(f"Registration attempt for email: {user.email}")  # Debug log
     
     # Check if user exists
-    existing_user = db.execute(
-        text("SELECT * FROM users WHERE email = :email"),
+    existing_user = (await db.execute(
+        text("SELECT id, password_hash, verification_key FROM users WHERE email = :email"),
         {"email": user.email}
-    ).fetchone()
-    
+    )).fetchone()
+
+    if existing_user and existing_user.password_hash == UNUSABLE_PASSWORD:
+        # Imported by a teacher and never activated. Only the mailbox owner may choose
+        # the password, so send the invitation again instead of taking this one.
+        resent = (await db.execute(
+            text("""
+                INSERT INTO email_outbox (to_address, subject, body)
+                SELECT :to_address, :subject, :body
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM email_outbox
+                    WHERE to_address = :to_address
+                    AND subject = :subject
+                    AND created_at > CURRENT_TIMESTAMP - make_interval(secs => :interval)
+                )
+                RETURNING id
+            """),
+            {
+                "to_address": user.email,
+                "subject": INVITATION_SUBJECT,
+                "body": invitation_body(existing_user.verification_key),
+                "interval": INVITATION_RESEND_INTERVAL
+            }
+        )).fetchone()
+        await db.commit()
+        if resent:
+            mail_sender.notify()
+        return {"message": "You were already added to a class. Please use the link we emailed you to choose your password."}
+
     if existing_user:
         print(f"User already exists: {user.email}")  # Debug log
         raise HTTPException(
@@ -115,11 +194,11 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
     
     # Create user with verification key
     verification_key = str(uuid.uuid4())
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     
     try:
         # Insert new user
-        result = db.execute(
+        result = await db.execute(
             text("""
                 INSERT INTO users (email, password_hash, verification_key, is_verified)
                 VALUES (:email, :password_hash, :verification_key, false)
@@ -132,12 +211,11 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
             }
         )
         new_user = result.fetchone()
-        db.commit()
         
         print(f"Created user: {new_user}")  # Debug log
         
-        # Send verification email
-        verification_url = f"http://localhost:8501/verify?key={verification_key}"
+        # Queue verification email, it is committed together with the user
+        verification_url = f"{FRONTEND_URL}/verify?key={verification_key}"
         email_body = f"""
 Welcome to the Course Platform!
 
@@ -146,36 +224,72 @@ Please verify your email by clicking the following link:
 
 If you did not create this account, please ignore this email.
 """
-        send_email(
+        await enqueue_email(
+            db,
             to_address=user.email,
             subject="Verify your Course Platform account",
             body=email_body
         )
+        await db.commit()
+        mail_sender.notify()
         
-        print(f"Sent verification email to: {user.email}")  # Debug log
+        print(f"Queued verification email to: {user.email}")  # Debug log
         return {"message": "Registration successful. Please check your email to verify your account."}
         
     except Exception as e:
         print(f"Error during registration: {str(e)}")  # Debug log
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
+class InvitationAccept(BaseModel):
+    password: str
+
+    @field_validator('password')
+    @classmethod
+    def password_strength(cls, v: str) -> str:
+        return check_password_strength(v)
+
+@app.post("/invitations/{key}/accept")
+async def accept_invitation(key: uuid.UUID, invitation: InvitationAccept, db: AsyncSession = Depends(get_db)):
+    """Set the first password of an imported user. The emailed key also verifies the address."""
+    hashed_password = await hash_password(invitation.password)
+    user = (await db.execute(
+        text("""
+            UPDATE users
+            SET password_hash = :password_hash,
+                is_verified = true,
+                verification_key = NULL
+            WHERE verification_key = :key AND password_hash = :unusable
+            RETURNING email
+        """),
+        {"password_hash": hashed_password, "key": key, "unusable": UNUSABLE_PASSWORD}
+    )).fetchone()
+
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid or already used invitation"
+        )
+    await db.commit()
+    invalidate_user(user.email)
+    return {"message": "Password set, you can now log in", "email": user.email}
+
 @app.get("/verify/{key}")
-async def verify_email(key: str, db: Session = Depends(get_db)):
+async def verify_email(key: str, db: AsyncSession = Depends(get_db)):
     print(f"Verification attempt with key: {key}")  # Debug log
     
     # First check if this key was ever associated with a user
-    user = db.execute(
+    user = (await db.execute(
         text("""
-            SELECT * FROM users 
+            SELECT id, email, is_verified FROM users 
             WHERE verification_key = :key 
             OR (verification_key IS NULL AND is_verified = true)
         """),
         {"key": key}
-    ).fetchone()
+    )).fetchone()
 
     print(f"Found user: {user}")  # Debug log
 
@@ -186,6 +300,17 @@ async def verify_email(key: str, db: Session = Depends(get_db)):
             detail="Invalid verification key"
         )
 
+    # Invitation keys set the first password as well, only accept_invitation may use them
+    invited = (await db.execute(
+        text("SELECT 1 FROM users WHERE verification_key = :key AND password_hash = :unusable"),
+        {"key": key, "unusable": UNUSABLE_PASSWORD}
+    )).fetchone()
+    if invited:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This link is an invitation, please choose a password through the invitation email"
+        )
+
     # If user is already verified, return success
     if user.is_verified:
         print(f"User already verified: {user.email}")  # Debug log
@@ -193,24 +318,26 @@ async def verify_email(key: str, db: Session = Depends(get_db)):
 
     try:
         # Update the user to verified status
-        result = db.execute(
+        result = await db.execute(
             text("""
                 UPDATE users 
                 SET is_verified = true,
                     verification_key = NULL
-                WHERE verification_key = :key
+                WHERE verification_key = :key AND password_hash <> :unusable
                 RETURNING id, email
             """),
-            {"key": key}
+            {"key": key, "unusable": UNUSABLE_PASSWORD}
         )
         updated_user = result.fetchone()
-        db.commit()
+        await db.commit()
+        if updated_user:
+            invalidate_user(updated_user.email)
         
         print(f"Successfully verified user: {updated_user}")  # Debug log
         return {"message": "Email verified successfully"}
     except Exception as e:
         print(f"Error during verification: {str(e)}")  # Debug log
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
@@ -219,7 +346,7 @@ async def verify_email(key: str, db: Session = Depends(get_db)):
 
 
 from fastapi import FastAPI, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from lib.database import get_db
 from lib.auth import get_current_user
@@ -227,19 +354,19 @@ from lib.auth import get_current_user
 @app.get("/credits/summary")
 async def get_user_credits(
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    credits_info = db.execute(
+    credits_info = (await db.execute(
         text("""
             SELECT 
-                available_credits,
+                balance AS available_credits,
                 total_transactions,
                 last_transaction_date
-            FROM user_available_credits 
+            FROM credit_balances 
             WHERE user_id = :user_id
         """),
         {"user_id": current_user.id}
-    ).fetchone()
+    )).fetchone()
     
     if not credits_info:
         return {
@@ -258,7 +385,7 @@ async def get_user_credits(
 
 from fastapi import FastAPI, Depends, HTTPException, status
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from lib.database import get_db
 from lib.auth import get_current_user
@@ -270,10 +397,10 @@ class ClassCreate(BaseModel):
 async def create_class(
     class_data: ClassCreate,
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
-        result = db.execute(
+        result = await db.execute(
             text("""
                 INSERT INTO classes (owner_id, name)
                 VALUES (:owner_id, :name)
@@ -285,7 +412,7 @@ async def create_class(
             }
         )
         new_class = result.fetchone()
-        db.commit()
+        await db.commit()
         
         return {
             "id": new_class.id,
@@ -294,7 +421,7 @@ async def create_class(
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         # Check if the error is due to duplicate name
         if "unique constraint" in str(e).lower():
             raise HTTPException(
@@ -308,31 +435,48 @@ async def create_class(
 
 
 
+from fastapi import Query
+from typing import Optional
+from lib.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, like_prefix, page
+
 @app.get("/classes/administered")
 async def get_administered_classes(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
+    conditions = ["owner_id = :user_id"]
+    params = {"user_id": current_user.id, "limit": limit + 1}
+
+    after = decode_cursor(cursor)
+    if after:
+        conditions.append("(created_at, id) < (:after_created_at, :after_id)")
+        params.update(after_created_at=after[0], after_id=after[1])
+
     try:
-        result = db.execute(
-            text("""
+        result = await db.execute(
+            text(f"""
                 SELECT id, name, created_at
                 FROM classes 
-                WHERE owner_id = :user_id
-                ORDER BY created_at DESC
+                WHERE {' AND '.join(conditions)}
+                ORDER BY created_at DESC, id DESC
+                LIMIT :limit
             """),
-            {"user_id": current_user.id}
+            params
         )
         classes = result.fetchall()
         
-        return [
-            {
+        return page(
+            classes,
+            limit,
+            lambda c: {
                 "id": c.id,
                 "name": c.name,
                 "created_at": c.created_at.isoformat()
-            }
-            for c in classes
-        ]
+            },
+            lambda c: (c.created_at, c.id)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -341,30 +485,43 @@ async def get_administered_classes(
 
 @app.get("/classes/enrolled")
 async def get_enrolled_classes(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
+    conditions = ["s.user_id = :user_id"]
+    params = {"user_id": current_user.id, "limit": limit + 1}
+
+    after = decode_cursor(cursor)
+    if after:
+        conditions.append("(s.created_at, s.id) < (:after_created_at, :after_id)")
+        params.update(after_created_at=after[0], after_id=after[1])
+
     try:
-        result = db.execute(
-            text("""
-                SELECT c.id, c.name, s.created_at as enrollment_date
+        result = await db.execute(
+            text(f"""
+                SELECT c.id, c.name, s.id AS student_id, s.created_at as enrollment_date
                 FROM classes c
                 JOIN students s ON c.id = s.class_id
-                WHERE s.user_id = :user_id
-                ORDER BY s.created_at DESC
+                WHERE {' AND '.join(conditions)}
+                ORDER BY s.created_at DESC, s.id DESC
+                LIMIT :limit
             """),
-            {"user_id": current_user.id}
+            params
         )
         classes = result.fetchall()
         
-        return [
-            {
+        return page(
+            classes,
+            limit,
+            lambda c: {
                 "id": c.id,
                 "name": c.name,
                 "enrolled_at": c.enrollment_date.isoformat()
-            }
-            for c in classes
-        ]
+            },
+            lambda c: (c.enrollment_date, c.student_id)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -376,11 +533,15 @@ async def get_enrolled_classes(
 @app.get("/classes/{class_id}/students")
 async def get_class_students(
     class_id: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    verified: Optional[bool] = None,
+    email_prefix: Optional[str] = None,
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # First verify that the current user is the administrator of this class
-    class_check = db.execute(
+    class_check = (await db.execute(
         text("""
             SELECT id FROM classes 
             WHERE id = :class_id AND owner_id = :user_id
@@ -389,47 +550,965 @@ async def get_class_students(
             "class_id": class_id,
             "user_id": current_user.id
         }
-    ).fetchone()
+    )).fetchone()
     
     if not class_check:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You are not the administrator of this class"
         )
+
+    # Only add the filters that are used, so every variant gets a plan that can use the keyset index
+    conditions = ["s.class_id = :class_id"]
+    params = {"class_id": class_id, "limit": limit + 1}
+
+    after = decode_cursor(cursor)
+    if after:
+        conditions.append("(s.created_at, s.id) < (:after_created_at, :after_id)")
+        params.update(after_created_at=after[0], after_id=after[1])
+    if verified is not None:
+        conditions.append("u.is_verified = :verified")
+        params["verified"] = verified
+    if email_prefix:
+        conditions.append("u.email LIKE :email_pattern")
+        params["email_pattern"] = like_prefix(email_prefix)
     
     # Get student information
     try:
-        result = db.execute(
-            text("""
+        result = await db.execute(
+            text(f"""
                 SELECT 
+                    s.id AS student_id,
                     u.id,
                     u.email,
                     u.is_verified,
                     s.created_at as enrollment_date
                 FROM students s
                 JOIN users u ON s.user_id = u.id
-                WHERE s.class_id = :class_id
-                ORDER BY s.created_at DESC
+                WHERE {' AND '.join(conditions)}
+                ORDER BY s.created_at DESC, s.id DESC
+                LIMIT :limit
             """),
-            {"class_id": class_id}
+            params
         )
         students = result.fetchall()
         
-        return [
-            {
+        return page(
+            students,
+            limit,
+            lambda student: {
                 "id": student.id,
                 "email": student.email,
                 "is_verified": student.is_verified,
                 "enrolled_at": student.enrollment_date.isoformat()
+            },
+            lambda student: (student.enrollment_date, student.student_id)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+
+from email_validator import validate_email, EmailNotValidError
+
+STUDENT_IMPORT_MAX_EMAILS = 10000
+
+class StudentImport(BaseModel):
+    emails: str  # one email per line, as entered in the "Add Students" text field
+    domain: Optional[str] = None  # expected email domain, defaults to the administrator's own
+
+@app.post("/classes/{class_id}/students/import")
+async def import_students(
+    class_id: int,
+    import_data: StudentImport,
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    class_check = (await db.execute(
+        text("""
+            SELECT id FROM classes 
+            WHERE id = :class_id AND owner_id = :user_id
+        """),
+        {
+            "class_id": class_id,
+            "user_id": current_user.id
+        }
+    )).fetchone()
+    
+    if not class_check:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not the administrator of this class"
+        )
+
+    lines = import_data.emails.splitlines()
+    if len(lines) > STUDENT_IMPORT_MAX_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {STUDENT_IMPORT_MAX_EMAILS} emails can be imported at once"
+        )
+
+    domain = (import_data.domain or current_user.email.rsplit('@', 1)[-1]).strip().lower()
+
+    # Validate and deduplicate in one pass, the database only sees unique valid emails
+    results = []
+    seen = {}
+    for line_number, line in enumerate(lines, start=1):
+        raw = line.strip()
+        if not raw:
+            continue
+        try:
+            email = validate_email(raw, check_deliverability=False).normalized
+        except EmailNotValidError as e:
+            results.append({"line": line_number, "email": raw, "status": "invalid", "error": str(e)})
+            continue
+
+        entry = {
+            "line": line_number,
+            "email": email,
+            "status": "duplicate" if email in seen else None,
+            "domain_mismatch": email.rsplit('@', 1)[-1].lower() != domain,
+        }
+        seen.setdefault(email, entry)
+        results.append(entry)
+
+    if seen:
+        try:
+            # Create missing users and enroll everyone in a single set-based statement
+            rows = (await db.execute(
+                text("""
+                    WITH input AS (
+                        SELECT DISTINCT email FROM unnest(CAST(:emails AS text[])) AS t(email)
+                    ),
+                    new_users AS (
+                        INSERT INTO users (email, password_hash, verification_key, is_verified)
+                        SELECT email, CAST(:password_hash AS text), uuid_generate_v4(), false
+                        FROM input
+                        ON CONFLICT (email) DO NOTHING
+                        RETURNING id, email, verification_key
+                    ),
+                    class_users AS (
+                        SELECT id, email FROM new_users
+                        UNION ALL
+                        SELECT u.id, u.email FROM users u JOIN input i ON i.email = u.email
+                    ),
+                    new_students AS (
+                        INSERT INTO students (class_id, user_id)
+                        SELECT CAST(:class_id AS int), id FROM class_users
+                        ON CONFLICT (user_id, class_id) DO NOTHING
+                        RETURNING user_id
+                    )
+                    SELECT 
+                        cu.email,
+                        nu.verification_key,
+                        nu.id IS NOT NULL AS user_created,
+                        cu.id IN (SELECT user_id FROM new_students) AS enrolled
+                    FROM class_users cu
+                    LEFT JOIN new_users nu ON nu.id = cu.id
+                """),
+                {
+                    "emails": list(seen.keys()),
+                    "password_hash": UNUSABLE_PASSWORD,
+                    "class_id": class_id
+                }
+            )).fetchall()
+
+            # New users can't log in until they choose a password, invite them in the same transaction
+            invited = [row for row in rows if row.user_created]
+            if invited:
+                await enqueue_emails(
+                    db,
+                    [row.email for row in invited],
+                    INVITATION_SUBJECT,
+                    [invitation_body(row.verification_key) for row in invited]
+                )
+            await db.commit()
+            if invited:
+                mail_sender.notify()
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=str(e)
+            )
+
+        for row in rows:
+            entry = seen[row.email]
+            entry["status"] = "enrolled" if row.enrolled else "already_enrolled"
+            entry["user_created"] = row.user_created
+
+        # Users created by a concurrent request are invisible to the statement above
+        for entry in seen.values():
+            if entry["status"] is None:
+                entry["status"] = "skipped"
+                entry["error"] = "Email was registered concurrently, please import it again"
+
+    summary = {"total": len(results), "domain": domain, "domain_mismatches": 0, "users_created": 0}
+    for entry in results:
+        summary[entry["status"]] = summary.get(entry["status"], 0) + 1
+        summary["domain_mismatches"] += entry.get("domain_mismatch", False)
+        summary["users_created"] += entry.get("user_created", False)
+
+    return {"summary": summary, "results": results}
+
+
+
+from typing import List
+from lib.credits import deduct_credits, credit_balance, InsufficientCredits
+
+class ModuleAssignment(BaseModel):
+    module_id: int
+    test_date: dt.date  # first day the module's questions are sent out
+    user_ids: Optional[List[int]] = None  # students to assign, the whole class when omitted
+
+@app.post("/classes/{class_id}/assign-module")
+async def assign_module(
+    class_id: int,
+    assignment: ModuleAssignment,
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    class_check = (await db.execute(
+        text("""
+            SELECT id FROM classes 
+            WHERE id = :class_id AND owner_id = :user_id
+        """),
+        {
+            "class_id": class_id,
+            "user_id": current_user.id
+        }
+    )).fetchone()
+    
+    if not class_check:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not the administrator of this class"
+        )
+
+    if assignment.test_date < dt.date.today():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The test date can not be in the past"
+        )
+
+    selection = {
+        "class_id": class_id,
+        "user_ids": assignment.user_ids
+    }
+
+    module = (await db.execute(
+        text("""
+            SELECT 
+                m.id,
+                m.course_id,
+                co.credit_cost,
+                (
+                    SELECT COUNT(*) 
+                    FROM questions_mc q 
+                    JOIN module_pages p ON p.id = q.module_page_id 
+                    WHERE p.module_id = m.id
+                ) AS question_count,
+                (
+                    SELECT COUNT(*) 
+                    FROM students s 
+                    WHERE s.class_id = :class_id 
+                    AND (CAST(:user_ids AS int[]) IS NULL OR s.user_id = ANY(CAST(:user_ids AS int[])))
+                ) AS student_count
+            FROM modules m
+            JOIN courses co ON co.id = m.course_id
+            WHERE m.id = :module_id
+        """),
+        {"module_id": assignment.module_id, **selection}
+    )).fetchone()
+
+    if not module:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Module not found"
+        )
+
+    if module.student_count == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="None of the selected students are in this class"
+        )
+
+    try:
+        # One assignment per selected student and question of the module, in a single statement.
+        # A student has at most one open assignment per question (uq_assignments_open), so a
+        # repeated request, e.g. a double click or client retry, creates nothing new.
+        created = (await db.execute(
+            text("""
+                WITH new_assignments AS (
+                    INSERT INTO assignments (student_id, question_mc_id, test_date, access_token, status)
+                    SELECT s.id, q.id, CAST(:test_date AS date), uuid_generate_v4(), 'pending'
+                    FROM students s
+                    CROSS JOIN (
+                        SELECT q.id 
+                        FROM questions_mc q 
+                        JOIN module_pages p ON p.id = q.module_page_id 
+                        WHERE p.module_id = :module_id
+                    ) q
+                    WHERE s.class_id = :class_id
+                    AND (CAST(:user_ids AS int[]) IS NULL OR s.user_id = ANY(CAST(:user_ids AS int[])))
+                    ON CONFLICT (student_id, question_mc_id) WHERE status IN ('pending', 'sent') DO NOTHING
+                    RETURNING student_id
+                )
+                SELECT COUNT(*) AS assignments, COUNT(DISTINCT student_id) AS students
+                FROM new_assignments
+            """),
+            {
+                "module_id": module.id,
+                "test_date": assignment.test_date,
+                **selection
             }
-            for student in students
-        ]
+        )).fetchone()
+
+        if created.assignments == 0:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="The module is already assigned to the selected students"
+            )
+
+        # Only students who actually received new assignments are charged
+        credit_cost = module.credit_cost * created.students
+
+        enrollment = (await db.execute(
+            text("""
+                INSERT INTO enrollments (class_id, course_id)
+                VALUES (:class_id, :course_id)
+                RETURNING id
+            """),
+            {
+                "class_id": class_id,
+                "course_id": module.course_id
+            }
+        )).fetchone()
+
+        # Free courses (credit_cost 0) leave no ledger row
+        if credit_cost > 0:
+            available_credits = await deduct_credits(
+                db,
+                user_id=current_user.id,
+                amount=credit_cost,
+                reference=f"enrollment:{enrollment.id}"
+            )
+        else:
+            available_credits = await credit_balance(db, current_user.id)
+
+        await db.commit()
+
+    except HTTPException:
+        raise
+    except InsufficientCredits as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=str(e)
+        )
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+    return {
+        "enrollment_id": enrollment.id,
+        "course_id": module.course_id,
+        "module_id": module.id,
+        "students": created.students,
+        "questions": module.question_count,
+        "assignments_created": created.assignments,
+        "credits_deducted": credit_cost,
+        "available_credits": available_credits
+    }
+
+
+
+DASHBOARD_STUDENTS_PER_CLASS = 100
+
+@app.get("/dashboard")
+async def get_dashboard(
+    students_per_class: int = DASHBOARD_STUDENTS_PER_CLASS,
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Everything the dashboard page shows, built from a fixed number of batched queries."""
+    students_per_class = max(0, min(students_per_class, 1000))
+    try:
+        credits_info = (await db.execute(
+            text("""
+                SELECT 
+                    balance AS available_credits,
+                    total_transactions,
+                    last_transaction_date
+                FROM credit_balances 
+                WHERE user_id = :user_id
+            """),
+            {"user_id": current_user.id}
+        )).fetchone()
+
+        administered = (await db.execute(
+            text("""
+                SELECT 
+                    c.id,
+                    c.name,
+                    c.created_at,
+                    (SELECT COUNT(*) FROM students s WHERE s.class_id = c.id) AS student_count
+                FROM classes c
+                WHERE c.owner_id = :user_id
+                ORDER BY c.created_at DESC
+            """),
+            {"user_id": current_user.id}
+        )).fetchall()
+
+        # Students of all administered classes at once, newest first and capped per class
+        students_by_class = {c.id: [] for c in administered}
+        if administered and students_per_class:
+            students = (await db.execute(
+                text("""
+                    SELECT 
+                        c.id AS class_id,
+                        st.id,
+                        st.email,
+                        st.is_verified,
+                        st.enrollment_date
+                    FROM unnest(CAST(:class_ids AS int[])) AS c(id)
+                    CROSS JOIN LATERAL (
+                        SELECT 
+                            u.id,
+                            u.email,
+                            u.is_verified,
+                            s.created_at AS enrollment_date
+                        FROM students s
+                        JOIN users u ON s.user_id = u.id
+                        WHERE s.class_id = c.id
+                        ORDER BY s.created_at DESC
+                        LIMIT :limit
+                    ) st
+                """),
+                {
+                    "class_ids": list(students_by_class.keys()),
+                    "limit": students_per_class
+                }
+            )).fetchall()
+            for student in students:
+                students_by_class[student.class_id].append({
+                    "id": student.id,
+                    "email": student.email,
+                    "is_verified": student.is_verified,
+                    "enrolled_at": student.enrollment_date.isoformat()
+                })
+
+        enrolled = (await db.execute(
+            text("""
+                SELECT c.id, c.name, s.created_at as enrollment_date
+                FROM classes c
+                JOIN students s ON c.id = s.class_id
+                WHERE s.user_id = :user_id
+                ORDER BY s.created_at DESC
+            """),
+            {"user_id": current_user.id}
+        )).fetchall()
+
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
+    return {
+        "user": {
+            "email": current_user.email,
+            "id": current_user.id,
+            "is_verified": current_user.is_verified
+        },
+        "credits": {
+            "available_credits": credits_info.available_credits if credits_info else 0,
+            "total_transactions": credits_info.total_transactions if credits_info else 0,
+            "last_transaction_date": credits_info.last_transaction_date.isoformat() if credits_info and credits_info.last_transaction_date else None
+        },
+        "administered_classes": [
+            {
+                "id": c.id,
+                "name": c.name,
+                "created_at": c.created_at.isoformat(),
+                "student_count": c.student_count,
+                "students": students_by_class[c.id]
+            }
+            for c in administered
+        ],
+        "enrolled_classes": [
+            {
+                "id": c.id,
+                "name": c.name,
+                "enrolled_at": c.enrollment_date.isoformat()
+            }
+            for c in enrolled
+        ]
+    }
+
+
+
+from fastapi.responses import StreamingResponse
+from lib.export import stream_student_activity, ndjson_export, csv_export, EXPORT_MEDIA_TYPES
+
+def activity_export_response(chunks, format: str, filename: str) -> StreamingResponse:
+    body = csv_export(chunks) if format == "csv" else ndjson_export(chunks)
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'}
+    )
+
+@app.get("/classes/{class_id}/export")
+async def export_class_activity(
+    class_id: int,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    class_check = (await db.execute(
+        text("""
+            SELECT id FROM classes 
+            WHERE id = :class_id AND owner_id = :user_id
+        """),
+        {
+            "class_id": class_id,
+            "user_id": current_user.id
+        }
+    )).fetchone()
+    
+    if not class_check:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not the administrator of this class"
+        )
+
+    return activity_export_response(
+        stream_student_activity(class_id),
+        format,
+        f"class-{class_id}-activity"
+    )
+
+@app.get("/classes/{class_id}/students/{user_id}/export")
+async def export_student_activity(
+    class_id: int,
+    user_id: int,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    student_check = (await db.execute(
+        text("""
+            SELECT s.id FROM students s
+            JOIN classes c ON c.id = s.class_id
+            WHERE s.class_id = :class_id AND s.user_id = :student_user_id AND c.owner_id = :user_id
+        """),
+        {
+            "class_id": class_id,
+            "student_user_id": user_id,
+            "user_id": current_user.id
+        }
+    )).fetchone()
+    
+    if not student_check:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="This student is not in a class you administer"
+        )
+
+    return activity_export_response(
+        stream_student_activity(class_id, user_id),
+        format,
+        f"class-{class_id}-student-{user_id}-activity"
+    )
+
+
+
+from lib.grading import answer_key, attempt_buffer, assignment_cache
+
+class AnswerSubmission(BaseModel):
+    answer_option_id: int
+
+@app.post("/assignments/{access_token}/answer")
+async def submit_answer(
+    access_token: str,
+    submission: AnswerSubmission,
+    db: AsyncSession = Depends(get_db)
+):
+    """Grade an answer against the in-memory answer key and return feedback right away.
+
+    The visit and attempt are written by the attempt buffer shortly after.
+    """
+    try:
+        access_token = str(uuid.UUID(access_token))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Assignment not found"
+        )
+
+    assignment = assignment_cache.get(access_token)
+    if assignment is None:
+        assignment = (await db.execute(
+            text("""
+                SELECT id, question_mc_id, status, expiration_date
+                FROM assignments
+                WHERE access_token = :access_token
+            """),
+            {"access_token": access_token}
+        )).fetchone()
+        if not assignment:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Assignment not found"
+            )
+        assignment_cache.set(access_token, assignment)
+
+    if assignment.status == 'expired' or assignment.expiration_date < dt.date.today():
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="This assignment has expired"
+        )
+
+    option = await answer_key.get(submission.answer_option_id)
+    if option is None or option.question_mc_id != assignment.question_mc_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This answer option does not belong to the assignment's question"
+        )
+
+    if attempt_buffer.is_full():
+        # The flusher is falling behind, write synchronously instead of growing the buffer
+        try:
+            await attempt_buffer.flush()
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e)
+            )
+    attempt_buffer.add(assignment.id, option.id, dt.datetime.now(dt.timezone.utc))
+
+    return {
+        "correct": option.is_correct,
+        "feedback": option.feedback_message
+    }
+
+
+
+from fastapi import Request, Response
+from lib.content import content_snapshots
+
+@app.get("/courses/{course_id}/content")
+async def get_course_content(
+    course_id: int,
+    request: Request,
+    current_user = Depends(get_current_user)
+):
+    """The whole course version as one precomputed snapshot, no database access once cached."""
+    snapshot = await content_snapshots.get(course_id)
+    if snapshot is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Course not found"
+        )
+
+    headers = {
+        "ETag": snapshot.etag,
+        # A course version never changes, so clients may keep it as long as they like
+        "Cache-Control": "private, max-age=31536000, immutable"
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or snapshot.etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+
+
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi.responses import FileResponse
+from lib.media import media_index, MEDIA_MAX_AGE
+
+@app.get("/media/{media_id}")
+async def get_media(
+    media_id: int,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=4096)
+):
+    """Serve a media file with content-hash ETags, conditional GETs and Range support.
+
+    Images are served as the smallest derivative at least `w` pixels wide, as WebP
+    when the client accepts it. Public, media is embedded in course pages with
+    plain <img>/<video> tags.
+    """
+    media = await media_index.get(media_id)
+    path = media.choose(w, request.headers.get("accept", "")) if media else None
+    info = await media_index.file_info(path) if path else None
+    if info is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Media not found"
+        )
+
+    headers = {
+        "ETag": info.etag,
+        "Last-Modified": formatdate(info.mtime, usegmt=True),
+        "Cache-Control": f"public, max-age={MEDIA_MAX_AGE}"
+    }
+    if media.variants:
+        headers["Vary"] = "Accept"
+
+    # If-None-Match wins over If-Modified-Since when both are sent
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match:
+        not_modified = if_none_match.strip() == "*" or info.etag in [tag.strip() for tag in if_none_match.split(",")]
+    elif if_modified_since:
+        try:
+            not_modified = int(info.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            not_modified = False
+    else:
+        not_modified = False
+    if not_modified:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # FileResponse answers Range requests itself and streams from the file without loading it
+    return FileResponse(path, media_type=info.media_type, headers=headers)
+
+
+
+from lib.certificates import certificate_index
+
+@app.get("/certificates/{access_token}/verify")
+async def verify_certificate(access_token: str, response: Response):
+    """Public certificate check, answered from memory."""
+    try:
+        access_token = str(uuid.UUID(access_token))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Certificate not found"
+        )
+
+    certificate = await certificate_index.get(access_token)
+    if certificate is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Certificate not found"
+        )
+
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return {
+        "valid": certificate.valid_until >= dt.date.today(),
+        "course": certificate.course_name,
+        "course_version": certificate.course_version,
+        "issued_at": certificate.issued_at.isoformat(),
+        "valid_until": certificate.valid_until.isoformat()
+    }
+
+
+from lib.certificates import certificate_issuer, CertificateFields
+
+@app.get("/certificates/{access_token}/pdf")
+async def get_certificate_pdf(access_token: str, db: AsyncSession = Depends(get_db)):
+    """The certificate as PDF, the access token is what the holder shares with verifiers."""
+    try:
+        access_token = str(uuid.UUID(access_token))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Certificate not found"
+        )
+
+    certificate = (await db.execute(
+        text("""
+            SELECT c.access_token, c.valid_until, c.created_at, u.email, co.name AS course_name, co.version AS course_version
+            FROM certificates c
+            JOIN students s ON s.id = c.student_id
+            JOIN users u ON u.id = s.user_id
+            JOIN courses co ON co.id = c.course_id
+            WHERE c.access_token = :access_token
+        """),
+        {"access_token": access_token}
+    )).fetchone()
+
+    if not certificate:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Certificate not found"
+        )
+
+    path = await certificate_issuer.pdf(CertificateFields(
+        str(certificate.access_token),
+        certificate.email,
+        certificate.course_name,
+        certificate.course_version,
+        certificate.created_at.date().isoformat(),
+        certificate.valid_until.isoformat()
+    ))
+    return FileResponse(
+        path,
+        media_type="application/pdf",
+        filename=f"certificate-{access_token}.pdf",
+        headers={"Cache-Control": "private, max-age=86400"}
+    )
+
+
+
+from types import SimpleNamespace
+
+PROGRESS_COUNTERS = """
+    COALESCE(SUM({t}.assignments_total), 0) AS assignments_total,
+    COALESCE(SUM({t}.assignments_pending), 0) AS assignments_pending,
+    COALESCE(SUM({t}.assignments_sent), 0) AS assignments_sent,
+    COALESCE(SUM({t}.assignments_completed), 0) AS assignments_completed,
+    COALESCE(SUM({t}.assignments_expired), 0) AS assignments_expired,
+    COALESCE(SUM({t}.visits), 0) AS visits,
+    COALESCE(SUM({t}.attempts), 0) AS attempts,
+    COALESCE(SUM({t}.correct_attempts), 0) AS correct_attempts,
+    MAX({t}.last_activity_at) AS last_activity_at
+"""
+
+def progress_summary(row) -> dict:
+    return {
+        "assignments": row.assignments_total,
+        "pending": row.assignments_pending,
+        "sent": row.assignments_sent,
+        "completed": row.assignments_completed,
+        "overdue": row.assignments_expired,
+        "completion_rate": round(row.assignments_completed / row.assignments_total, 4) if row.assignments_total else 0.0,
+        "visits": row.visits,
+        "attempts": row.attempts,
+        "correct_attempts": row.correct_attempts,
+        "accuracy": round(row.correct_attempts / row.attempts, 4) if row.attempts else 0.0,
+        "last_activity_at": row.last_activity_at.isoformat() if row.last_activity_at else None
+    }
+
+@app.get("/classes/{class_id}/progress")
+async def get_class_progress(
+    class_id: int,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Completion, overdue and attempt statistics from the progress rollups, per course and per student."""
+    class_check = (await db.execute(
+        text("""
+            SELECT id FROM classes 
+            WHERE id = :class_id AND owner_id = :user_id
+        """),
+        {
+            "class_id": class_id,
+            "user_id": current_user.id
+        }
+    )).fetchone()
+    
+    if not class_check:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not the administrator of this class"
+        )
+
+    courses = (await db.execute(
+        text(f"""
+            SELECT co.id, co.name, co.version, {PROGRESS_COUNTERS.format(t='cp')}
+            FROM class_progress cp
+            JOIN courses co ON co.id = cp.course_id
+            WHERE cp.class_id = :class_id
+            GROUP BY co.id
+            ORDER BY co.name, co.version
+        """),
+        {"class_id": class_id}
+    )).fetchall()
+
+    conditions = ["s.class_id = :class_id"]
+    params = {"class_id": class_id, "limit": limit + 1}
+    after = decode_cursor(cursor)
+    if after:
+        conditions.append("(s.created_at, s.id) < (:after_created_at, :after_id)")
+        params.update(after_created_at=after[0], after_id=after[1])
+
+    students = (await db.execute(
+        text(f"""
+            SELECT s.id AS student_id, s.created_at, u.id, u.email, progress.*
+            FROM students s
+            JOIN users u ON u.id = s.user_id
+            CROSS JOIN LATERAL (
+                SELECT {PROGRESS_COUNTERS.format(t='sp')}
+                FROM student_progress sp
+                WHERE sp.student_id = s.id
+            ) progress
+            WHERE {' AND '.join(conditions)}
+            ORDER BY s.created_at DESC, s.id DESC
+            LIMIT :limit
+        """),
+        params
+    )).fetchall()
+
+    total = dict.fromkeys(["assignments_total", "assignments_pending", "assignments_sent", "assignments_completed",
+                           "assignments_expired", "visits", "attempts", "correct_attempts"], 0)
+    for course in courses:
+        for key in total:
+            total[key] += getattr(course, key)
+    total["last_activity_at"] = max((c.last_activity_at for c in courses if c.last_activity_at), default=None)
+
+    return {
+        "class_id": class_id,
+        "total": progress_summary(SimpleNamespace(**total)),
+        "courses": [
+            {
+                "id": course.id,
+                "name": course.name,
+                "version": course.version,
+                **progress_summary(course)
+            }
+            for course in courses
+        ],
+        "students": page(
+            students,
+            limit,
+            lambda student: {
+                "id": student.id,
+                "email": student.email,
+                **progress_summary(student)
+            },
+            lambda student: (student.created_at, student.student_id)
+        )
+    }
+
+
+
+
+
+
+
+from lib.database import pool_status
+from lib.auth import password_hashing_status
+from lib.metrics import status_collector, render_metrics, METRICS_CONTENT_TYPE
+
+status_collector.register("pool", pool_status)
+status_collector.register("password_hashing", password_hashing_status)
+status_collector.register("mail", mail_sender.status)
+status_collector.register("assignment_delivery", assignment_delivery.status)
+status_collector.register("answers", attempt_buffer.status)
+status_collector.register("content", content_snapshots.status)
+status_collector.register("media", media_index.status)
+status_collector.register("media_derivatives", derivative_worker.status)
+status_collector.register("certificates", certificate_index.status)
+status_collector.register("certificate_issuer", certificate_issuer.status)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 
 
 
@@ -437,9 +1516,13 @@ async def get_class_students(
 
 
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_db)):
     try:
-        db.execute(text("SELECT 1")).fetchone()
-        return {"status": "healthy"}
+        (await db.execute(text("SELECT 1"))).fetchone()
+        return {
+            "status": "healthy",
+            # The same components /metrics exports
+            **status_collector.statuses(),
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
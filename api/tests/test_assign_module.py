@@ -0,0 +1,109 @@
+"""Assigning a module of a free course (credit_cost 0).
+
+Needs the database from docker-compose.yml, see test_mail.py.
+"""
+import uuid
+import asyncio
+import datetime as dt
+from types import SimpleNamespace
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("asyncpg")
+from sqlalchemy import text
+
+from lib.auth import get_current_user
+from lib.database import AsyncSessionLocal, async_engine
+
+
+async def create_free_course(run: str) -> SimpleNamespace:
+    """An owner with a class of one student and a free course with one question."""
+    async with AsyncSessionLocal() as db:
+        owner_id = (await db.execute(
+            text("INSERT INTO users (email, password_hash) VALUES (:email, '!') RETURNING id"),
+            {"email": f"owner-{run}@example.com"}
+        )).scalar_one()
+        student_user_id = (await db.execute(
+            text("INSERT INTO users (email, password_hash) VALUES (:email, '!') RETURNING id"),
+            {"email": f"student-{run}@example.com"}
+        )).scalar_one()
+        class_id = (await db.execute(
+            text("INSERT INTO classes (owner_id, name) VALUES (:owner_id, :name) RETURNING id"),
+            {"owner_id": owner_id, "name": f"Test {run}"}
+        )).scalar_one()
+        await db.execute(
+            text("INSERT INTO students (class_id, user_id) VALUES (:class_id, :user_id)"),
+            {"class_id": class_id, "user_id": student_user_id}
+        )
+        course_id = (await db.execute(
+            text("INSERT INTO courses (name, version, credit_cost) VALUES (:name, 1, 0) RETURNING id"),
+            {"name": f"Free {run}"}
+        )).scalar_one()
+        module_id = (await db.execute(
+            text("""
+                INSERT INTO modules (course_id, name, version, sequence_number)
+                VALUES (:course_id, :name, 1, 1)
+                RETURNING id
+            """),
+            {"course_id": course_id, "name": f"Free {run}"}
+        )).scalar_one()
+        page_id = (await db.execute(
+            text("""
+                INSERT INTO module_pages (module_id, name, version, sequence_number)
+                VALUES (:module_id, :name, 1, 1)
+                RETURNING id
+            """),
+            {"module_id": module_id, "name": f"Free {run}"}
+        )).scalar_one()
+        await db.execute(
+            text("INSERT INTO questions_mc (module_page_id, question) VALUES (:page_id, 'Why?')"),
+            {"page_id": page_id}
+        )
+        await db.commit()
+    return SimpleNamespace(
+        owner=SimpleNamespace(id=owner_id, email=f"owner-{run}@example.com"),
+        user_ids=[owner_id, student_user_id],
+        class_id=class_id,
+        course_id=course_id,
+        module_id=module_id
+    )
+
+
+async def assign_free_module():
+    from main import app
+
+    run = uuid.uuid4().hex[:8]
+    setup = await create_free_course(run)
+    app.dependency_overrides[get_current_user] = lambda: setup.owner
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            body = {"module_id": setup.module_id, "test_date": dt.date.today().isoformat()}
+            response = await client.post(f"/classes/{setup.class_id}/assign-module", json=body)
+            assert response.status_code == 200, response.text
+            result = response.json()
+            assert result["assignments_created"] == 1
+            assert result["credits_deducted"] == 0
+            assert result["available_credits"] == 0
+
+            # Nothing new to assign the second time
+            response = await client.post(f"/classes/{setup.class_id}/assign-module", json=body)
+            assert response.status_code == 409
+
+        async with AsyncSessionLocal() as db:
+            ledger_rows = (await db.execute(
+                text("SELECT COUNT(*) FROM credits WHERE user_id = :user_id"),
+                {"user_id": setup.owner.id}
+            )).scalar_one()
+            assert ledger_rows == 0
+    finally:
+        app.dependency_overrides.pop(get_current_user, None)
+        async with AsyncSessionLocal() as db:
+            await db.execute(text("DELETE FROM courses WHERE id = :id"), {"id": setup.course_id})
+            await db.execute(text("DELETE FROM users WHERE id = ANY(CAST(:ids AS int[]))"), {"ids": setup.user_ids})
+            await db.commit()
+        await async_engine.dispose()
+
+
+def test_free_module_is_assigned_without_a_charge(database):
+    asyncio.run(assign_free_module())
@@ -0,0 +1,140 @@
+"""Outbox delivery against a local aiosmtpd server.
+
+    pip install -r api/requirements.txt -r api/tests/requirements.txt
+    POSTGRES_HOST=localhost ... pytest api/tests
+
+Needs the database from docker-compose.yml (POSTGRES_* like the API). Run it
+against a test database: the sender claims every due row in email_outbox.
+"""
+import uuid
+import socket
+import asyncio
+
+import pytest
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+pytest.importorskip("asyncpg")
+from sqlalchemy import text
+
+from lib import mail
+from lib.database import AsyncSessionLocal, async_engine
+
+
+class RecordingHandler:
+    """Accepts everything except recipients starting with "reject"."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("reject"):
+            return "550 5.1.1 Mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    handler = RecordingHandler()
+    controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    monkeypatch.setattr(mail, "EMAIL_ADDRESS", "courses@example.com")
+    monkeypatch.setattr(mail, "EMAIL_PASSWORD", None)
+    monkeypatch.setattr(mail, "SMTP_SERVER", controller.hostname)
+    monkeypatch.setattr(mail, "SMTP_PORT", controller.port)
+    monkeypatch.setattr(mail, "SMTP_USE_SSL", False)
+    yield handler
+    controller.stop()
+
+
+async def outbox_rows(ids):
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            text("""
+                SELECT id, to_address, status, attempts, last_error, sent_at,
+                       EXTRACT(EPOCH FROM next_attempt_at - CURRENT_TIMESTAMP) AS retry_in
+                FROM email_outbox
+                WHERE id = ANY(CAST(:ids AS int[]))
+                ORDER BY id
+            """),
+            {"ids": ids}
+        )).fetchall()
+    return {row.to_address: row for row in rows}
+
+
+async def deliver_with_retries(handler, monkeypatch):
+    monkeypatch.setattr(mail, "MAIL_BATCH_SIZE", 2)
+    monkeypatch.setattr(mail, "MAIL_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(mail, "MAIL_RETRY_BASE_DELAY", 60)
+    run = uuid.uuid4().hex[:8]
+    addresses = [f"first-{run}@example.com", f"second-{run}@example.com", f"reject-{run}@example.com"]
+
+    async with AsyncSessionLocal() as db:
+        pending = (await db.execute(
+            text("SELECT COUNT(*) FROM email_outbox WHERE status IN ('pending', 'sending')")
+        )).scalar()
+        if pending:
+            pytest.skip("email_outbox has undelivered mail, run against a test database")
+        for address in addresses:
+            await mail.enqueue_email(db, address, f"Test {run}", "Hello")
+        ids = (await db.execute(
+            text("SELECT id FROM email_outbox WHERE subject = :subject ORDER BY id"),
+            {"subject": f"Test {run}"}
+        )).scalars().all()
+        await db.commit()
+
+    sender = mail.MailSender()
+    try:
+        # Batches of MAIL_BATCH_SIZE, oldest first
+        assert await sender.process_batch() == 2
+        assert await sender.process_batch() == 1
+        assert await sender.process_batch() == 0
+
+        delivered = [rcpt for envelope in handler.messages for rcpt in envelope.rcpt_tos]
+        assert delivered == addresses[:2]
+        assert sender._connection.connects == 1
+
+        rows = await outbox_rows(ids)
+        for address in addresses[:2]:
+            assert rows[address].status == 'sent'
+            assert rows[address].attempts == 1
+            assert rows[address].sent_at is not None
+        rejected = rows[addresses[2]]
+        assert rejected.status == 'pending'
+        assert rejected.attempts == 1
+        assert "550" in rejected.last_error
+        # First retry after MAIL_RETRY_BASE_DELAY
+        assert 50 < rejected.retry_in <= 60
+
+        # Make the retry due, the second failure uses up MAIL_MAX_ATTEMPTS
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                text("UPDATE email_outbox SET next_attempt_at = CURRENT_TIMESTAMP WHERE id = :id"),
+                {"id": rejected.id}
+            )
+            await db.commit()
+        assert await sender.process_batch() == 1
+
+        rejected = (await outbox_rows(ids))[addresses[2]]
+        assert rejected.status == 'failed'
+        assert rejected.attempts == 2
+        assert sender.status()["sent"] == 2
+        assert sender.status()["retried"] == 1
+        assert sender.status()["failed"] == 1
+    finally:
+        await sender.stop()
+        await async_engine.dispose()
+
+
+def test_outbox_batches_retries_and_records_status(database, smtp_server, monkeypatch):
+    asyncio.run(deliver_with_retries(smtp_server, monkeypatch))
@@ -0,0 +1,265 @@
+"""Query-plan regression checks for the SQL the API runs.
+
+    python benchmarks/check_plans.py [--budget-ms 50] [--min-rows 10000] [--json report.json]
+
+Extracts every text("...") statement from api/main.py and api/lib/auth.py
+(add more with --file), binds sample values taken from the database and runs
+EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) on each, all inside one transaction
+that is rolled back. A statement fails when its plan sequentially scans a
+table with more than --min-rows rows or it takes longer than --budget-ms, and
+one that can't be explained at all (e.g. a missing column) is an error.
+
+f-strings are expanded with the module's string constants and the literal
+values their function assigns first (e.g. the base `conditions` list), so the
+checked variant is the one without optional filters. Meant to run against a
+database filled by generate_data.py.
+"""
+import os
+import re
+import ast
+import sys
+import json
+import uuid
+import argparse
+import datetime as dt
+from typing import List, NamedTuple, Optional
+
+import psycopg2
+
+from generate_data import connect
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FILES = ['api/main.py', 'api/lib/auth.py']
+BIND = re.compile(r'(?<![:\w]):(\w+)')
+UNUSABLE_PASSWORD = '!'  # lib.auth.UNUSABLE_PASSWORD
+
+
+class Statement(NamedTuple):
+    location: str  # file:line function
+    sql: str
+
+
+def literal_assignments(nodes) -> dict:
+    """Names assigned a literal (string, list of strings, ...) among these statements."""
+    names = {}
+    for node in nodes:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                names.setdefault(node.targets[0].id, ast.literal_eval(node.value))
+            except ValueError:
+                pass
+    return names
+
+
+def render(node, namespace: dict) -> Optional[str]:
+    """Source text of a text() argument, None when an f-string part can't be evaluated."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+                continue
+            try:
+                expression = compile(ast.Expression(value.value), '<sql>', 'eval')
+                parts.append(str(eval(expression, {'__builtins__': {}}, dict(namespace))))
+            except Exception:
+                return None
+        return ''.join(parts)
+    return None
+
+
+def extract_statements(path: str) -> tuple:
+    with open(os.path.join(ROOT, path)) as f:
+        tree = ast.parse(f.read())
+    module_names = literal_assignments(tree.body)
+
+    statements, skipped = [], []
+    functions = [node for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    seen = set()
+    for function in functions:
+        namespace = {**module_names, **literal_assignments(ast.walk(function))}
+        for node in ast.walk(function):
+            if isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'text' and node.args and id(node) not in seen:
+                seen.add(id(node))
+                location = f"{path}:{node.lineno} {function.name}"
+                sql = render(node.args[0], namespace)
+                if sql is None:
+                    skipped.append(location)
+                else:
+                    statements.append(Statement(location, sql.strip()))
+    return statements, skipped
+
+
+def sample_params(cur) -> dict:
+    """Realistic values for the bind parameters, centred on the class with the most students.
+
+    The keys and addresses only INSERTs use are ones nobody has yet, so those
+    statements don't stop at a unique violation. See insert_params() for email.
+    """
+    cur.execute("""
+        SELECT c.id, c.owner_id, u.email
+        FROM classes c
+        JOIN users u ON u.id = c.owner_id
+        JOIN students s ON s.class_id = c.id
+        GROUP BY c.id, u.email
+        ORDER BY COUNT(*) DESC
+        LIMIT 1
+    """)
+    class_id, owner_id, email = cur.fetchone()
+    cur.execute("SELECT user_id FROM students WHERE class_id = %s LIMIT 1", (class_id,))
+    student_user_id = cur.fetchone()[0]
+    cur.execute("SELECT course_id FROM enrollments WHERE class_id = %s LIMIT 1", (class_id,))
+    row = cur.fetchone()
+    course_id = row[0] if row else 1
+    cur.execute("SELECT id FROM modules WHERE course_id = %s ORDER BY sequence_number LIMIT 1", (course_id,))
+    row = cur.fetchone()
+    module_id = row[0] if row else 1
+    cur.execute("SELECT verification_key FROM users WHERE id = %s", (student_user_id,))
+    verification_key = str(cur.fetchone()[0])
+    cur.execute("SELECT access_token FROM assignments ORDER BY id DESC LIMIT 1")
+    row = cur.fetchone()
+    access_token = str(row[0]) if row else '00000000-0000-0000-0000-000000000000'
+
+    fresh = uuid.uuid4()
+    return {
+        "email": email,
+        "user_id": owner_id,
+        "owner_id": owner_id,
+        "class_id": class_id,
+        "class_ids": [class_id],
+        "student_user_id": student_user_id,
+        "user_ids": [student_user_id],
+        "course_id": course_id,
+        "module_id": module_id,
+        "key": verification_key,
+        "verification_key": str(fresh),
+        "access_token": access_token,
+        "name": "Plan check class",
+        "password_hash": UNUSABLE_PASSWORD,
+        "unusable": UNUSABLE_PASSWORD,
+        "emails": [f"plan-check-{fresh.hex}-{i}@example.com" for i in range(3)],
+        "to_address": email,
+        "subject": "Plan check",
+        "body": "Plan check",
+        "interval": 900,
+        "test_date": dt.date.today(),
+        "limit": 51,
+    }
+
+
+def insert_params(params: dict) -> dict:
+    """Bind values for an INSERT, with an email address that isn't registered yet."""
+    return {**params, "email": f"plan-check-{uuid.uuid4().hex}@example.com"}
+
+
+def large_tables(cur, min_rows: int) -> set:
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'r' AND n.nspname = 'public' AND c.reltuples > %s
+    """, (min_rows,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def seq_scans(plan: dict) -> List[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def to_psycopg(sql: str) -> str:
+    """:name binds to %(name)s, escaping literal percent signs."""
+    return BIND.sub(r'%(\1)s', sql.replace('%', '%%'))
+
+
+def check(conn, statements: List[Statement], args) -> List[dict]:
+    results = []
+    cur = conn.cursor()
+    params = sample_params(cur)
+    large = large_tables(cur, args.min_rows)
+    cur.execute("SET LOCAL statement_timeout = %s", (int(args.timeout * 1000),))
+
+    for statement in statements:
+        result = {"location": statement.location, "status": "ok", "problems": []}
+        missing = sorted(set(BIND.findall(statement.sql)) - params.keys())
+        if missing:
+            result.update(status="error", problems=[f"no sample value for {', '.join(':' + name for name in missing)}"])
+            results.append(result)
+            continue
+        statement_params = insert_params(params) if statement.sql.upper().startswith("INSERT") else params
+        cur.execute("SAVEPOINT plan_check")
+        try:
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + to_psycopg(statement.sql), statement_params)
+            explained = cur.fetchone()[0][0]
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT plan_check")
+            result.update(status="error", problems=[str(e).strip().splitlines()[0]])
+            results.append(result)
+            continue
+        cur.execute("ROLLBACK TO SAVEPOINT plan_check")
+
+        plan = explained["Plan"]
+        result["execution_ms"] = round(explained["Execution Time"], 3)
+        result["shared_hit"] = plan.get("Shared Hit Blocks", 0)
+        result["shared_read"] = plan.get("Shared Read Blocks", 0)
+        for table in seq_scans(plan):
+            if table in large:
+                result["problems"].append(f"Seq Scan on {table}")
+        if explained["Execution Time"] > args.budget_ms:
+            result["problems"].append(f"{explained['Execution Time']:.1f} ms over the {args.budget_ms} ms budget")
+        if result["problems"]:
+            result["status"] = "fail"
+        results.append(result)
+
+    conn.rollback()
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", action="append", default=[], help="extra source file relative to the repository root")
+    parser.add_argument("--budget-ms", type=float, default=50.0, help="execution time budget per statement")
+    parser.add_argument("--min-rows", type=int, default=10000, help="sequential scans on smaller tables are fine")
+    parser.add_argument("--timeout", type=float, default=30.0, help="statement timeout in seconds")
+    parser.add_argument("--strict", action="store_true", help="also fail on dynamic SQL that couldn't be rendered")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    statements, skipped = [], []
+    for path in DEFAULT_FILES + args.file:
+        found, not_rendered = extract_statements(path)
+        statements.extend(found)
+        skipped.extend(not_rendered)
+
+    conn = connect()
+    try:
+        results = check(conn, statements, args)
+    finally:
+        conn.close()
+
+    for result in results:
+        timing = f"{result['execution_ms']:9.2f} ms" if "execution_ms" in result else " " * 12
+        print(f"{result['status']:5} {timing}  {result['location']}")
+        for problem in result["problems"]:
+            print(f"      {problem}")
+    for location in skipped:
+        print(f"skip               {location} (dynamic SQL)")
+
+    failed = [r for r in results if r["status"] == "fail"]
+    errors = [r for r in results if r["status"] == "error"]
+    print(f"\n{len(results)} statements, {len(failed)} failed, {len(errors)} errors, {len(skipped)} skipped")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "skipped": skipped}, f, indent=2)
+    return 1 if failed or errors or (args.strict and skipped) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""Bulk-load synthetic organisations into the database with COPY.
+
+    python benchmarks/generate_data.py --users 100000 --classes 10000 --assignments 10000000
+
+Every run adds a new, independent set of rows (emails, class names and access
+tokens carry a random run id), so it can be repeated to grow the data further.
+--seed only fixes the shape of the data. Ids are reserved from the sequences
+up front, which lets related rows be written in the same pass without reading
+ids back.
+
+By default triggers are switched off for the session (session_replication_role
+= replica, needs a superuser) and the trigger-maintained tables are rebuilt at
+the end with rebuild_progress() and reconcile_credit_balances(true). Pass
+--keep-triggers to load through the triggers instead.
+"""
+import io
+import os
+import csv
+import sys
+import time
+import uuid
+import random
+import argparse
+import datetime as dt
+
+import bcrypt
+import psycopg2
+
+
+CHUNK_ROWS = 50000
+PASSWORD = "Bench-pass1!"
+# Distribution of assignment status, overdue ones are 'expired'
+STATUSES = [('completed', 0.5), ('sent', 0.25), ('pending', 0.15), ('expired', 0.1)]
+
+
+def connect():
+    return psycopg2.connect(
+        host=os.getenv('POSTGRES_HOST', 'localhost'),
+        port=os.getenv('POSTGRES_PORT', '5432'),
+        user=os.getenv('POSTGRES_USER', 'postgres'),
+        password=os.getenv('POSTGRES_PASSWORD', 'postgres'),
+        dbname=os.getenv('POSTGRES_DB', 'mydb')
+    )
+
+
+def reserve_ids(cur, table: str, count: int) -> int:
+    """Take `count` consecutive ids from the table's sequence, returns the first."""
+    cur.execute(f"SELECT nextval(pg_get_serial_sequence('{table}', 'id'))")
+    first = cur.fetchone()[0]
+    cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), %s)", (first + count - 1,))
+    return first
+
+
+def random_uuid(rng: random.Random, salt: int) -> str:
+    """Seeded uuid made unique per run by mixing in the run's random salt."""
+    return str(uuid.UUID(int=rng.getrandbits(128) ^ salt, version=4))
+
+
+class Copier:
+    """Buffers rows as CSV and COPYs them into a table in chunks."""
+
+    def __init__(self, cur, table: str, columns: list):
+        self.cur = cur
+        self.table = table
+        self.columns = columns
+        self.rows = 0
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._pending = 0
+
+    def add(self, *row) -> None:
+        self._writer.writerow(['\\N' if value is None else value for value in row])
+        self._pending += 1
+        if self._pending >= CHUNK_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        self._buffer.seek(0)
+        self.cur.copy_expert(
+            f"COPY {self.table} ({', '.join(self.columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            self._buffer
+        )
+        self.rows += self._pending
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._pending = 0
+
+
+def log(message: str, start: float) -> None:
+    print(f"[{time.perf_counter() - start:8.1f}s] {message}", flush=True)
+
+
+def generate(conn, args) -> None:
+    rng = random.Random(args.seed)
+    # Not from the seeded rng, repeated runs with the same seed must not collide
+    salt = uuid.uuid4().int
+    run = uuid.UUID(int=salt).hex[:8]
+    start = time.perf_counter()
+    now = dt.datetime.now(dt.timezone.utc)
+    today = now.date()
+    cur = conn.cursor()
+    if not args.keep_triggers:
+        cur.execute("SET session_replication_role = replica")
+
+    # Users, the first --classes of them own one class each
+    password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=4)).decode()
+    first_user = reserve_ids(cur, 'users', args.users)
+    users = Copier(cur, 'users', ['id', 'email', 'password_hash', 'verification_key', 'is_verified', 'created_at'])
+    for i in range(args.users):
+        org = i % args.orgs
+        created_at = now - dt.timedelta(days=rng.uniform(0, 730))
+        users.add(first_user + i, f"gen-{run}-{i}@org{org}.example.com", password_hash, random_uuid(rng, salt), rng.random() < 0.9, created_at)
+    users.flush()
+    log(f"users: {users.rows}", start)
+
+    credits = Copier(cur, 'credits', ['user_id', 'amount', 'stripe_payment_id', 'created_at'])
+    for i in range(args.classes):
+        credits.add(first_user + i, rng.randint(100, 10000), f"gen_{run}_{i}", now - dt.timedelta(days=rng.uniform(0, 365)))
+    credits.flush()
+
+    first_class = reserve_ids(cur, 'classes', args.classes)
+    classes = Copier(cur, 'classes', ['id', 'owner_id', 'name', 'created_at'])
+    for i in range(args.classes):
+        classes.add(first_class + i, first_user + i, f"Generated {run} class {i}", now - dt.timedelta(days=rng.uniform(0, 365)))
+    classes.flush()
+    log(f"classes: {classes.rows}", start)
+
+    # Course content: courses -> modules -> pages -> questions -> options
+    questions_by_course = {}
+    course_ids = []
+    first_course = reserve_ids(cur, 'courses', args.courses)
+    first_module = reserve_ids(cur, 'modules', args.courses * args.modules)
+    first_page = reserve_ids(cur, 'module_pages', args.courses * args.modules * args.pages)
+    question_count = args.courses * args.modules * args.pages * args.questions
+    first_question = reserve_ids(cur, 'questions_mc', question_count)
+    first_option = reserve_ids(cur, 'answer_options', question_count * args.options)
+    courses = Copier(cur, 'courses', ['id', 'name', 'version', 'description', 'credit_cost'])
+    modules = Copier(cur, 'modules', ['id', 'course_id', 'name', 'version', 'description', 'sequence_number'])
+    pages = Copier(cur, 'module_pages', ['id', 'module_id', 'name', 'version', 'description', 'sequence_number'])
+    questions = Copier(cur, 'questions_mc', ['id', 'module_page_id', 'context', 'question'])
+    options = Copier(cur, 'answer_options', ['id', 'question_mc_id', 'option_text', 'feedback_message'])
+    correctness = Copier(cur, 'answer_option_correctness', ['question_mc_id', 'answer_option_id'])
+    correct_option = {}
+    wrong_options = {}
+    module_id, page_id, question_id, option_id = first_module, first_page, first_question, first_option
+    for c in range(args.courses):
+        course_id = first_course + c
+        course_ids.append(course_id)
+        questions_by_course[course_id] = []
+        courses.add(course_id, f"Generated {run} course {c}", 1, f"Generated course {c}", 1)
+        for m in range(args.modules):
+            modules.add(module_id, course_id, f"Generated {run} module {c}.{m}", 1, f"Module {m}", m + 1)
+            for p in range(args.pages):
+                pages.add(page_id, module_id, f"Generated {run} page {c}.{m}.{p}", 1, f"Page {p}", p + 1)
+                for q in range(args.questions):
+                    questions.add(question_id, page_id, None, f"Question {c}.{m}.{p}.{q}?")
+                    questions_by_course[course_id].append(question_id)
+                    for o in range(args.options):
+                        options.add(option_id, question_id, f"Option {o}", f"Feedback {o}")
+                        if o == 0:
+                            correct_option[question_id] = option_id
+                            correctness.add(question_id, option_id)
+                        else:
+                            wrong_options.setdefault(question_id, []).append(option_id)
+                        option_id += 1
+                    question_id += 1
+                page_id += 1
+            module_id += 1
+    for copier in (courses, modules, pages, questions, options, correctness):
+        copier.flush()
+    log(f"content: {courses.rows} courses, {questions.rows} questions, {options.rows} options", start)
+
+    # Every class is enrolled in one or two courses and gets --students-per-class students
+    class_courses = {}
+    enrollments = Copier(cur, 'enrollments', ['class_id', 'course_id'])
+    for i in range(args.classes):
+        class_courses[first_class + i] = rng.sample(course_ids, min(len(course_ids), rng.randint(1, 2)))
+        for course_id in class_courses[first_class + i]:
+            enrollments.add(first_class + i, course_id)
+    enrollments.flush()
+
+    student_count = args.classes * args.students_per_class
+    first_student = reserve_ids(cur, 'students', student_count)
+    students = Copier(cur, 'students', ['id', 'class_id', 'user_id', 'created_at'])
+    student_class = []
+    for i in range(args.classes):
+        class_id = first_class + i
+        for offset in rng.sample(range(args.users), min(args.users, args.students_per_class)):
+            students.add(first_student + len(student_class), class_id, first_user + offset, now - dt.timedelta(days=rng.uniform(0, 365)))
+            student_class.append(class_id)
+    students.flush()
+    log(f"students: {students.rows}", start)
+
+    # Assignments with visits and attempts matching their status
+    first_assignment = reserve_ids(cur, 'assignments', args.assignments)
+    first_visit = reserve_ids(cur, 'assignment_visits', 2 * args.assignments)
+    assignments = Copier(cur, 'assignments', ['id', 'student_id', 'question_mc_id', 'test_date', 'access_token', 'expiration_date', 'status', 'completed_at', 'created_at'])
+    visits = Copier(cur, 'assignment_visits', ['id', 'assignment_id', 'created_at'])
+    attempts = Copier(cur, 'assignment_attempts', ['assignment_visit_id', 'answer_option_id', 'created_at'])
+    status_names = [name for name, _ in STATUSES]
+    status_weights = [weight for _, weight in STATUSES]
+    visit_id = first_visit
+    open_pairs = set()
+    for i in range(args.assignments):
+        student = rng.randrange(len(student_class))
+        question = rng.choice(questions_by_course[rng.choice(class_courses[student_class[student]])])
+        status = rng.choices(status_names, status_weights)[0]
+        if status in ('pending', 'sent'):
+            # uq_assignments_open allows one open assignment per student and question
+            pair = (first_student + student) << 32 | question
+            if pair in open_pairs:
+                status = 'completed'
+            else:
+                open_pairs.add(pair)
+        created_at = now - dt.timedelta(days=rng.uniform(0, 365))
+        test_date = (created_at + dt.timedelta(days=rng.randint(0, 30))).date()
+        if status == 'pending':
+            test_date = today + dt.timedelta(days=rng.randint(0, 60))
+        expiration_date = today - dt.timedelta(days=rng.randint(1, 30)) if status == 'expired' else test_date + dt.timedelta(days=365)
+        assignment_id = first_assignment + i
+        access_token = random_uuid(rng, salt)
+        completed_at = None
+
+        if status == 'pending':
+            assignments.add(assignment_id, first_student + student, question, test_date, access_token, expiration_date, status, completed_at, created_at)
+            continue
+        for _ in range(1 if rng.random() < 0.8 else 2):
+            if visit_id >= first_visit + 2 * args.assignments:
+                break
+            visited_at = created_at + dt.timedelta(hours=rng.uniform(1, 72))
+            visits.add(visit_id, assignment_id, visited_at)
+            if status == 'completed' or rng.random() < 0.3:
+                if rng.random() < 0.3:
+                    attempts.add(visit_id, rng.choice(wrong_options[question]), visited_at)
+                if status == 'completed':
+                    attempts.add(visit_id, correct_option[question], visited_at + dt.timedelta(seconds=30))
+                    completed_at = completed_at or visited_at + dt.timedelta(seconds=30)
+            visit_id += 1
+        assignments.add(assignment_id, first_student + student, question, test_date, access_token, expiration_date, status, completed_at, created_at)
+        if (i + 1) % 1000000 == 0:
+            log(f"assignments: {i + 1}", start)
+    for copier in (assignments, visits, attempts):
+        copier.flush()
+    log(f"assignments: {assignments.rows}, visits: {visits.rows}, attempts: {attempts.rows}", start)
+
+    if not args.keep_triggers:
+        cur.execute("SET session_replication_role = DEFAULT")
+        cur.execute("SELECT rebuild_progress()")
+        cur.execute("SELECT count(*) FROM reconcile_credit_balances(true)")
+        log("rebuilt progress rollups and credit balances", start)
+
+    conn.commit()
+    cur.execute("ANALYZE")
+    conn.commit()
+    log(f"done, run id {run}, every generated user has password {PASSWORD}", start)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--orgs", type=int, default=1000, help="email domains the users are spread over")
+    parser.add_argument("--classes", type=int, default=10000)
+    parser.add_argument("--students-per-class", type=int, default=30)
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--modules", type=int, default=5, help="per course")
+    parser.add_argument("--pages", type=int, default=4, help="per module")
+    parser.add_argument("--questions", type=int, default=5, help="per page")
+    parser.add_argument("--options", type=int, default=4, help="per question, the first is correct")
+    parser.add_argument("--assignments", type=int, default=10000000)
+    parser.add_argument("--seed", type=int, default=42, help="fixes the data's shape, names and tokens differ per run")
+    parser.add_argument("--keep-triggers", action="store_true", help="load through the triggers instead of rebuilding afterwards")
+    args = parser.parse_args()
+
+    if args.classes > args.users:
+        parser.error("--classes can't exceed --users, every class needs its own owner")
+
+    conn = connect()
+    try:
+        generate(conn, args)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
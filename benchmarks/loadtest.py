@@ -0,0 +1,244 @@
+"""Load test for the API: scripted user sessions with latency percentiles per endpoint.
+
+    python benchmarks/loadtest.py run --users 50 --iterations 20 --output results/run.json
+    python benchmarks/loadtest.py compare results/baseline.json results/run.json
+
+Every virtual user registers, logs in and then repeatedly loads the dashboard,
+creates a class, imports a few students and lists them. Run it against a stack
+started with docker-compose.bench.yml (see scripts/bench.sh) so registration
+emails go to the fake SMTP server.
+"""
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+import datetime as dt
+from collections import defaultdict
+
+import httpx
+
+
+PASSWORD = "Bench-pass1!"
+
+
+class Recorder:
+    """Latency and status of every request, grouped by endpoint (route template, not url)."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    async def request(self, client: httpx.AsyncClient, endpoint: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.latencies[endpoint].append(1000 * (time.perf_counter() - start))
+            self.statuses[endpoint][type(e).__name__] += 1
+            self.errors[endpoint] += 1
+            return None
+        self.latencies[endpoint].append(1000 * (time.perf_counter() - start))
+        self.statuses[endpoint][str(response.status_code)] += 1
+        if response.status_code >= 400:
+            self.errors[endpoint] += 1
+        return response
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentile."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: list, errors: int, duration: float, statuses: dict = None) -> dict:
+    values = sorted(latencies)
+    count = len(values)
+    summary = {
+        "requests": count,
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        "throughput_rps": round(count / duration, 2) if duration else 0.0,
+        "mean_ms": round(sum(values) / count, 2) if count else 0.0,
+        "p50_ms": round(percentile(values, 50), 2),
+        "p95_ms": round(percentile(values, 95), 2),
+        "p99_ms": round(percentile(values, 99), 2),
+        "max_ms": round(values[-1], 2) if values else 0.0,
+    }
+    if statuses is not None:
+        summary["statuses"] = dict(statuses)
+    return summary
+
+
+async def user_session(client: httpx.AsyncClient, recorder: Recorder, run_id: str, user: int, args) -> None:
+    email = f"bench-{run_id}-{user}@example.com"
+    await recorder.request(client, "POST /register", "POST", "/register", json={"email": email, "password": PASSWORD})
+    response = await recorder.request(client, "POST /token", "POST", "/token", data={"username": email, "password": PASSWORD})
+    if response is None or response.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    await recorder.request(client, "GET /users/me", "GET", "/users/me", headers=headers)
+    for iteration in range(args.iterations):
+        await recorder.request(client, "GET /dashboard", "GET", "/dashboard", headers=headers)
+        await recorder.request(client, "GET /credits/summary", "GET", "/credits/summary", headers=headers)
+
+        response = await recorder.request(
+            client, "POST /classes", "POST", "/classes",
+            headers=headers, json={"name": f"Bench {run_id} {user}-{iteration}"}
+        )
+        if response is not None and response.status_code == 200:
+            class_id = response.json()["id"]
+            emails = "\n".join(f"student-{run_id}-{user}-{iteration}-{n}@example.com" for n in range(args.students))
+            await recorder.request(
+                client, "POST /classes/{class_id}/students/import", "POST", f"/classes/{class_id}/students/import",
+                headers=headers, json={"emails": emails, "domain": "example.com"}
+            )
+            await recorder.request(
+                client, "GET /classes/{class_id}/students", "GET", f"/classes/{class_id}/students",
+                headers=headers, params={"limit": 50}
+            )
+
+        await recorder.request(client, "GET /classes/administered", "GET", "/classes/administered", headers=headers)
+        await recorder.request(client, "GET /classes/enrolled", "GET", "/classes/enrolled", headers=headers)
+        if args.think_time:
+            await asyncio.sleep(random.uniform(0, 2 * args.think_time))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    recorder = Recorder()
+    run_id = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        response = await client.get("/health")
+        response.raise_for_status()
+
+        async def delayed_session(user: int):
+            # Spread session starts over the ramp-up so they don't all register in the same instant
+            await asyncio.sleep(args.ramp_up * user / args.users)
+            await user_session(client, recorder, run_id, user, args)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(delayed_session(user) for user in range(args.users)))
+        duration = time.perf_counter() - start
+
+    all_latencies = [latency for values in recorder.latencies.values() for latency in values]
+    return {
+        "meta": {
+            "started_at": dt.datetime.now(dt.timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "base_url": args.base_url,
+            "users": args.users,
+            "iterations": args.iterations,
+            "students_per_class": args.students,
+            "think_time": args.think_time,
+            "duration_s": round(duration, 3),
+            "python": platform.python_version(),
+        },
+        "total": summarize(all_latencies, sum(recorder.errors.values()), duration),
+        "endpoints": {
+            endpoint: summarize(values, recorder.errors[endpoint], duration, recorder.statuses[endpoint])
+            for endpoint, values in sorted(recorder.latencies.items())
+        },
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"{'endpoint':45} {'reqs':>7} {'err%':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    rows = list(result["endpoints"].items()) + [("TOTAL", result["total"])]
+    for endpoint, s in rows:
+        print(
+            f"{endpoint:45} {s['requests']:>7} {100 * s['error_rate']:>5.1f}% {s['throughput_rps']:>8.1f} "
+            f"{s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f}"
+        )
+
+
+def compare(args) -> int:
+    """Exit code 1 when an endpoint's p95/p99 or error rate regressed beyond the thresholds."""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    regressions = []
+    print(f"{'endpoint':45} {'p95 base':>9} {'p95 now':>9} {'change':>8} {'err% base':>10} {'err% now':>9}")
+    for endpoint, now in current["endpoints"].items():
+        base = baseline["endpoints"].get(endpoint)
+        if base is None:
+            print(f"{endpoint:45} {'-':>9} {now['p95_ms']:>9.1f} {'new':>8}")
+            continue
+        change = (now["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        print(
+            f"{endpoint:45} {base['p95_ms']:>9.1f} {now['p95_ms']:>9.1f} {100 * change:>7.1f}% "
+            f"{100 * base['error_rate']:>9.1f}% {100 * now['error_rate']:>8.1f}%"
+        )
+        for p in ("p95_ms", "p99_ms"):
+            # Ignore tiny absolute differences, they are noise at low latencies
+            if now[p] > base[p] * (1 + args.threshold) and now[p] - base[p] > args.min_delta_ms:
+                regressions.append(f"{endpoint} {p} {base[p]:.1f} -> {now[p]:.1f}")
+        if now["error_rate"] > base["error_rate"] + args.error_threshold:
+            regressions.append(f"{endpoint} error rate {base['error_rate']:.2%} -> {now['error_rate']:.2%}")
+
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the load test")
+    run_parser.add_argument("--base-url", default="http://localhost:8000")
+    run_parser.add_argument("--users", type=int, default=20, help="concurrent user sessions")
+    run_parser.add_argument("--iterations", type=int, default=10, help="dashboard/class rounds per session")
+    run_parser.add_argument("--students", type=int, default=5, help="students imported into every new class")
+    run_parser.add_argument("--ramp-up", type=float, default=5.0, help="seconds over which sessions start")
+    run_parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between rounds in seconds")
+    run_parser.add_argument("--timeout", type=float, default=30.0)
+    run_parser.add_argument("--seed", type=int, default=None, help="seed for think times, for reproducible runs")
+    run_parser.add_argument("--output", help="write the results as JSON to this file")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative p95/p99 increase")
+    compare_parser.add_argument("--min-delta-ms", type=float, default=5.0, help="ignore smaller absolute increases")
+    compare_parser.add_argument("--error-threshold", type=float, default=0.01, help="allowed error rate increase")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        return compare(args)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 1 if result["total"]["error_rate"] > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# frontend/lib/api.py
+import os
+import time
+import threading
+from typing import Optional, Dict, Any, Tuple
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+
+API_URL = os.getenv('API_URL', 'http://api:8000')
+API_POOL_SIZE = int(os.getenv('API_POOL_SIZE', '20'))
+API_TIMEOUT = float(os.getenv('API_TIMEOUT', '10'))
+API_CACHE_TTL = float(os.getenv('API_CACHE_TTL', '30'))
+API_CACHE_MAX_ENTRIES = 10000
+
+
+class ApiClient:
+    """HTTP client shared by all Streamlit sessions.
+
+    Keeps connections to the API open in a pool and caches successful GET responses
+    per token for a short while, so a rerun doesn't redo every request. Writes made
+    through the client drop the cached responses of the token that made them.
+    """
+
+    def __init__(self, api_url: str, pool_size: int = API_POOL_SIZE, cache_ttl: float = API_CACHE_TTL):
+        self.api_url = api_url
+        self.cache_ttl = cache_ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._cache: Dict[Tuple, Tuple[float, requests.Response]] = {}
+        self._lock = threading.Lock()
+
+    def _headers(self, token: Optional[str]) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {token}"} if token else {}
+
+    def get(self, path: str, token: Optional[str] = None, params: Optional[Dict[str, Any]] = None,
+            cached: bool = True, ttl: Optional[float] = None) -> requests.Response:
+        """GET a path, served from the cache when an identical request succeeded recently."""
+        key = (token, path, tuple(sorted((params or {}).items())))
+        now = time.monotonic()
+        if cached:
+            with self._lock:
+                entry = self._cache.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+
+        response = self.session.get(
+            url=f"{self.api_url}{path}",
+            headers=self._headers(token),
+            params=params,
+            timeout=API_TIMEOUT
+        )
+        if cached and response.status_code == 200:
+            with self._lock:
+                if len(self._cache) >= API_CACHE_MAX_ENTRIES:
+                    self._prune(now)
+                self._cache[key] = (now + (self.cache_ttl if ttl is None else ttl), response)
+        return response
+
+    def post(self, path: str, token: Optional[str] = None, **kwargs) -> requests.Response:
+        """POST to a path, a successful write invalidates the token's cached reads."""
+        response = self.session.post(
+            url=f"{self.api_url}{path}",
+            headers=self._headers(token),
+            timeout=API_TIMEOUT,
+            **kwargs
+        )
+        if token and response.status_code < 400:
+            self.invalidate(token)
+        return response
+
+    def invalidate(self, token: Optional[str]) -> None:
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == token]:
+                del self._cache[key]
+
+    def _prune(self, now: float) -> None:
+        for key in [key for key, (expires, _) in self._cache.items() if expires <= now]:
+            del self._cache[key]
+        # Still full, drop the oldest half
+        if len(self._cache) >= API_CACHE_MAX_ENTRIES:
+            for key in list(self._cache)[:API_CACHE_MAX_ENTRIES // 2]:
+                del self._cache[key]
+
+
+@st.cache_resource
+def get_api_client(api_url: str = API_URL) -> ApiClient:
+    """One client per process, shared across sessions and reruns."""
+    return ApiClient(api_url)
@@ -1,20 +1,27 @@
 # frontend/lib/auth.py
 import streamlit as st
-import requests
-import time
 import datetime as dt
 from streamlit_cookies_controller import CookieController
 from typing import Optional, Dict, Any
 
+from lib.api import get_api_client
+
 
 class AuthManager:
     def __init__(self, api_url: str, token_cookie_name: str = "auth_token"):
         self.api_url = api_url
         self.token_cookie_name = token_cookie_name
         self.cookie_controller = CookieController()
+        self.client = get_api_client(api_url)
+        # The cookie component only reports changes on the next rerun, so the
+        # session keeps its own copy of the token after login and logout
+        self.session_key = f"_{token_cookie_name}"
+        self.pending_key = f"_{token_cookie_name}_pending_switch"
         
     def get_token(self) -> Optional[str]:
-        """Get the authentication token from cookies."""
+        """Get the authentication token from the session, falling back to cookies."""
+        if self.session_key in st.session_state:
+            return st.session_state[self.session_key]
         return self.cookie_controller.get(self.token_cookie_name)
     
     def is_authenticated(self) -> bool:
@@ -23,8 +30,8 @@ class AuthManager:
     
     def login(self, email: str, password: str) -> Dict[str, Any]:
         """Attempt to login user and return result."""
-        response = requests.post(
-            url=f"{self.api_url}/token",
+        response = self.client.post(
+            "/token",
             data={"username": email, "password": password}
         )
         result = response.json()
@@ -37,7 +44,7 @@ class AuthManager:
                 value=token,
                 expires=expires,
             )
-            time.sleep(1)  # Give the cookie some time to appear
+            st.session_state[self.session_key] = token
             return {"success": True, "message": "Logged in successfully!"}
             
         elif 'detail' in result:
@@ -47,8 +54,31 @@ class AuthManager:
     
     def logout(self) -> None:
         """Logout user by removing the auth token."""
+        self.client.invalidate(self.get_token())
         self.cookie_controller.remove(self.token_cookie_name)
-        time.sleep(1)  # Give the cookie some time to cleanup
+        st.session_state[self.session_key] = None
+    
+    def switch_page_when_stored(self, page: str, message: str) -> None:
+        """Switch to a page once the browser has stored the token cookie set in this run.
+
+        Switching in the same run can drop the cookie component before it reaches the
+        browser, so end this run and let complete_pending_switch() finish on a rerun.
+        """
+        st.session_state[self.pending_key] = {"page": page, "token": st.session_state.get(self.session_key)}
+        st.info(message)
+        st.stop()
+
+    def complete_pending_switch(self) -> None:
+        """Call at the top of every page, before checking is_authenticated()."""
+        pending = st.session_state.get(self.pending_key)
+        if not pending:
+            return
+        # A new CookieController reads the cookies back from the browser
+        if self.cookie_controller.get(self.token_cookie_name) == pending["token"]:
+            del st.session_state[self.pending_key]
+            st.switch_page(pending["page"])
+        st.info("Just a moment...")
+        st.stop()
     
     def get_user_info(self) -> Optional[Dict[str, Any]]:
         """Get current user information."""
@@ -56,10 +86,7 @@ class AuthManager:
         if not token:
             return None
             
-        response = requests.get(
-            url=f"{self.api_url}/users/me",
-            headers={"Authorization": f"Bearer {token}"}
-        )
+        response = self.client.get("/users/me", token=token)
         return response.json() if response.status_code == 200 else None
 
 def create_login_ui(auth: AuthManager) -> None:
@@ -71,13 +98,12 @@ def create_login_ui(auth: AuthManager) -> None:
     if st.button('login', type='primary', use_container_width=True):
         result = auth.login(email, password)
         if result["success"]:
-            st.switch_page('routes/dashboard.py')
+            auth.switch_page_when_stored('routes/dashboard.py', 'Logging you in...')
         else:
             st.error(result["message"])
 
 def create_logout_ui(auth: AuthManager) -> None:
     """Create logout UI components."""
     if st.button('Logout', type='primary', use_container_width=True):
-        st.warning('Logging you out...')
         auth.logout()
-        st.switch_page('routes/home.py')
+        auth.switch_page_when_stored('routes/home.py', 'Logging you out...')
@@ -1,7 +1,6 @@
 import streamlit as st
-import requests
-import requests
 import datetime as dt
+import pandas as pd
 
 from lib.auth import AuthManager, create_logout_ui
 from lib.menu import navigation
@@ -18,6 +17,7 @@ st.title('Dashboard')
 # Initialize authentication
 api_baseurl = "http://api:8000"
 auth = AuthManager(api_url=api_baseurl)
+auth.complete_pending_switch()
 auth_token = auth.get_token()
 
 # Handle unauthenticated users
@@ -25,8 +25,20 @@ if not auth.is_authenticated():
     st.error('Please login using the link in the sidebar')
     st.stop()
 
-# Get user info
-user_info = auth.get_user_info()
+# Load everything the page shows in a single (cached) request
+def get_dashboard_data():
+    response = auth.client.get("/dashboard", token=auth_token)
+    if response.status_code == 200:
+        return response.json()
+    else:
+        raise ValueError(response.content)
+
+try:
+    dashboard_data = get_dashboard_data()
+except Exception as e:
+    st.error(f"Error loading dashboard: {str(e)}")
+    st.stop()
+user_info = dashboard_data["user"]
 
 # User info and logout in sidebar
 with st.sidebar:
@@ -36,37 +48,18 @@ with st.sidebar:
 
 st.header('Course Credits', divider=True)
 
-def get_credit_data():
-
-    # Set up headers with the bearer token
-    headers = {
-        "Authorization": f"Bearer {auth_token}"
-    }
-
-    # Make the request
-    response = requests.get(
-        url     = f"{api_baseurl}/credits/summary",
-        headers = headers
-    )
-    if response.status_code == 200:
-        result = response.json()
-        result['last_transaction_date'] = dt.datetime.fromisoformat(result['last_transaction_date'])
-        return result
-
-    else:
-        raise ValueError(response.content)
-
-
-credit_data = get_credit_data()
+credit_data = dashboard_data["credits"]
+if credit_data['last_transaction_date']:
+    credit_data['last_transaction_date'] = dt.datetime.fromisoformat(credit_data['last_transaction_date'])
 credit_metrics = st.columns(len(credit_data))
 i = 0
 for k, v in credit_data.items():
-    if not type(v) in (int, float, str, None):
+    if isinstance(v, dt.datetime):
         v = str(v.date())
 
     credit_metrics[i].metric(
         label = k,
-        value = v,
+        value = v if v is not None else '-',
     )
     i += 1
 
@@ -80,16 +73,10 @@ with st.form("create_class_form"):
 
     if submit_button:
         try:
-            # Set up headers with the bearer token
-            headers = {
-                "Authorization": f"Bearer {auth_token}",
-                "Content-Type": "application/json"
-            }
-            
-            # Make the request
-            response = requests.post(
-                url=f"{api_baseurl}/classes",
-                headers=headers,
+            # Make the request, this also drops our cached dashboard data
+            response = auth.client.post(
+                "/classes",
+                token=auth_token,
                 json={"name": class_name}
             )
             
@@ -108,90 +95,46 @@ with st.form("create_class_form"):
 
 
 st.header('My Classes', divider=True)
-# Function to fetch administered classes
-def get_administered_classes():
-    headers = {"Authorization": f"Bearer {auth_token}"}
-    response = requests.get(
-        url=f"{api_baseurl}/classes/administered",
-        headers=headers
-    )
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise ValueError(response.content)
 
-# Function to fetch students for a specific class
-def get_class_students(class_id):
-    headers = {"Authorization": f"Bearer {auth_token}"}
-    response = requests.get(
-        url=f"{api_baseurl}/classes/{class_id}/students",
-        headers=headers
-    )
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise ValueError(response.content)
-    
 # Display administered classes
 st.subheader("Classes I Administer")
-try:
-    admin_classes = get_administered_classes()
-    if not admin_classes:
-        st.info("You don't administer any classes yet.")
-    else:
-        for class_info in admin_classes:
-            with st.expander(class_info["name"]):
-                st.write(f"Class ID: {class_info['id']}")
-                st.write(f"Created: {dt.datetime.fromisoformat(class_info['created_at']).date()}")
-                
-                # Add student information
-                st.divider()
-                st.write("Students:")
-                try:
-                    students = get_class_students(class_info['id'])
-                    if not students:
-                        st.info("No students enrolled yet.")
-                    else:
-                        # Create a DataFrame for better display
-                        import pandas as pd
-                        df = pd.DataFrame(students)
-                        df['enrolled_at'] = pd.to_datetime(df['enrolled_at']).dt.date
-                        st.dataframe(
-                            df.rename(columns={
-                                'email': 'Email',
-                                'is_verified': 'Verified',
-                                'enrolled_at': 'Enrolled Date'
-                            }),
-                            hide_index=True
-                        )
-                except Exception as e:
-                    st.error(f"Error loading student data: {str(e)}")
-
-except Exception as e:
-    st.error(f"Error loading administered classes: {str(e)}")
+admin_classes = dashboard_data["administered_classes"]
+if not admin_classes:
+    st.info("You don't administer any classes yet.")
+else:
+    for class_info in admin_classes:
+        with st.expander(class_info["name"]):
+            st.write(f"Class ID: {class_info['id']}")
+            st.write(f"Created: {dt.datetime.fromisoformat(class_info['created_at']).date()}")
+            
+            # Add student information
+            st.divider()
+            st.write(f"Students ({class_info['student_count']}):")
+            students = class_info["students"]
+            if not students:
+                st.info("No students enrolled yet.")
+            else:
+                # Create a DataFrame for better display
+                df = pd.DataFrame(students)
+                df['enrolled_at'] = pd.to_datetime(df['enrolled_at']).dt.date
+                st.dataframe(
+                    df.rename(columns={
+                        'email': 'Email',
+                        'is_verified': 'Verified',
+                        'enrolled_at': 'Enrolled Date'
+                    }),
+                    hide_index=True
+                )
+                if len(students) < class_info['student_count']:
+                    st.caption(f"Showing the {len(students)} most recently enrolled students.")
 
 
-# Function to fetch enrolled classes
-def get_enrolled_classes():
-    headers = {"Authorization": f"Bearer {auth_token}"}
-    response = requests.get(
-        url=f"{api_baseurl}/classes/enrolled",
-        headers=headers
-    )
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise ValueError(response.content)
-
 st.subheader("Classes I'm Enrolled In")
-try:
-    enrolled_classes = get_enrolled_classes()
-    if not enrolled_classes:
-        st.info("You're not enrolled in any classes yet.")
-    else:
-        for class_info in enrolled_classes:
-            with st.expander(class_info["name"]):
-                st.write(f"Class ID: {class_info['id']}")
-                st.write(f"Enrolled: {dt.datetime.fromisoformat(class_info['enrolled_at']).date()}")
-except Exception as e:
-    st.error(f"Error loading enrolled classes: {str(e)}")
+enrolled_classes = dashboard_data["enrolled_classes"]
+if not enrolled_classes:
+    st.info("You're not enrolled in any classes yet.")
+else:
+    for class_info in enrolled_classes:
+        with st.expander(class_info["name"]):
+            st.write(f"Class ID: {class_info['id']}")
+            st.write(f"Enrolled: {dt.datetime.fromisoformat(class_info['enrolled_at']).date()}")
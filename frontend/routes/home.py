@@ -1,8 +1,6 @@
 # frontend/routes/home.py
 import streamlit as st
 
-import requests
-
 from lib.auth import AuthManager
 from lib.menu import navigation
 import config
@@ -16,6 +14,7 @@ with st.sidebar:
 
 # Initialize authentication
 auth = AuthManager(api_url="http://api:8000")
+auth.complete_pending_switch()
 
 if auth.is_authenticated():
     st.switch_page('routes/dashboard.py')
@@ -57,8 +56,8 @@ with st.form("register_form"):
             confirm_password_errors.error("Passwords do not match")
         
         try:
-            response = requests.post(
-                url  = "http://api:8000/register",
+            response = auth.client.post(
+                "/register",
                 json = {"email": email, "password": password}
             )
         
@@ -0,0 +1,47 @@
+# frontend/routes/invite.py
+import streamlit as st
+from lib.auth import AuthManager
+import config
+
+st.set_page_config(**config.DEFAULT_PAGE_CONFIG)
+
+# Initialize authentication
+auth = AuthManager(api_url="http://api:8000")
+
+
+st.title("Activate Your Account")
+
+# Invitation key from the link in the email sent on student import
+key = st.query_params.get("key")
+
+if not key:
+    st.error("No invitation key provided")
+    st.page_link("routes/home.py", label="Return to Home", use_container_width=True)
+    st.stop()
+
+with st.form("invite_form"):
+    password = st.text_input("Choose a Password", type="password")
+    password_errors = st.empty()
+
+    confirm_password = st.text_input("Confirm Password", type="password")
+    confirm_password_errors = st.empty()
+
+    submitted = st.form_submit_button("Activate", use_container_width=True)
+
+    if submitted:
+        if password != confirm_password:
+            confirm_password_errors.error("Passwords do not match")
+            st.stop()
+
+        response = auth.client.post(f"/invitations/{key}/accept", json={"password": password})
+
+        if response.status_code == 200:
+            st.success("Your password is set! Please click Login in the sidebar.")
+        elif response.status_code == 422:
+            for detail in response.json().get("detail", []):
+                if detail['loc'][-1] == 'password':
+                    password_errors.error(detail['msg'])
+                else:
+                    st.error("Invalid invitation link")
+        else:
+            st.error(response.json().get("detail", "Activation failed"))
@@ -12,6 +12,7 @@ with st.sidebar:
 
 # Initialize authentication
 auth = AuthManager(api_url="http://api:8000")
+auth.complete_pending_switch()
 
 # Handle unauthenticated users
 if not auth.is_authenticated():
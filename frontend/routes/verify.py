@@ -1,6 +1,5 @@
 # frontend/routes/verify.py
 import streamlit as st
-import requests
 from lib.auth import AuthManager
 import config
 
@@ -13,7 +12,7 @@ auth = AuthManager(api_url="http://api:8000")
 @st.cache_data
 def request_verify(key):
     '''simple cached request to avoid triggering the api twice by accident due to streamlit reruns'''
-    return requests.get(f"http://api:8000/verify/{key}")
+    return auth.client.get(f"/verify/{key}", cached=False)
 
 
 st.title("Email Verification")
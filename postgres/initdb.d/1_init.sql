@@ -29,6 +29,16 @@ CREATE TABLE credits (
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
+-- running credit balance per user, kept in sync with the credits ledger by the after_credit_insert trigger
+-- deductions are negative rows in credits, the check constraint rejects any that would overdraw the balance
+CREATE TABLE credit_balances (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    balance INT NOT NULL DEFAULT 0 CONSTRAINT credit_balances_no_overdraft CHECK (balance >= 0),
+    total_transactions INT NOT NULL DEFAULT 0,
+    last_transaction_date TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Core tables
 CREATE TABLE classes (
     id SERIAL PRIMARY KEY,
@@ -51,9 +61,26 @@ CREATE TABLE media (
     id SERIAL PRIMARY KEY,
     alt_text TEXT NOT NULL,
     path TEXT NOT NULL,
+    width INT,  -- of the original, filled in by the derivative worker for images
+    height INT,
+    derivatives_status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (derivatives_status IN ('pending', 'processing', 'done', 'skipped', 'failed')),
+    derivatives_locked_until TIMESTAMP WITH TIME ZONE,  -- lease on a claimed row, after which another worker may retry it
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
+-- resized and re-encoded copies of image media, stored content-addressed next to the original
+CREATE TABLE media_derivatives (
+    id SERIAL PRIMARY KEY,
+    media_id INTEGER NOT NULL REFERENCES media(id) ON DELETE CASCADE,
+    width INT NOT NULL,
+    height INT NOT NULL,
+    format VARCHAR(10) NOT NULL CHECK (format IN ('jpeg', 'webp')),
+    path TEXT NOT NULL,  -- relative to the media root like media.path
+    size_bytes INT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(media_id, width, format)
+);
+
 -- stores course metadata
 CREATE TABLE courses (
     id SERIAL PRIMARY KEY,
@@ -167,6 +194,7 @@ CREATE TABLE assignments (
     access_token UUID UNIQUE NOT NULL,  -- used for automatic assignment tracking using query-params in the url
     expiration_date DATE NOT NULL DEFAULT CURRENT_DATE + INTERVAL '1 year',
     status VARCHAR(20) CHECK (status IN ('pending', 'sent', 'completed', 'expired')),
+    completed_at TIMESTAMP WITH TIME ZONE,  -- set with status 'completed', the certificate issuer only checks newer completions
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -195,6 +223,108 @@ CREATE TABLE certificates (
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
+-- background maintenance jobs, run in small committed chunks by run_maintenance_jobs()
+CREATE TABLE maintenance_jobs (
+    name VARCHAR(100) PRIMARY KEY,
+    chunk_function TEXT NOT NULL,  -- function(batch_size INT) RETURNS INT that processes one chunk and returns the rows it touched
+    lag_function TEXT,  -- function() RETURNS INTERVAL telling how far behind the job is
+    batch_size INT NOT NULL DEFAULT 1000,
+    max_runtime INTERVAL NOT NULL DEFAULT INTERVAL '1 minute',  -- a run stops after this and continues at the next schedule
+    enabled BOOLEAN NOT NULL DEFAULT true,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- one row per maintenance run, progress is committed after every chunk so interrupted runs stay visible
+CREATE TABLE maintenance_runs (
+    id SERIAL PRIMARY KEY,
+    job VARCHAR(100) REFERENCES maintenance_jobs(name) ON DELETE CASCADE,
+    started_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT clock_timestamp(),
+    finished_at TIMESTAMP WITH TIME ZONE,  -- NULL while running, or when the run was interrupted
+    rows_processed BIGINT NOT NULL DEFAULT 0,
+    chunks INT NOT NULL DEFAULT 0,
+    rows_per_second NUMERIC,
+    lag INTERVAL,
+    caught_up BOOLEAN  -- false when the run hit max_runtime with work left
+);
+
+-- outgoing emails, written in the same transaction as the change that triggers them and delivered by the api's mail sender
+CREATE TABLE email_outbox (
+    id SERIAL PRIMARY KEY,
+    to_address VARCHAR(255) NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    sender_name VARCHAR(255) NOT NULL DEFAULT 'Course Platform',
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sending', 'sent', 'failed')),
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_until TIMESTAMP WITH TIME ZONE,  -- lease on a claimed message, after which another sender may retry it
+    last_error TEXT,
+    sent_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- sanitized html of the markdown fields of courses, modules, module_pages and questions_mc
+CREATE TABLE rendered_markdown (
+    source_table VARCHAR(50) NOT NULL,
+    source_id INT NOT NULL,
+    field VARCHAR(50) NOT NULL,
+    content_hash CHAR(64) NOT NULL,  -- sha256 of the markdown and renderer version the html was made from
+    html TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source_table, source_id, field)
+);
+
+-- progress rollups for dashboards, kept up to date by the track_*_progress triggers
+-- per student and course, class_id is copied so counters can still be moved when the student row is gone
+CREATE TABLE student_progress (
+    student_id INT NOT NULL,
+    course_id INT NOT NULL,
+    class_id INT NOT NULL,
+    assignments_total INT NOT NULL DEFAULT 0,
+    assignments_pending INT NOT NULL DEFAULT 0,
+    assignments_sent INT NOT NULL DEFAULT 0,
+    assignments_completed INT NOT NULL DEFAULT 0,
+    assignments_expired INT NOT NULL DEFAULT 0,  -- overdue, the expiry job moves unanswered assignments here
+    visits INT NOT NULL DEFAULT 0,
+    attempts INT NOT NULL DEFAULT 0,
+    correct_attempts INT NOT NULL DEFAULT 0,
+    last_activity_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (student_id, course_id)
+);
+
+-- per class and course
+CREATE TABLE class_progress (
+    class_id INT NOT NULL,
+    course_id INT NOT NULL,
+    assignments_total INT NOT NULL DEFAULT 0,
+    assignments_pending INT NOT NULL DEFAULT 0,
+    assignments_sent INT NOT NULL DEFAULT 0,
+    assignments_completed INT NOT NULL DEFAULT 0,
+    assignments_expired INT NOT NULL DEFAULT 0,  -- overdue, the expiry job moves unanswered assignments here
+    visits INT NOT NULL DEFAULT 0,
+    attempts INT NOT NULL DEFAULT 0,
+    correct_attempts INT NOT NULL DEFAULT 0,
+    last_activity_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (class_id, course_id)
+);
+
+-- per course over all classes
+CREATE TABLE course_progress (
+    course_id INT PRIMARY KEY,
+    assignments_total INT NOT NULL DEFAULT 0,
+    assignments_pending INT NOT NULL DEFAULT 0,
+    assignments_sent INT NOT NULL DEFAULT 0,
+    assignments_completed INT NOT NULL DEFAULT 0,
+    assignments_expired INT NOT NULL DEFAULT 0,  -- overdue, the expiry job moves unanswered assignments here
+    visits INT NOT NULL DEFAULT 0,
+    attempts INT NOT NULL DEFAULT 0,
+    correct_attempts INT NOT NULL DEFAULT 0,
+    last_activity_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 
 
 --------- INDEXES
@@ -204,11 +334,15 @@ CREATE TABLE certificates (
 -- User Authentication & Verification
 CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_users_verification_key ON users(verification_key);
+CREATE INDEX idx_users_email_pattern ON users(email text_pattern_ops);  -- email prefix filters (LIKE 'abc%')
 
 -- classe Management
 CREATE INDEX idx_students_user_id ON students(user_id);
 CREATE INDEX idx_students_org_id ON students(class_id);
 CREATE INDEX idx_students_composite ON students(user_id, class_id);
+CREATE INDEX idx_classes_owner_created ON classes(owner_id, created_at DESC, id DESC);
+CREATE INDEX idx_students_class_created ON students(class_id, created_at DESC, id DESC);
+CREATE INDEX idx_students_user_created ON students(user_id, created_at DESC, id DESC);
 
 -- Course & Module Navigation
 CREATE INDEX idx_modules_course_id ON modules(course_id);
@@ -220,20 +354,39 @@ CREATE INDEX idx_assignments_student_id ON assignments(student_id);
 CREATE INDEX idx_assignments_access_token ON assignments(access_token);
 CREATE INDEX idx_assignments_status ON assignments(status);
 CREATE INDEX idx_assignments_test_date ON assignments(test_date);
+CREATE INDEX idx_assignments_completed_at ON assignments(completed_at) WHERE completed_at IS NOT NULL;  -- certificate issuer
 CREATE INDEX idx_assignments_composite ON assignments(student_id, status, test_date);
+CREATE INDEX idx_assignments_due ON assignments(test_date, id) WHERE status = 'pending';  -- delivery worker queue
+CREATE UNIQUE INDEX uq_assignments_open ON assignments(student_id, question_mc_id) WHERE status IN ('pending', 'sent');  -- one open assignment per student and question
+CREATE INDEX idx_assignments_active_expiration ON assignments(expiration_date, id) WHERE status IN ('pending', 'sent');  -- expiry job
 
 -- Progress Tracking
 CREATE INDEX idx_assignment_visits_assignment_id ON assignment_visits(assignment_id);
 CREATE INDEX idx_assignment_attempts_visit_id ON assignment_attempts(assignment_visit_id);
+CREATE INDEX idx_answer_option_correctness_option_id ON answer_option_correctness(answer_option_id);
 CREATE INDEX idx_enrollments_composite ON enrollments(class_id, course_id);
 
 -- Certificate Management
 CREATE INDEX idx_certificates_access_token ON certificates(access_token);
 CREATE INDEX idx_certificates_validity ON certificates(student_id, course_id, valid_until);
+CREATE INDEX idx_certificates_created_at ON certificates(created_at);  -- incremental verification index refresh
+
+-- Progress rollups
+CREATE INDEX idx_student_progress_class ON student_progress(class_id, student_id);
 
 -- Credits System
 CREATE INDEX idx_credits_user_id ON credits(user_id);
 
+-- Maintenance
+CREATE INDEX idx_maintenance_runs_job ON maintenance_runs(job, started_at DESC);
+
+-- Email Outbox (only undelivered messages)
+CREATE INDEX idx_email_outbox_due ON email_outbox(next_attempt_at, id) WHERE status IN ('pending', 'sending');
+CREATE INDEX idx_email_outbox_recipient ON email_outbox(to_address, created_at);  -- invitation re-send throttle
+
+-- Media derivative worker queue
+CREATE INDEX idx_media_derivatives_due ON media(id) WHERE derivatives_status IN ('pending', 'processing');
+
 -- Page Navigation & Content Structure
 CREATE INDEX idx_module_pages_sequence ON module_pages(module_id, sequence_number);
 CREATE INDEX idx_modules_sequence ON modules(course_id, sequence_number);
@@ -251,12 +404,11 @@ CREATE OR REPLACE VIEW user_available_credits AS
 SELECT 
     u.id AS user_id,
     u.email,
-    COALESCE(SUM(c.amount), 0) AS available_credits,
-    COUNT(c.id) AS total_transactions,
-    MAX(c.created_at) AS last_transaction_date
+    COALESCE(b.balance, 0) AS available_credits,
+    COALESCE(b.total_transactions, 0) AS total_transactions,
+    b.last_transaction_date
 FROM users u
-LEFT JOIN credits c ON u.id = c.user_id
-GROUP BY u.id, u.email;
+LEFT JOIN credit_balances b ON u.id = b.user_id;
 
 
 
@@ -265,63 +417,661 @@ GROUP BY u.id, u.email;
 
 
 -- Update assignment status to 'completed' only when the correct answer is given
+-- Runs once per statement, so a batch of attempts costs a single UPDATE
 CREATE OR REPLACE FUNCTION update_assignment_completion()
 RETURNS TRIGGER AS $$
 BEGIN
-    -- If answer is correct
-    IF EXISTS (
-        SELECT 1 
-        FROM answer_option_correctness 
-        WHERE answer_option_id = NEW.answer_option_id
-    ) THEN
-        -- Mark assignment completed
-        UPDATE assignments 
-        SET status = 'completed'
-        WHERE id = (
-            SELECT assignment_id 
-            FROM assignment_visits 
-            WHERE id = NEW.assignment_visit_id
-        );
-    END IF;
-    RETURN NEW;
+    -- Mark assignments with a correct answer in this batch completed
+    UPDATE assignments a
+    SET status = 'completed', completed_at = now()
+    FROM new_attempts na
+    JOIN assignment_visits v ON v.id = na.assignment_visit_id
+    JOIN answer_option_correctness c ON c.answer_option_id = na.answer_option_id
+    WHERE a.id = v.assignment_id
+    AND a.status IS DISTINCT FROM 'completed';
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
 CREATE TRIGGER after_assignment_attempt
 AFTER INSERT ON assignment_attempts
-FOR EACH ROW
+REFERENCING NEW TABLE AS new_attempts
+FOR EACH STATEMENT
 EXECUTE FUNCTION update_assignment_completion();
 
 
 
+-- Apply every credits ledger row to the user's running balance
+-- The row lock taken by the UPDATE serializes concurrent purchases and deductions for a user,
+-- and the no_overdraft check constraint aborts the insert if the balance would drop below zero
+CREATE OR REPLACE FUNCTION apply_credit_transaction()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.user_id IS NULL THEN
+        RETURN NEW;
+    END IF;
+
+    INSERT INTO credit_balances (user_id)
+    VALUES (NEW.user_id)
+    ON CONFLICT (user_id) DO NOTHING;
+
+    UPDATE credit_balances
+    SET balance = balance + NEW.amount,
+        total_transactions = total_transactions + 1,
+        last_transaction_date = GREATEST(last_transaction_date, NEW.created_at),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE user_id = NEW.user_id;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER after_credit_insert
+AFTER INSERT ON credits
+FOR EACH ROW
+EXECUTE FUNCTION apply_credit_transaction();
+
+
+
+-- Drop rendered html when the markdown it was made from changes or its row is deleted
+-- TG_ARGV[0] is the markdown column of the table the trigger is on
+CREATE OR REPLACE FUNCTION invalidate_rendered_markdown()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM rendered_markdown
+    WHERE source_table = TG_TABLE_NAME
+    AND source_id = OLD.id
+    AND field = TG_ARGV[0];
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER after_course_description_change
+AFTER UPDATE OF description OR DELETE ON courses
+FOR EACH ROW
+EXECUTE FUNCTION invalidate_rendered_markdown('description');
+
+CREATE TRIGGER after_module_description_change
+AFTER UPDATE OF description OR DELETE ON modules
+FOR EACH ROW
+EXECUTE FUNCTION invalidate_rendered_markdown('description');
+
+CREATE TRIGGER after_module_page_description_change
+AFTER UPDATE OF description OR DELETE ON module_pages
+FOR EACH ROW
+EXECUTE FUNCTION invalidate_rendered_markdown('description');
+
+CREATE TRIGGER after_question_context_change
+AFTER UPDATE OF context OR DELETE ON questions_mc
+FOR EACH ROW
+EXECUTE FUNCTION invalidate_rendered_markdown('context');
+
+
+
+-- One change to the progress counters, produced by the track_*_progress triggers
+-- sign is +1 for a new assignment with this status, -1 for one that left it and 0 for visits and attempts
+CREATE TYPE progress_delta AS (
+    student_id INT,
+    question_mc_id INT,
+    status VARCHAR(20),
+    sign INT,
+    visits INT,
+    attempts INT,
+    correct_attempts INT,
+    activity_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Deltas summed per student and course, with the student's class
+CREATE OR REPLACE FUNCTION aggregate_progress_deltas(deltas progress_delta[])
+RETURNS TABLE (
+    student_id INT,
+    class_id INT,
+    course_id INT,
+    assignments_total BIGINT,
+    assignments_pending BIGINT,
+    assignments_sent BIGINT,
+    assignments_completed BIGINT,
+    assignments_expired BIGINT,
+    visits BIGINT,
+    attempts BIGINT,
+    correct_attempts BIGINT,
+    last_activity_at TIMESTAMP WITH TIME ZONE
+) AS $$
+    SELECT
+        d.student_id,
+        -- the student_progress copy covers assignments removed together with their student
+        COALESCE(s.class_id, (SELECT sp.class_id FROM student_progress sp WHERE sp.student_id = d.student_id LIMIT 1)) AS class_id,
+        m.course_id,
+        COALESCE(SUM(d.sign), 0) AS assignments_total,
+        COALESCE(SUM(d.sign) FILTER (WHERE d.status = 'pending'), 0) AS assignments_pending,
+        COALESCE(SUM(d.sign) FILTER (WHERE d.status = 'sent'), 0) AS assignments_sent,
+        COALESCE(SUM(d.sign) FILTER (WHERE d.status = 'completed'), 0) AS assignments_completed,
+        COALESCE(SUM(d.sign) FILTER (WHERE d.status = 'expired'), 0) AS assignments_expired,
+        SUM(d.visits) AS visits,
+        SUM(d.attempts) AS attempts,
+        SUM(d.correct_attempts) AS correct_attempts,
+        MAX(d.activity_at) AS last_activity_at
+    FROM unnest(deltas) d
+    JOIN questions_mc q ON q.id = d.question_mc_id
+    JOIN module_pages p ON p.id = q.module_page_id
+    JOIN modules m ON m.id = p.module_id
+    LEFT JOIN students s ON s.id = d.student_id
+    GROUP BY d.student_id, s.class_id, m.course_id;
+$$ LANGUAGE sql STABLE;
+
+-- Add a batch of deltas to student_progress, class_progress and course_progress.
+-- Answer flushes, delivery batches and expiry chunks update the same class and course rows
+-- concurrently. Each upsert takes its row locks in key order, and the tables are always
+-- updated in the same order, so two batches never wait on each other in a cycle.
+CREATE OR REPLACE FUNCTION apply_progress_deltas(deltas progress_delta[])
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO student_progress AS t (
+        student_id, course_id, class_id,
+        assignments_total, assignments_pending, assignments_sent, assignments_completed, assignments_expired,
+        visits, attempts, correct_attempts, last_activity_at
+    )
+    SELECT
+        d.student_id, d.course_id, d.class_id,
+        d.assignments_total, d.assignments_pending, d.assignments_sent, d.assignments_completed, d.assignments_expired,
+        d.visits, d.attempts, d.correct_attempts, d.last_activity_at
+    FROM aggregate_progress_deltas(deltas) d
+    WHERE d.class_id IS NOT NULL
+    ORDER BY d.student_id, d.course_id
+    ON CONFLICT (student_id, course_id) DO UPDATE
+        SET assignments_total = t.assignments_total + EXCLUDED.assignments_total,
+            assignments_pending = t.assignments_pending + EXCLUDED.assignments_pending,
+            assignments_sent = t.assignments_sent + EXCLUDED.assignments_sent,
+            assignments_completed = t.assignments_completed + EXCLUDED.assignments_completed,
+            assignments_expired = t.assignments_expired + EXCLUDED.assignments_expired,
+            visits = t.visits + EXCLUDED.visits,
+            attempts = t.attempts + EXCLUDED.attempts,
+            correct_attempts = t.correct_attempts + EXCLUDED.correct_attempts,
+            last_activity_at = GREATEST(t.last_activity_at, EXCLUDED.last_activity_at),
+            updated_at = CURRENT_TIMESTAMP;
+
+    INSERT INTO class_progress AS t (
+        class_id, course_id,
+        assignments_total, assignments_pending, assignments_sent, assignments_completed, assignments_expired,
+        visits, attempts, correct_attempts, last_activity_at
+    )
+    SELECT
+        d.class_id, d.course_id,
+        SUM(d.assignments_total), SUM(d.assignments_pending), SUM(d.assignments_sent), SUM(d.assignments_completed), SUM(d.assignments_expired),
+        SUM(d.visits), SUM(d.attempts), SUM(d.correct_attempts), MAX(d.last_activity_at)
+    FROM aggregate_progress_deltas(deltas) d
+    WHERE d.class_id IS NOT NULL
+    GROUP BY d.class_id, d.course_id
+    ORDER BY d.class_id, d.course_id
+    ON CONFLICT (class_id, course_id) DO UPDATE
+        SET assignments_total = t.assignments_total + EXCLUDED.assignments_total,
+            assignments_pending = t.assignments_pending + EXCLUDED.assignments_pending,
+            assignments_sent = t.assignments_sent + EXCLUDED.assignments_sent,
+            assignments_completed = t.assignments_completed + EXCLUDED.assignments_completed,
+            assignments_expired = t.assignments_expired + EXCLUDED.assignments_expired,
+            visits = t.visits + EXCLUDED.visits,
+            attempts = t.attempts + EXCLUDED.attempts,
+            correct_attempts = t.correct_attempts + EXCLUDED.correct_attempts,
+            last_activity_at = GREATEST(t.last_activity_at, EXCLUDED.last_activity_at),
+            updated_at = CURRENT_TIMESTAMP;
+
+    INSERT INTO course_progress AS t (
+        course_id,
+        assignments_total, assignments_pending, assignments_sent, assignments_completed, assignments_expired,
+        visits, attempts, correct_attempts, last_activity_at
+    )
+    SELECT
+        d.course_id,
+        SUM(d.assignments_total), SUM(d.assignments_pending), SUM(d.assignments_sent), SUM(d.assignments_completed), SUM(d.assignments_expired),
+        SUM(d.visits), SUM(d.attempts), SUM(d.correct_attempts), MAX(d.last_activity_at)
+    FROM aggregate_progress_deltas(deltas) d
+    WHERE d.class_id IS NOT NULL
+    GROUP BY d.course_id
+    ORDER BY d.course_id
+    ON CONFLICT (course_id) DO UPDATE
+        SET assignments_total = t.assignments_total + EXCLUDED.assignments_total,
+            assignments_pending = t.assignments_pending + EXCLUDED.assignments_pending,
+            assignments_sent = t.assignments_sent + EXCLUDED.assignments_sent,
+            assignments_completed = t.assignments_completed + EXCLUDED.assignments_completed,
+            assignments_expired = t.assignments_expired + EXCLUDED.assignments_expired,
+            visits = t.visits + EXCLUDED.visits,
+            attempts = t.attempts + EXCLUDED.attempts,
+            correct_attempts = t.correct_attempts + EXCLUDED.correct_attempts,
+            last_activity_at = GREATEST(t.last_activity_at, EXCLUDED.last_activity_at),
+            updated_at = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Assignment counters per status
+-- Transition tables can't be shared between events, so INSERT, UPDATE and DELETE each get a trigger
+CREATE OR REPLACE FUNCTION track_assignment_progress()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM apply_progress_deltas(ARRAY(
+            SELECT ROW(n.student_id, n.question_mc_id, n.status, 1, 0, 0, 0, NULL)::progress_delta
+            FROM new_assignments n
+        ));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM apply_progress_deltas(ARRAY(
+            SELECT ROW(o.student_id, o.question_mc_id, o.status, -1, 0, 0, 0, NULL)::progress_delta
+            FROM old_assignments o
+        ));
+    ELSE
+        -- Only status changes move counters, a changed row leaves its old status and enters the new one
+        PERFORM apply_progress_deltas(ARRAY(
+            SELECT ROW(n.student_id, n.question_mc_id, n.status, 1, 0, 0, 0, NULL)::progress_delta
+            FROM new_assignments n
+            JOIN old_assignments o ON o.id = n.id
+            WHERE o.status IS DISTINCT FROM n.status
+            UNION ALL
+            SELECT ROW(o.student_id, o.question_mc_id, o.status, -1, 0, 0, 0, NULL)::progress_delta
+            FROM new_assignments n
+            JOIN old_assignments o ON o.id = n.id
+            WHERE o.status IS DISTINCT FROM n.status
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER track_assignment_insert_progress
+AFTER INSERT ON assignments
+REFERENCING NEW TABLE AS new_assignments
+FOR EACH STATEMENT
+EXECUTE FUNCTION track_assignment_progress();
+
+CREATE TRIGGER track_assignment_update_progress
+AFTER UPDATE ON assignments
+REFERENCING OLD TABLE AS old_assignments NEW TABLE AS new_assignments
+FOR EACH STATEMENT
+EXECUTE FUNCTION track_assignment_progress();
+
+CREATE TRIGGER track_assignment_delete_progress
+AFTER DELETE ON assignments
+REFERENCING OLD TABLE AS old_assignments
+FOR EACH STATEMENT
+EXECUTE FUNCTION track_assignment_progress();
+
+-- Visit counters
+CREATE OR REPLACE FUNCTION track_visit_progress()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM apply_progress_deltas(ARRAY(
+        SELECT ROW(a.student_id, a.question_mc_id, NULL, 0, 1, 0, 0, v.created_at)::progress_delta
+        FROM new_visits v
+        JOIN assignments a ON a.id = v.assignment_id
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER track_visit_progress
+AFTER INSERT ON assignment_visits
+REFERENCING NEW TABLE AS new_visits
+FOR EACH STATEMENT
+EXECUTE FUNCTION track_visit_progress();
+
+-- Attempt counters
+CREATE OR REPLACE FUNCTION track_attempt_progress()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM apply_progress_deltas(ARRAY(
+        SELECT ROW(a.student_id, a.question_mc_id, NULL, 0, 0, 1, (c.id IS NOT NULL)::int, na.created_at)::progress_delta
+        FROM new_attempts na
+        JOIN assignment_visits v ON v.id = na.assignment_visit_id
+        JOIN assignments a ON a.id = v.assignment_id
+        LEFT JOIN answer_option_correctness c ON c.answer_option_id = na.answer_option_id
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER track_attempt_progress
+AFTER INSERT ON assignment_attempts
+REFERENCING NEW TABLE AS new_attempts
+FOR EACH STATEMENT
+EXECUTE FUNCTION track_attempt_progress();
+
+-- Removing students takes their remaining counters out of the class and course rollups
+CREATE OR REPLACE FUNCTION track_student_removal()
+RETURNS TRIGGER AS $$
+BEGIN
+    WITH removed AS (
+        DELETE FROM student_progress sp
+        USING old_students o
+        WHERE sp.student_id = o.id
+        RETURNING sp.*
+    ),
+    classes_done AS (
+        UPDATE class_progress t
+        SET assignments_total = t.assignments_total - r.assignments_total,
+            assignments_pending = t.assignments_pending - r.assignments_pending,
+            assignments_sent = t.assignments_sent - r.assignments_sent,
+            assignments_completed = t.assignments_completed - r.assignments_completed,
+            assignments_expired = t.assignments_expired - r.assignments_expired,
+            visits = t.visits - r.visits,
+            attempts = t.attempts - r.attempts,
+            correct_attempts = t.correct_attempts - r.correct_attempts,
+            updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT class_id, course_id,
+                SUM(assignments_total) AS assignments_total, SUM(assignments_pending) AS assignments_pending,
+                SUM(assignments_sent) AS assignments_sent, SUM(assignments_completed) AS assignments_completed,
+                SUM(assignments_expired) AS assignments_expired, SUM(visits) AS visits,
+                SUM(attempts) AS attempts, SUM(correct_attempts) AS correct_attempts
+            FROM removed
+            GROUP BY class_id, course_id
+        ) r
+        WHERE t.class_id = r.class_id AND t.course_id = r.course_id
+    )
+    UPDATE course_progress t
+    SET assignments_total = t.assignments_total - r.assignments_total,
+        assignments_pending = t.assignments_pending - r.assignments_pending,
+        assignments_sent = t.assignments_sent - r.assignments_sent,
+        assignments_completed = t.assignments_completed - r.assignments_completed,
+        assignments_expired = t.assignments_expired - r.assignments_expired,
+        visits = t.visits - r.visits,
+        attempts = t.attempts - r.attempts,
+        correct_attempts = t.correct_attempts - r.correct_attempts,
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT course_id,
+            SUM(assignments_total) AS assignments_total, SUM(assignments_pending) AS assignments_pending,
+            SUM(assignments_sent) AS assignments_sent, SUM(assignments_completed) AS assignments_completed,
+            SUM(assignments_expired) AS assignments_expired, SUM(visits) AS visits,
+            SUM(attempts) AS attempts, SUM(correct_attempts) AS correct_attempts
+        FROM removed
+        GROUP BY course_id
+    ) r
+    WHERE t.course_id = r.course_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER track_student_removal
+AFTER DELETE ON students
+REFERENCING OLD TABLE AS old_students
+FOR EACH STATEMENT
+EXECUTE FUNCTION track_student_removal();
+
+-- Recompute all rollups from scratch with plain aggregates, fine for tables of any size
+-- Only needed after bulk loads with triggers disabled, and after content deletes:
+-- assignments removed together with their question can't be mapped to a course by the triggers
+CREATE OR REPLACE FUNCTION rebuild_progress()
+RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE student_progress, class_progress, course_progress IN EXCLUSIVE MODE;
+    TRUNCATE student_progress, class_progress, course_progress;
+
+    INSERT INTO student_progress (
+        student_id, course_id, class_id,
+        assignments_total, assignments_pending, assignments_sent, assignments_completed, assignments_expired,
+        visits, attempts, correct_attempts, last_activity_at
+    )
+    SELECT
+        a.student_id,
+        m.course_id,
+        s.class_id,
+        COUNT(*),
+        COUNT(*) FILTER (WHERE a.status = 'pending'),
+        COUNT(*) FILTER (WHERE a.status = 'sent'),
+        COUNT(*) FILTER (WHERE a.status = 'completed'),
+        COUNT(*) FILTER (WHERE a.status = 'expired'),
+        COALESCE(SUM(act.visits), 0),
+        COALESCE(SUM(act.attempts), 0),
+        COALESCE(SUM(act.correct_attempts), 0),
+        MAX(act.last_activity_at)
+    FROM assignments a
+    JOIN students s ON s.id = a.student_id
+    JOIN questions_mc q ON q.id = a.question_mc_id
+    JOIN module_pages p ON p.id = q.module_page_id
+    JOIN modules m ON m.id = p.module_id
+    LEFT JOIN (
+        SELECT
+            v.assignment_id,
+            COUNT(DISTINCT v.id) AS visits,
+            COUNT(na.id) AS attempts,
+            COUNT(c.id) AS correct_attempts,
+            GREATEST(MAX(v.created_at), MAX(na.created_at)) AS last_activity_at
+        FROM assignment_visits v
+        LEFT JOIN assignment_attempts na ON na.assignment_visit_id = v.id
+        LEFT JOIN answer_option_correctness c ON c.answer_option_id = na.answer_option_id
+        GROUP BY v.assignment_id
+    ) act ON act.assignment_id = a.id
+    GROUP BY a.student_id, m.course_id, s.class_id;
+
+    INSERT INTO class_progress (
+        class_id, course_id,
+        assignments_total, assignments_pending, assignments_sent, assignments_completed, assignments_expired,
+        visits, attempts, correct_attempts, last_activity_at
+    )
+    SELECT
+        class_id, course_id,
+        SUM(assignments_total), SUM(assignments_pending), SUM(assignments_sent), SUM(assignments_completed), SUM(assignments_expired),
+        SUM(visits), SUM(attempts), SUM(correct_attempts), MAX(last_activity_at)
+    FROM student_progress
+    GROUP BY class_id, course_id;
+
+    INSERT INTO course_progress (
+        course_id,
+        assignments_total, assignments_pending, assignments_sent, assignments_completed, assignments_expired,
+        visits, attempts, correct_attempts, last_activity_at
+    )
+    SELECT
+        course_id,
+        SUM(assignments_total), SUM(assignments_pending), SUM(assignments_sent), SUM(assignments_completed), SUM(assignments_expired),
+        SUM(visits), SUM(attempts), SUM(correct_attempts), MAX(last_activity_at)
+    FROM student_progress
+    GROUP BY course_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+
 -------- CRON FUNCTIONS
 
 
 
--- Function to update expired assignments
-CREATE OR REPLACE FUNCTION update_expired_assignments()
-RETURNS void AS $$
+-- Run one maintenance job chunk by chunk, committing after every chunk so row locks stay short
+-- Rows that are done drop out of the job's partial index, so an interrupted run simply continues next time
+CREATE OR REPLACE PROCEDURE run_maintenance_job(job_name TEXT)
+LANGUAGE plpgsql AS $$
+DECLARE
+    settings maintenance_jobs%ROWTYPE;
+    run_id INT;
+    run_started TIMESTAMP WITH TIME ZONE := clock_timestamp();
+    rows_done BIGINT := 0;
+    chunk_count INT := 0;
+    chunk_rows INT;
+    current_lag INTERVAL;
 BEGIN
-    UPDATE assignments 
+    SELECT * INTO settings FROM maintenance_jobs WHERE name = job_name;
+    IF NOT FOUND OR NOT settings.enabled THEN
+        RETURN;
+    END IF;
+
+    -- Session level lock, it has to survive the commits below
+    IF NOT pg_try_advisory_lock(hashtext('maintenance:' || job_name)) THEN
+        RAISE NOTICE 'Maintenance job % is already running', job_name;
+        RETURN;
+    END IF;
+
+    INSERT INTO maintenance_runs (job) VALUES (job_name) RETURNING id INTO run_id;
+    COMMIT;
+
+    LOOP
+        EXECUTE format('SELECT %I($1)', settings.chunk_function) INTO chunk_rows USING settings.batch_size;
+        rows_done := rows_done + chunk_rows;
+        chunk_count := chunk_count + 1;
+
+        UPDATE maintenance_runs
+        SET rows_processed = rows_done,
+            chunks = chunk_count
+        WHERE id = run_id;
+        COMMIT;
+
+        EXIT WHEN chunk_rows < settings.batch_size
+            OR clock_timestamp() - run_started > settings.max_runtime;
+    END LOOP;
+
+    IF settings.lag_function IS NOT NULL THEN
+        EXECUTE format('SELECT %I()', settings.lag_function) INTO current_lag;
+    END IF;
+
+    UPDATE maintenance_runs
+    SET finished_at = clock_timestamp(),
+        rows_per_second = round(rows_done / GREATEST(EXTRACT(EPOCH FROM clock_timestamp() - run_started), 0.001), 1),
+        lag = current_lag,
+        caught_up = chunk_rows < settings.batch_size
+    WHERE id = run_id;
+    COMMIT;
+
+    PERFORM pg_advisory_unlock(hashtext('maintenance:' || job_name));
+END;
+$$;
+
+CREATE OR REPLACE PROCEDURE run_maintenance_jobs()
+LANGUAGE plpgsql AS $$
+DECLARE
+    job_names TEXT[];
+    job_name TEXT;
+BEGIN
+    SELECT array_agg(name ORDER BY name) INTO job_names FROM maintenance_jobs WHERE enabled;
+    FOREACH job_name IN ARRAY COALESCE(job_names, '{}') LOOP
+        CALL run_maintenance_job(job_name);
+    END LOOP;
+END;
+$$;
+
+-- Latest run of every maintenance job
+CREATE OR REPLACE VIEW maintenance_status AS
+SELECT DISTINCT ON (j.name)
+    j.name AS job,
+    j.enabled,
+    r.started_at,
+    r.finished_at,
+    r.rows_processed,
+    r.chunks,
+    r.rows_per_second,
+    r.lag,
+    r.caught_up
+FROM maintenance_jobs j
+LEFT JOIN maintenance_runs r ON r.job = j.name
+ORDER BY j.name, r.started_at DESC;
+
+-- Expire one chunk of open assignments past their expiration date
+CREATE OR REPLACE FUNCTION expire_assignments_chunk(batch_size INT)
+RETURNS INT AS $$
+DECLARE
+    expired INT;
+BEGIN
+    WITH batch AS (
+        SELECT id FROM assignments
+        WHERE status IN ('pending', 'sent')
+        AND expiration_date < CURRENT_DATE
+        ORDER BY expiration_date, id
+        LIMIT batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE assignments a
     SET status = 'expired'
-    WHERE expiration_date < CURRENT_DATE 
-    AND status != 'expired'
-    AND status != 'completed';
+    FROM batch
+    WHERE a.id = batch.id;
+
+    GET DIAGNOSTICS expired = ROW_COUNT;
+    RETURN expired;
+END;
+$$ LANGUAGE plpgsql;
+
+-- How long the oldest assignment that should have expired has been waiting
+CREATE OR REPLACE FUNCTION expire_assignments_lag()
+RETURNS INTERVAL AS $$
+    SELECT COALESCE((CURRENT_DATE - MIN(expiration_date)) * INTERVAL '1 day', INTERVAL '0')
+    FROM assignments
+    WHERE status IN ('pending', 'sent')
+    AND expiration_date < CURRENT_DATE;
+$$ LANGUAGE sql STABLE;
+
+-- Compare credit_balances with the credits ledger and return every user whose balance is off
+-- With fix = true the balances are rewritten from the ledger, new credits are blocked while that happens
+CREATE OR REPLACE FUNCTION reconcile_credit_balances(fix BOOLEAN DEFAULT false)
+RETURNS TABLE (user_id INTEGER, recorded_balance INT, ledger_balance INT) AS $$
+#variable_conflict use_column
+BEGIN
+    IF fix THEN
+        LOCK TABLE credits IN SHARE MODE;
+    END IF;
+
+    CREATE TEMPORARY TABLE credit_ledger_totals AS
+    SELECT 
+        c.user_id,
+        SUM(c.amount)::INT AS balance,
+        COUNT(*)::INT AS total_transactions,
+        MAX(c.created_at) AS last_transaction_date
+    FROM credits c
+    WHERE c.user_id IS NOT NULL
+    GROUP BY c.user_id;
+
+    RETURN QUERY
+    SELECT 
+        COALESCE(l.user_id, b.user_id),
+        b.balance,
+        COALESCE(l.balance, 0)
+    FROM credit_ledger_totals l
+    FULL JOIN credit_balances b ON b.user_id = l.user_id
+    WHERE COALESCE(b.balance, 0) <> COALESCE(l.balance, 0)
+    OR COALESCE(b.total_transactions, 0) <> COALESCE(l.total_transactions, 0);
+
+    IF fix THEN
+        INSERT INTO credit_balances (user_id, balance, total_transactions, last_transaction_date)
+        SELECT l.user_id, l.balance, l.total_transactions, l.last_transaction_date
+        FROM credit_ledger_totals l
+        ON CONFLICT (user_id) DO UPDATE
+        SET balance = EXCLUDED.balance,
+            total_transactions = EXCLUDED.total_transactions,
+            last_transaction_date = EXCLUDED.last_transaction_date,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE credit_balances.balance <> EXCLUDED.balance
+        OR credit_balances.total_transactions <> EXCLUDED.total_transactions;
+
+        UPDATE credit_balances b
+        SET balance = 0,
+            total_transactions = 0,
+            last_transaction_date = NULL,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE NOT EXISTS (SELECT 1 FROM credit_ledger_totals l WHERE l.user_id = b.user_id)
+        AND (b.balance <> 0 OR b.total_transactions <> 0);
+    END IF;
+
+    DROP TABLE credit_ledger_totals;
 END;
 $$ LANGUAGE plpgsql;
 
 CREATE OR REPLACE FUNCTION daily_maintenance()
 RETURNS void AS $$
+DECLARE
+    mismatches INT;
 BEGIN
     
-    -- Update expired assignments
-    PERFORM update_expired_assignments();
+    -- Verify the running credit balances against the ledger, fixing is left to an operator
+    SELECT COUNT(*) INTO mismatches FROM reconcile_credit_balances();
+    IF mismatches > 0 THEN
+        RAISE WARNING '% credit balance(s) do not match the credits ledger, run SELECT * FROM reconcile_credit_balances(true) to repair', mismatches;
+    END IF;
 
 END;
 $$ LANGUAGE plpgsql;
 
+-- Register chunked maintenance jobs
+INSERT INTO maintenance_jobs (name, chunk_function, lag_function, batch_size) VALUES
+('expire_assignments', 'expire_assignments_chunk', 'expire_assignments_lag', 5000);
+
 -- Schedule daily maintenance
 SELECT cron.schedule('0 0 * * *', $$SELECT daily_maintenance()$$);
 
+-- Chunked jobs run often and only do a bounded amount of work per run
+SELECT cron.schedule('*/15 * * * *', $$CALL run_maintenance_jobs()$$);
+
 
 
@@ -0,0 +1,66 @@
+#!/bin/bash
+
+# Start the stack with a fake SMTP server and run the load test against it.
+# Results are written to benchmarks/results/<time>-<commit>.json.
+#
+# Usage: scripts/bench.sh [--baseline FILE] [--keep-running] [loadtest run options...]
+#   e.g. scripts/bench.sh --baseline benchmarks/results/baseline.json --users 50 --iterations 20
+
+set -euo pipefail
+
+CURRENT_UID=$(id -u)
+CURRENT_GID=$(id -g)
+export CURRENT_UID CURRENT_GID
+
+source .env
+
+COMPOSE="docker compose -f docker-compose.yml -f docker-compose.bench.yml"
+API_URL=${BENCH_API_URL:-http://localhost:8000}
+
+BASELINE=""
+KEEP_RUNNING=false
+LOADTEST_ARGS=()
+while [[ $# -gt 0 ]]; do
+    case $1 in
+        --baseline)
+            BASELINE=$2
+            shift 2
+            ;;
+        --keep-running)
+            KEEP_RUNNING=true
+            shift
+            ;;
+        *)
+            LOADTEST_ARGS+=("$1")
+            shift
+            ;;
+    esac
+done
+
+echo "Starting benchmark stack..."
+$COMPOSE up -d --build
+
+echo "Waiting for the API..."
+for _ in $(seq 1 60); do
+    if curl -sf "$API_URL/health" > /dev/null; then
+        break
+    fi
+    sleep 2
+done
+curl -sf "$API_URL/health" > /dev/null || { echo "API did not become healthy"; exit 1; }
+
+mkdir -p benchmarks/results
+OUTPUT="benchmarks/results/$(date +%Y%m%d-%H%M%S)-$(git rev-parse --short HEAD).json"
+
+STATUS=0
+python benchmarks/loadtest.py run --base-url "$API_URL" --output "$OUTPUT" ${LOADTEST_ARGS[@]+"${LOADTEST_ARGS[@]}"} || STATUS=$?
+
+if [ -n "$BASELINE" ]; then
+    python benchmarks/loadtest.py compare "$BASELINE" "$OUTPUT" || STATUS=$?
+fi
+
+if [ "$KEEP_RUNNING" = false ]; then
+    $COMPOSE down
+fi
+
+exit $STATUS